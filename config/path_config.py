@@ -17,6 +17,8 @@ KB_DIR = PROJECT_ROOT / "kb"
 KB_LIST_DIR = KB_DIR / "kb_list"
 KB_SAVE_PATH_DIR = KB_DIR / "save_path"
 KB_PARSE_RESULT_DIR = KB_DIR / "parse_result"
+# embedding 缓存目录（所有知识库共用）
+EMBEDDING_CACHE_DIR = KB_DIR / "embedding_cache"
 
 # 知识库具体路径
 PRIVATE_KB_DIR = KB_LIST_DIR / "private_kb"
@@ -117,6 +119,7 @@ def init_directories():
         KB_LIST_DIR,
         KB_SAVE_PATH_DIR,
         KB_PARSE_RESULT_DIR,
+        EMBEDDING_CACHE_DIR,
         EVALUATION_DIR,
         EVALUATION_RESULTS_DIR,
         DB_DIR,
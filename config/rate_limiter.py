@@ -0,0 +1,520 @@
+"""
+智谱 API 的全局限流（令牌桶）和并发控制
+
+embedding（入库 + 查询）、对话 llm、rerank 共用同一个账号的配额，各自乱发请求时会先撞一波 429，
+然后一起退避空转。这里每个接口一个 RateLimiter，同一进程里所有调用方共用；
+入库 CLI 和各个 uvicorn worker 是不同的进程，配额默认存在 sqlite 文件里（shared_state_path），
+同一台机器上的进程共用一份，而不是每个进程各拿一份完整配额：
+
+- 两个令牌桶：每秒请求数（requests_per_s，容量 burst）和每分钟 token 数（tokens_per_min）
+- max_concurrency 限制同时在途的请求数（用 limit / alimit 时生效）
+- 等待的请求按优先级排队：INTERACTIVE（在线对话、查询 embedding、rerank）先于 BATCH（入库 embedding），
+  等待超过 aging_s 的 BATCH 请求提升为 INTERACTIVE，入库任务不会被在线流量饿死；
+  跨进程时，有进程在排队等 INTERACTIVE 请求，其他进程的 BATCH 请求先让路
+- 同步 acquire 和异步 aacquire 共用同一个队列
+- metrics() 返回排队深度、平均等待时间等，/api/memory 里可以看到
+
+调用前不知道实际 token 数（对话的输出长度）时先按估计值扣，调用后用 settle 补差
+"""
+import asyncio
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+from langchain_core.rate_limiters import BaseRateLimiter
+
+from config.path_config import DB_DIR
+from config.token_utils import count_tokens
+
+INTERACTIVE = 0
+BATCH = 1
+_priority_names = {INTERACTIVE: 'interactive', BATCH: 'batch'}
+
+# 各接口的默认配额，可以用环境变量覆盖，如 ZHIPU_EMBEDDING_RPS / ZHIPU_CHAT_TPM / ZHIPU_RERANK_CONCURRENCY
+default_limits = {
+    'embedding': {'requests_per_s': 10, 'tokens_per_min': 1_000_000, 'max_concurrency': 8},
+    'chat': {'requests_per_s': 5, 'tokens_per_min': 300_000, 'max_concurrency': 8},
+    'rerank': {'requests_per_s': 5, 'tokens_per_min': None, 'max_concurrency': 4},
+}
+# 跨进程共享配额的 sqlite 文件，环境变量 ZHIPU_RATE_LIMIT_DB 设成空字符串时退回每个进程各自限流
+shared_state_path = os.getenv('ZHIPU_RATE_LIMIT_DB', str(DB_DIR / 'rate_limits.sqlite'))
+
+class _Bucket:
+    def __init__(self, rate: float, capacity: float):
+        # rate: 每秒补充的令牌数
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        # 共享配额用的是墙上时间，时钟回拨时不倒扣
+        self.level = min(self.capacity, self.level + max(0.0, now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        # 超过容量的请求（单个超长文本）只要求桶是满的，否则永远等不到
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+
+def _alive(pid: int) -> bool:
+    if os.name == 'nt':
+        # Windows 上 os.kill 会直接结束进程，不做存活检查
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class _LocalQuota:
+    """进程内的配额：请求桶、token 桶和在途请求数"""
+
+    def __init__(self, requests_per_s: float, burst: float, tokens_per_min: Optional[float],
+                 max_concurrency: Optional[int]):
+        self.requests = _Bucket(requests_per_s, burst)
+        self.tokens = _Bucket(tokens_per_min / 60, tokens_per_min) if tokens_per_min else None
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+
+    def _wait_time(self, tokens: int, concurrent: bool, in_flight: int, now: float) -> float:
+        self.requests.refill(now)
+        wait = self.requests.wait_time(1)
+        if self.tokens is not None:
+            self.tokens.refill(now)
+            wait = max(wait, self.tokens.wait_time(tokens))
+        if concurrent and self.max_concurrency and in_flight >= self.max_concurrency:
+            # 等 release 通知
+            wait = max(wait, 0.05)
+        return wait
+
+    def _take(self, tokens: int, concurrent: bool):
+        self.requests.level -= 1
+        if self.tokens is not None:
+            self.tokens.level -= tokens
+        if concurrent:
+            self.in_flight += 1
+
+    def _overdraw(self, tokens: int):
+        self.tokens.level = min(self.tokens.capacity, self.tokens.level - tokens)
+
+    def take(self, tokens: int, concurrent: bool, priority: int) -> float:
+        """配额够时扣掉返回 0，否则返回建议的等待时间"""
+        wait = self._wait_time(tokens, concurrent, self.in_flight, time.monotonic())
+        if wait <= 0:
+            self._take(tokens, concurrent)
+        return wait
+
+    def release(self):
+        self.in_flight -= 1
+
+    def settle(self, tokens: int):
+        self.tokens.refill(time.monotonic())
+        self._overdraw(tokens)
+
+    def set_waiting(self, interactive: int):
+        """本进程排队中的 INTERACTIVE 请求数，只有跨进程共享时有用"""
+
+
+class _SharedQuota(_LocalQuota):
+    """
+    配额存在 sqlite 文件里，同一台机器上的多个进程共用：
+    桶的余量和各进程的在途请求数在 BEGIN IMMEDIATE 事务里读改写，时间用墙上时间；
+    其他进程有排队中的 INTERACTIVE 请求时，本进程的 BATCH 请求（老化前）先让路；
+    进程崩溃后留下的在途 / 排队记录按 pid 是否还活着清理
+    """
+
+    def __init__(self, path, name: str, *args):
+        super().__init__(*args)
+        self.path = str(path)
+        self.name = name
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._waiting = 0
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets '
+                         '(name TEXT PRIMARY KEY, requests REAL, tokens REAL, updated REAL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS procs (name TEXT, pid INTEGER, in_flight INTEGER, '
+                         'interactive INTEGER, PRIMARY KEY (name, pid))')
+
+    @contextmanager
+    def _transaction(self):
+        """调用方持有 RateLimiter 的锁，同一进程里不会并发使用连接"""
+        if self._pid != os.getpid():
+            # fork 出来的子进程不能沿用父进程的连接和计数
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._pid = os.getpid()
+            self.in_flight = 0
+            self._waiting = 0
+        conn = self._conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _load(self, conn: sqlite3.Connection, now: float):
+        row = conn.execute('SELECT requests, tokens, updated FROM buckets WHERE name = ?', (self.name,)).fetchone()
+        if row is None:
+            requests, tokens, updated = self.requests.capacity, None, now
+        else:
+            requests, tokens, updated = row
+        self.requests.level, self.requests.updated = requests, updated
+        self.requests.refill(now)
+        if self.tokens is not None:
+            self.tokens.level = self.tokens.capacity if tokens is None else tokens
+            self.tokens.updated = updated
+            self.tokens.refill(now)
+
+    def _store(self, conn: sqlite3.Connection, now: float):
+        conn.execute('INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?)',
+                     (self.name, self.requests.level, None if self.tokens is None else self.tokens.level, now))
+
+    def _save_proc(self, conn: sqlite3.Connection):
+        conn.execute('INSERT OR REPLACE INTO procs VALUES (?, ?, ?, ?)',
+                     (self.name, self._pid, self.in_flight, self._waiting))
+
+    def _others(self, conn: sqlite3.Connection):
+        """其他进程的 (在途请求数, 排队中的 INTERACTIVE 请求数)，顺便清掉已经退出的进程"""
+        in_flight, interactive = 0, 0
+        rows = conn.execute('SELECT pid, in_flight, interactive FROM procs WHERE name = ? AND pid != ?',
+                            (self.name, self._pid)).fetchall()
+        for pid, n, waiting in rows:
+            if not _alive(pid):
+                conn.execute('DELETE FROM procs WHERE name = ? AND pid = ?', (self.name, pid))
+                continue
+            in_flight += n
+            interactive += waiting
+        return in_flight, interactive
+
+    def take(self, tokens: int, concurrent: bool, priority: int) -> float:
+        with self._transaction() as conn:
+            now = time.time()
+            other_in_flight, other_interactive = self._others(conn)
+            if priority != INTERACTIVE and other_interactive:
+                return 0.05
+            self._load(conn, now)
+            wait = self._wait_time(tokens, concurrent, self.in_flight + other_in_flight, now)
+            if wait > 0:
+                return wait
+            self._take(tokens, concurrent)
+            self._store(conn, now)
+            if concurrent:
+                self._save_proc(conn)
+            return 0.0
+
+    def release(self):
+        with self._transaction() as conn:
+            self.in_flight -= 1
+            self._save_proc(conn)
+
+    def settle(self, tokens: int):
+        with self._transaction() as conn:
+            now = time.time()
+            self._load(conn, now)
+            self._overdraw(tokens)
+            self._store(conn, now)
+
+    def set_waiting(self, interactive: int):
+        if interactive == self._waiting:
+            return
+        with self._transaction() as conn:
+            self._waiting = interactive
+            self._save_proc(conn)
+
+
+class _Waiter:
+    def __init__(self, seq: int, priority: int, tokens: int, concurrent: bool):
+        self.seq = seq
+        self.priority = priority
+        self.tokens = tokens
+        self.concurrent = concurrent
+        self.enqueued = time.monotonic()
+        # 异步等待被取消 / 已经拿到配额，只在 RateLimiter 的锁内读写
+        self.cancelled = False
+        self.granted = False
+
+
+class RateLimiter:
+    def __init__(self, name: str, requests_per_s: float, tokens_per_min: Optional[float] = None,
+                 max_concurrency: Optional[int] = None, burst: Optional[float] = None, aging_s: float = 10.0,
+                 shared_path: Optional[str] = None):
+        """
+        Args:
+            name: 接口名，只用于 metrics
+            requests_per_s: 每秒请求数
+            tokens_per_min: 每分钟 token 数，None 不限
+            max_concurrency: 同时在途请求数，None 不限（只对 limit / alimit 生效）
+            burst: 请求桶容量，默认 requests_per_s（最多攒 1 秒的请求）
+            aging_s: BATCH 请求等待超过这个时间后按 INTERACTIVE 排队
+            shared_path: 跨进程共享配额的 sqlite 文件，None 只在本进程内限流
+        """
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.aging_s = aging_s
+        args = (requests_per_s, burst or max(1.0, requests_per_s), tokens_per_min, max_concurrency)
+        self._quota = _LocalQuota(*args)
+        if shared_path:
+            try:
+                self._quota = _SharedQuota(shared_path, name, *args)
+            except (sqlite3.Error, OSError) as e:
+                print(f'{name} 限流无法使用共享配额 {shared_path}（{e}），只在本进程内限流')
+        self._cond = threading.Condition()
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        self.acquired = {INTERACTIVE: 0, BATCH: 0}
+        self.waited = {INTERACTIVE: 0.0, BATCH: 0.0}
+
+    @property
+    def in_flight(self) -> int:
+        """本进程在途的请求数"""
+        return self._quota.in_flight
+
+    def _publish_waiting(self):
+        self._quota.set_waiting(sum(1 for w in self._waiters if w.priority == INTERACTIVE))
+
+    def _rank(self, waiter: _Waiter, now: float):
+        priority = waiter.priority
+        if priority != INTERACTIVE and now - waiter.enqueued >= self.aging_s:
+            priority = INTERACTIVE
+        return priority, waiter.seq
+
+    def _try_acquire(self, waiter: _Waiter) -> Optional[float]:
+        """在锁内调用：轮到 waiter 且配额够时扣掉配额返回 None，否则返回建议的等待时间"""
+        if waiter.cancelled:
+            return None
+        now = time.monotonic()
+        head = min(self._waiters, key=lambda w: self._rank(w, now))
+        if head is not waiter:
+            return 0.05
+        wait = self._quota.take(waiter.tokens, waiter.concurrent, self._rank(waiter, now)[0])
+        if wait > 0:
+            return wait
+        self._waiters.remove(waiter)
+        waiter.granted = True
+        if waiter.priority == INTERACTIVE:
+            self._publish_waiting()
+        self.acquired[waiter.priority] += 1
+        self.waited[waiter.priority] += now - waiter.enqueued
+        # 队头换了，让下一个等待者重新检查
+        self._cond.notify_all()
+        return None
+
+    def _new_waiter(self, tokens: int, priority: int, concurrent: bool) -> _Waiter:
+        return _Waiter(next(self._seq), priority, tokens, concurrent)
+
+    def _enqueue(self, waiter: _Waiter):
+        """在锁内调用"""
+        if waiter.cancelled:
+            return
+        self._waiters.append(waiter)
+        if waiter.priority == INTERACTIVE:
+            self._publish_waiting()
+
+    def _locked(self, fn, *args):
+        with self._cond:
+            return fn(*args)
+
+    def _abandon(self, waiter: _Waiter):
+        """异步等待被取消：还在排队就出队；取消前工作线程已经替它拿到了并发名额就还回去"""
+        with self._cond:
+            waiter.cancelled = True
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                if waiter.priority == INTERACTIVE:
+                    self._publish_waiting()
+            elif waiter.granted and waiter.concurrent:
+                self._quota.release()
+            self._cond.notify_all()
+
+    def acquire(self, tokens: int = 0, priority: int = INTERACTIVE, _concurrent: bool = False):
+        """阻塞直到拿到 1 个请求配额和 tokens 个 token 配额"""
+        waiter = self._new_waiter(tokens, priority, _concurrent)
+        with self._cond:
+            self._enqueue(waiter)
+            while True:
+                wait = self._try_acquire(waiter)
+                if wait is None:
+                    return
+                self._cond.wait(timeout=wait)
+
+    async def aacquire(self, tokens: int = 0, priority: int = INTERACTIVE, _concurrent: bool = False):
+        """
+        acquire 的异步版本，等待时不阻塞事件循环；
+        锁可能被同步调用方占着，共享配额还要写 sqlite，所以入队和每次尝试都放到线程里做
+        """
+        waiter = self._new_waiter(tokens, priority, _concurrent)
+        try:
+            await asyncio.to_thread(self._locked, self._enqueue, waiter)
+            while True:
+                wait = await asyncio.to_thread(self._locked, self._try_acquire, waiter)
+                if wait is None:
+                    return
+                await asyncio.sleep(min(wait, 0.05))
+        except asyncio.CancelledError:
+            # 被取消时工作线程可能还在跑，_abandon 和它都在锁内按 waiter 的状态处理，先后顺序无所谓
+            await asyncio.shield(asyncio.to_thread(self._abandon, waiter))
+            raise
+
+    def release(self):
+        with self._cond:
+            self._quota.release()
+            self._cond.notify_all()
+
+    def settle(self, tokens: int):
+        """调用结束后按实际 token 数补扣（tokens 为负时退回），允许透支，后面的请求会多等一会"""
+        if self._quota.tokens is None or not tokens:
+            return
+        with self._cond:
+            self._quota.settle(tokens)
+
+    @contextmanager
+    def limit(self, tokens: int = 0, priority: int = INTERACTIVE):
+        """限流 + 占一个并发名额，退出时释放名额"""
+        self.acquire(tokens, priority, _concurrent=True)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def alimit(self, tokens: int = 0, priority: int = INTERACTIVE):
+        await self.aacquire(tokens, priority, _concurrent=True)
+        try:
+            yield
+        finally:
+            # 共享配额时 release 要写 sqlite
+            await asyncio.to_thread(self.release)
+
+    def metrics(self) -> dict:
+        with self._cond:
+            queued = {name: 0 for name in _priority_names.values()}
+            for waiter in self._waiters:
+                queued[_priority_names[waiter.priority]] += 1
+            return {
+                'queue_depth': len(self._waiters),
+                'queued': queued,
+                'in_flight': self.in_flight,
+                'acquired': {_priority_names[p]: n for p, n in self.acquired.items()},
+                'avg_wait_ms': {_priority_names[p]: (self.waited[p] / n * 1000 if n else 0.0)
+                                for p, n in self.acquired.items()},
+                # 共享配额时是本进程上次检查时的余量
+                'tokens_available': None if self._quota.tokens is None else round(self._quota.tokens.level),
+                'shared': isinstance(self._quota, _SharedQuota),
+            }
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _env_number(name: str, default):
+    value = os.getenv(name)
+    return default if value is None else float(value)
+
+
+def get_limiter(endpoint: str) -> RateLimiter:
+    """
+    进程内共享的接口限流器，配额取 default_limits，环境变量 ZHIPU_{ENDPOINT}_RPS / _TPM / _CONCURRENCY 可覆盖；
+    shared_state_path 不为空时配额和同一台机器上的其他进程共用
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(endpoint)
+        if limiter is None:
+            limits = default_limits.get(endpoint, default_limits['chat'])
+            prefix = f'ZHIPU_{endpoint.upper()}'
+            concurrency = _env_number(f'{prefix}_CONCURRENCY', limits['max_concurrency'])
+            limiter = RateLimiter(
+                endpoint,
+                requests_per_s=_env_number(f'{prefix}_RPS', limits['requests_per_s']),
+                tokens_per_min=_env_number(f'{prefix}_TPM', limits['tokens_per_min']),
+                max_concurrency=int(concurrency) if concurrency else None,
+                shared_path=shared_state_path or None,
+            )
+            _limiters[endpoint] = limiter
+        return limiter
+
+
+def limiter_metrics() -> dict:
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {name: limiter.metrics() for name, limiter in limiters.items()}
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """
+    embedding 客户端加上限流：embed_documents（入库）按 BATCH 优先级，embed_query（在线查询）按 INTERACTIVE
+    其他属性（model 等）透传给被包装的对象
+    """
+
+    def __init__(self, embeddings: Embeddings, limiter: Optional[RateLimiter] = None):
+        self.embeddings = embeddings
+        self.limiter = limiter or get_limiter('embedding')
+
+    def __getattr__(self, name):
+        # copy / 反序列化时 __dict__ 还是空的，要抛 AttributeError 而不是 KeyError
+        if 'embeddings' not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.__dict__['embeddings'], name)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self.limiter.limit(sum(count_tokens(text) for text in texts), BATCH):
+            return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with self.limiter.limit(count_tokens(text), INTERACTIVE):
+            return self.embeddings.embed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        async with self.limiter.alimit(sum(count_tokens(text) for text in texts), BATCH):
+            return await self.embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        async with self.limiter.alimit(count_tokens(text), INTERACTIVE):
+            return await self.embeddings.aembed_query(text)
+
+
+class ChatRateLimiter(BaseRateLimiter):
+    """
+    接到 ChatOpenAI(rate_limiter=...) 上，每次调用前按 INTERACTIVE 取一个请求配额
+
+    LangChain 的 rate_limiter 接口只在调用前取配额，没有释放的时机，所以这里不占并发名额；
+    输出的 token 数由 ChatTokenUsage 回调在调用结束后 settle
+    """
+
+    def __init__(self, limiter: Optional[RateLimiter] = None, priority: int = INTERACTIVE):
+        self.limiter = limiter or get_limiter('chat')
+        self.priority = priority
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        self.limiter.acquire(0, self.priority)
+        return True
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        await self.limiter.aacquire(0, self.priority)
+        return True
+
+
+class ChatTokenUsage(BaseCallbackHandler):
+    """对话结束后把实际消耗的 token 数记到 chat 限流器的 token 桶上"""
+
+    def __init__(self, limiter: Optional[RateLimiter] = None):
+        self.limiter = limiter or get_limiter('chat')
+
+    def on_llm_end(self, response, **kwargs):
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        self.limiter.settle(usage.get('total_tokens', 0))
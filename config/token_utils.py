@@ -0,0 +1,20 @@
+"""
+token 数估算，限流器（config/rate_limiter.py）和入库流水线（kb/embedding_pipeline.py）共用
+
+单独放一个模块、不依赖其他配置，kb 下的模块按 path_config 的方式直接 import，不会牵出模型客户端的初始化
+"""
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """用 tiktoken 估算 token 数，tiktoken 不可用时退化为字符数"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception:
+            _encoding = False
+    if _encoding is False:
+        return len(text)
+    return len(_encoding.encode(text, disallowed_special=()))
@@ -3,6 +3,7 @@ FastAPI 服务版本的 RAG 系统
 基于 rag_with_async_table.py，不改动原有代码，只是添加 API 接口
 """
 import asyncio
+import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from sse_starlette.sse import EventSourceResponse
@@ -19,7 +20,7 @@ from langchain_core.chat_history import AIMessage, HumanMessage, BaseChatMessage
 from langchain_community.chat_message_histories import ChatMessageHistory
 from v2_rag_with_stream_async import (
     llm,
-    load_vector_store,
+    embed_model,
     create_history_aware_retriever_chain,
     create_qa_chain,
     RunnableWithMessageHistory
@@ -95,11 +96,25 @@ def get_session_history(session_id: str) -> BaseChatMessageHistory:
     return store[session_id]
 
 # ==================== RAG 链初始化 ====================
-from config.path_config import VECTOR_STORE_DIR
+from config.path_config import VECTOR_STORE_DIR, KB_DIR
+from config.rate_limiter import limiter_metrics
+import sys
+sys.path.append(str(KB_DIR))
+from kb_snapshot import SnapshotStore, HotSwapRetriever
+from sharded_store import load_vector_store
+from memory_report import print_memory_report, process_memory
+from kb_registry import get_registry
 print('[初始化] 正在加载向量库...')
 local_store = str(VECTOR_STORE_DIR / '1201Faiss.faiss')
-embed = load_vector_store(local_store)
-retriever = embed.as_retriever(search_kwargs={'k': 3})
+# 向量库以快照形式保存时，后台切换到新快照，不影响正在处理的请求
+# 索引以只读 mmap 方式加载，多个 uvicorn worker 共享同一份 page cache
+retriever = HotSwapRetriever(
+    SnapshotStore(local_store),
+    loader=lambda path: load_vector_store(path, embed_model, allow_dangerous_deserialization=True, mmap=True),
+    search_kwargs={'k': 3}
+).start()
+embed = retriever.vector_store
+print_memory_report(' 向量库加载完成')
 retriever_chain = create_history_aware_retriever_chain(llm=llm, retriever=retriever)
 qa_chain = create_qa_chain(llm=llm, history_aware_retriever=retriever_chain)
 
@@ -167,7 +182,8 @@ async def root():
         "endpoints": {
             "chat": "/api/chat",
             "chat_stream": "/api/chat/stream",
-            "session_info": "/api/session/{session_id}"
+            "session_info": "/api/session/{session_id}",
+            "memory": "/api/memory"
         }
     }
 
@@ -288,10 +304,23 @@ async def get_session_info(session_id: str):
         print(f'[错误] 获取会话信息失败: {e}')
         raise
 
+@app.get("/api/memory")
+async def memory_info():
+    """
+    当前 worker 进程的内存统计（MB）
+
+    rss 包含和其他 worker 共享的 mmap 索引页，pss 是按共享进程数均摊后的值，
+    private 是本进程独占的部分；kb_registry 是按需加载的知识库缓存的命中 / 加载统计；
+    rate_limits 是各智谱接口限流器的排队深度、在途请求数和平均等待时间
+    """
+    return {'pid': os.getpid(), **process_memory(), 'kb_registry': get_registry().info(),
+            'rate_limits': limiter_metrics()}
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """关闭时清理资源"""
     print('[关闭] 正在清理资源...')
+    retriever.stop()
     await engine.dispose()
     print('[关闭] 资源清理完成')
 
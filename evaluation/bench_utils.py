@@ -0,0 +1,92 @@
+"""
+检索 benchmark 的公共工具
+
+- 读取标注测试集，问题只 embed 一次，各种检索方式用同一批查询向量比较
+- 统计 recall@k / mrr、单条查询延迟（p50 / p95）和 QPS
+- 统计 faiss 索引序列化后的大小，作为常驻内存的近似
+"""
+import ast
+import json
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence
+
+import faiss
+import numpy as np
+
+from evl_full_private import EvaluateMetrics
+
+
+def load_dataset(path) -> List[dict]:
+    with open(str(path), 'r', encoding='utf-8') as f:
+        dataset = json.load(f)
+    # 标注测试集里 relevant_docs 有的存成了列表的字符串形式，统一转回列表
+    for item in dataset:
+        if isinstance(item.get('relevant_docs'), str):
+            item['relevant_docs'] = ast.literal_eval(item['relevant_docs'])
+    return dataset
+
+
+def embed_questions(embeddings, questions: List[str]) -> np.ndarray:
+    return np.array(embeddings.embed_documents(questions), dtype=np.float32)
+
+
+def index_memory_mb(index: faiss.Index) -> float:
+    return len(faiss.serialize_index(index)) / 1024 / 1024
+
+
+def evaluate_search(search: Callable[[np.ndarray, int], List[str]], query_vectors: np.ndarray,
+                    relevant: Sequence[List[str]], k_list: Sequence[int] = (3, 5, 10),
+                    repeat: int = 3) -> Dict[str, float]:
+    """
+    Args:
+        search: search(query_vector, k) -> 检索到的文档块 id 列表
+        query_vectors: 查询向量，每行一条
+        relevant: 每条查询的相关文档块 id
+        repeat: 计时重复次数，取所有轮次的延迟分布
+    """
+    k_max = max(k_list)
+    results = [search(vec, k_max) for vec in query_vectors]
+    latencies = []
+    for _ in range(repeat):
+        for vec in query_vectors:
+            start = time.perf_counter()
+            search(vec, k_max)
+            latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies)
+    metrics = {}
+    for k in k_list:
+        metrics[f'recall@{k}'] = float(np.mean([
+            EvaluateMetrics.recall_k(retrieved_ids=ids, relevant_ids=rel, k=k) for ids, rel in zip(results, relevant)
+        ]))
+    metrics['mrr'] = float(np.mean([EvaluateMetrics.mrr(ids, rel) for ids, rel in zip(results, relevant)]))
+    metrics['p50_ms'] = float(np.percentile(latencies, 50) * 1000)
+    metrics['p95_ms'] = float(np.percentile(latencies, 95) * 1000)
+    metrics['qps'] = float(len(latencies) / latencies.sum()) if latencies.sum() else 0.0
+    metrics['results'] = results
+    return metrics
+
+
+def overlap_at_k(results: List[List[str]], baseline: List[List[str]], k: int) -> float:
+    """和基准结果 top-k 的重合比例，比 recall 更敏感地反映近似检索的损失"""
+    return float(np.mean([len(set(a[:k]) & set(b[:k])) / max(1, len(b[:k])) for a, b in zip(results, baseline)]))
+
+
+def print_table(rows: List[dict], columns: List[str]):
+    print(' | '.join(f'{c:>12}' for c in columns))
+    print('-' * (15 * len(columns)))
+    for row in rows:
+        cells = []
+        for c in columns:
+            value = row.get(c, '')
+            cells.append(f'{value:>12.4f}' if isinstance(value, float) else f'{str(value):>12}')
+        print(' | '.join(cells))
+
+
+def save_results(rows: List[dict], output):
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump([{k: v for k, v in row.items() if k != 'results'} for row in rows],
+                  f, ensure_ascii=False, indent=4)
+    print(f'结果已经保存到了{output}')
@@ -0,0 +1,95 @@
+"""
+二值粗排 benchmark：精确 Flat 检索 vs 二值 Hamming 粗排 + 全精度精排的 QPS 和召回对比
+
+示例：
+    python evaluation/binary_benchmark.py \
+        --vector kb/kb_list/Controlled_chunk_250/vector_store \
+        --candidates 100 200 400 \
+        --output evaluation/results/binary.json
+
+每种配置都从同一个向量库 rebuild 出对应的索引，用测试集里的同一批查询向量检索。
+overlap@k 是和精确检索结果 top-k 的重合比例。
+--distractors 可以追加随机向量模拟大库（只影响 QPS 和 overlap，测试集的相关文档不变）。
+"""
+from __future__ import annotations
+import sys
+from pathlib import Path
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+sys.path.append(str(project_root / 'config'))
+sys.path.append(str(project_root / 'src'))
+sys.path.append(str(project_root / 'kb'))
+
+import argparse
+import numpy as np
+from config.rag_config import ZHIPUEmbeddings
+from kb_snapshot import resolve_vector_path
+from kb_vector_store import KBVectorStore
+from bench_utils import (load_dataset, embed_questions, evaluate_search, index_memory_mb,
+                         overlap_at_k, print_table, save_results)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='比较精确检索和二值粗排 + 精排的 QPS / 召回',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--vector', type=Path, help='向量库路径',
+                        default=project_root / 'kb/kb_list/Controlled_chunk_250/vector_store')
+    parser.add_argument('--dataset', type=Path, help='测试集路径',
+                        default=project_root / 'evaluation/test_dataset_annotated.json')
+    parser.add_argument('--output', type=Path, help='输出路径',
+                        default=project_root / 'evaluation/results/binary.json')
+    parser.add_argument('--candidates', type=int, nargs='+', default=[100, 200, 400],
+                        help='二值粗排的候选数')
+    parser.add_argument('--distractors', type=int, default=0, help='追加的随机干扰向量数')
+    parser.add_argument('--repeat', type=int, default=20, help='计时重复次数')
+    return parser.parse_args()
+
+
+def add_distractors(store: KBVectorStore, n: int, dim: int):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    store.add_embeddings([('', vec) for vec in vectors],
+                         metadatas=[{'id': f'distractor_{i}'} for i in range(n)])
+
+
+def main():
+    args = parse_args()
+    vector_path = str(resolve_vector_path(args.vector.expanduser().absolute()))
+    dataset = load_dataset(args.dataset)
+    query_vectors = embed_questions(ZHIPUEmbeddings, [item['question'] for item in dataset])
+    relevant = [item['relevant_docs'] for item in dataset]
+
+    store = KBVectorStore.load_local(vector_path, ZHIPUEmbeddings, allow_dangerous_deserialization=True)
+    if args.distractors:
+        add_distractors(store, args.distractors, store.index.d)
+    store.rebuild({'type': 'flat', 'binary': True})
+    print(f'向量数: {store.index.ntotal}')
+
+    configs = [('exact', {'binary': False})]
+    configs += [(f'binary@{n}', {'binary_candidates': n}) for n in args.candidates]
+    rows = []
+    baseline = None
+    for name, search_kwargs in configs:
+        def search(vec, k):
+            return [doc.metadata.get('id', '')
+                    for doc, _ in store.similarity_search_with_score_by_vector(vec, k=k, **search_kwargs)]
+
+        metrics = evaluate_search(search, query_vectors, relevant, repeat=args.repeat)
+        if baseline is None:
+            baseline = metrics['results']
+        metrics['overlap@5'] = overlap_at_k(metrics['results'], baseline, 5)
+        metrics['overlap@10'] = overlap_at_k(metrics['results'], baseline, 10)
+        rows.append({'config': name, **metrics})
+
+    print_table(rows, ['config', 'recall@5', 'recall@10', 'overlap@10', 'mrr', 'p50_ms', 'qps'])
+    print(f'float32 索引 {index_memory_mb(store.index):.1f}MB，'
+          f'二值码 {store._binary.ntotal * store._binary.code_size / 1024 / 1024:.1f}MB')
+    save_results(rows, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+级联 rerank 评估：第一阶段缩小候选池后再用 bge-reranker-large 打分，召回率和延迟的取舍
+
+示例：
+    python evaluation/cascade_rerank_eval.py \
+        --vector kb/kb_list/Controlled_chunk_250/vector_store \
+        --first-stage-k 5 8 10 15 --small-model models/bge-reranker-base \
+        --output evaluation/results/cascade_rerank.json
+
+候选文档块用测试集问题预先检索好（k=20，和 FullEvaluator 一致），计时只包含 rerank；
+分数缓存和微批都关闭，每个请求都真正经过模型。比较的配置：
+- vector: 不 rerank，直接取召回顺序的前 final_k 个
+- large: 大模型给全部 k 个候选打分（现在的做法）
+- vector>large@N: 按向量相似度保留前 N 个，大模型只给这 N 个打分
+- small>large@N: 小 cross-encoder 给全部候选打分保留前 N 个（传了 --small-model 才跑）
+overlap 是和 large 配置 top-final_k 结果的重合比例，large_pairs 是每个请求大模型实际打分的 pair 数。
+"""
+from __future__ import annotations
+import sys
+from pathlib import Path
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+sys.path.append(str(project_root / 'config'))
+sys.path.append(str(project_root / 'src'))
+sys.path.append(str(project_root / 'kb'))
+
+import argparse
+from config.path_config import BGE_RERANKER_MODEL
+from config.rag_config import ZHIPUEmbeddings, rerank_backend
+from kb_snapshot import resolve_vector_path
+from kb_vector_store import KBVectorStore
+from v3_rerank_rag_private import SimpleRerank, load_reranker
+from bench_utils import load_dataset, embed_questions, evaluate_search, overlap_at_k, print_table, save_results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='评估级联 rerank 的召回率 / 延迟取舍',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--vector', type=Path, help='向量库路径',
+                        default=project_root / 'kb/kb_list/Controlled_chunk_250/vector_store')
+    parser.add_argument('--dataset', type=Path, help='测试集路径',
+                        default=project_root / 'evaluation/test_dataset_annotated.json')
+    parser.add_argument('--output', type=Path, help='输出路径',
+                        default=project_root / 'evaluation/results/cascade_rerank.json')
+    parser.add_argument('--model', type=str, default=str(BGE_RERANKER_MODEL), help='第二阶段 rerank 模型路径')
+    parser.add_argument('--small-model', type=str, default=None, help='第一阶段小 cross-encoder 模型路径')
+    parser.add_argument('--backend', type=str, default=rerank_backend, help='推理后端 torch / onnx / onnx_int8')
+    parser.add_argument('--k', type=int, default=20, help='每个请求的候选文档块数')
+    parser.add_argument('--final-k', type=int, default=5, help='rerank 后保留的文档块数')
+    parser.add_argument('--first-stage-k', type=int, nargs='+', default=[5, 8, 10, 15],
+                        help='第一阶段保留的文档块数')
+    parser.add_argument('--repeat', type=int, default=3, help='计时重复次数')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    vector_path = str(resolve_vector_path(args.vector.expanduser().absolute()))
+    dataset = load_dataset(args.dataset)
+    questions = [item['question'] for item in dataset]
+    relevant = [item['relevant_docs'] for item in dataset]
+    query_vectors = embed_questions(ZHIPUEmbeddings, questions)
+    store = KBVectorStore.load_local(vector_path, ZHIPUEmbeddings, allow_dangerous_deserialization=True)
+    candidates = [(question, [doc for doc, _ in store.similarity_search_with_score_by_vector(vec, k=args.k)])
+                  for question, vec in zip(questions, query_vectors)]
+    k_list = sorted({k for k in (1, 3, 5, 10) if k <= args.final_k} | {args.final_k})
+
+    large = load_reranker(args.model, backend=args.backend)
+    small = load_reranker(args.small_model, backend=args.backend) if args.small_model else None
+
+    def rerank_search(rerank: SimpleRerank):
+        def search(i, k):
+            question, docs = candidates[i]
+            return [doc.metadata.get('id', '') for doc in rerank._rerank(docs, question)[0]]
+        return search
+
+    def vector_search(i, k):
+        return [doc.metadata.get('id', '') for doc in candidates[i][1][:args.final_k]]
+
+    configs = [('vector', vector_search, 0),
+               ('large', rerank_search(SimpleRerank(reranker=large, final_k=args.final_k, use_cache=False,
+                                                    micro_batch=False)), args.k)]
+    for n in args.first_stage_k:
+        stages = [('vector', 'vector')] + ([('small', small)] if small is not None else [])
+        for name, first_stage in stages:
+            rerank = SimpleRerank(reranker=large, final_k=args.final_k, use_cache=False, micro_batch=False,
+                                  first_stage=first_stage, first_stage_k=n)
+            configs.append((f'{name}>large@{rerank.first_stage_k}', rerank_search(rerank),
+                            min(rerank.first_stage_k, args.k)))
+
+    # 预热，避免第一次前向计算的初始化开销算进结果
+    large.predict([[candidates[0][0], candidates[0][1][0].page_content]])
+    if small is not None:
+        small.predict([[candidates[0][0], candidates[0][1][0].page_content]])
+
+    rows = []
+    baseline = None
+    for name, search, large_pairs in configs:
+        metrics = evaluate_search(search, list(range(len(candidates))), relevant, k_list=k_list, repeat=args.repeat)
+        if name == 'large':
+            baseline = metrics['results']
+        rows.append({'config': name, 'large_pairs': large_pairs, **metrics})
+    for row in rows:
+        row['overlap'] = overlap_at_k(row['results'], baseline, args.final_k)
+
+    columns = ['config', 'large_pairs'] + [f'recall@{k}' for k in k_list] + ['mrr', 'overlap', 'p50_ms', 'p95_ms']
+    print_table(rows, columns)
+    save_results(rows, args.output)
+
+
+if __name__ == '__main__':
+    main()
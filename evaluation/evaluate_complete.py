@@ -3,12 +3,18 @@
 整合了：检索评估、生成评估(ragas)、端到端评估
 """
 
+import sys
 import json
 import time
 from typing import List, Dict, Any
 from pathlib import Path
 
-from langchain_community.vectorstores import FAISS
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+sys.path.append(str(project_root / 'kb'))
+from kb_snapshot import resolve_vector_path
+from sharded_store import load_vector_store
 from langchain_huggingface import HuggingFaceEmbeddings
 from datasets import Dataset
 from ragas import evaluate
@@ -93,9 +99,9 @@ class CompleteEvaluator:
             model_kwargs={'device': 'cpu'}
         )
 
-        # 加载向量库
-        self.vector_store = FAISS.load_local(
-            vector_store_path,
+        # 加载向量库：快照布局时加载 CURRENT 指向的快照，兼容 index.pkl / chunk store / 分片
+        self.vector_store = load_vector_store(
+            resolve_vector_path(vector_store_path),
             self.embeddings,
             allow_dangerous_deserialization=True
         )
@@ -18,6 +18,7 @@ if str(project_root) not in sys.path:
     sys.path.insert(0, str(project_root))
 sys.path.append(str(project_root / 'config'))
 sys.path.append(str(project_root / 'src'))
+sys.path.append(str(project_root / 'kb'))
 from langchain_community.vectorstores import FAISS
 from langchain_huggingface import HuggingFaceEmbeddings
 from datasets import Dataset
@@ -33,6 +34,8 @@ import pprint
 import tqdm
 from sentence_transformers import CrossEncoder
 from src.v3_rerank_rag_private import SimpleRerank
+from kb_snapshot import resolve_vector_path
+from kb_vector_store import KBVectorStore
 #指标
 class EvaluateMetrics:
     @staticmethod
@@ -67,7 +70,10 @@ class FullEvaluator:
         print('初始化评估器')
         self.embedding = ZHIPUEmbeddings
         self.use_rerank = use_rerank
-        self.vector_store = FAISS.load_local(vector_store,self.embedding,allow_dangerous_deserialization=True)
+        #vector_store 目录下是快照布局时加载 CURRENT 指向的快照
+        #KBVectorStore 兼容 index.pkl 和 chunk store 两种格式
+        self.vector_store = KBVectorStore.load_local(str(resolve_vector_path(vector_store)),self.embedding,
+                                                     allow_dangerous_deserialization=True)
         if self.use_rerank:
             base_retriever = self.vector_store.as_retriever(search_kwargs={'k': 20})
 
@@ -81,7 +87,7 @@ class FullEvaluator:
 
     def retrieve_doc(self,query:str,k:int):
         if self.use_rerank:
-          docs = SimpleRerank.invoke(query)
+          docs = self.rerank_model.invoke(query)
         else:
             docs = self.vector_store.similarity_search(query,k=k)
         retrieved_ids = [doc.metadata.get('id','')for doc in docs]
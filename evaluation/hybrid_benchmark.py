@@ -0,0 +1,90 @@
+"""
+混合检索 benchmark：向量检索 / BM25 / BM25 + 向量（RRF 融合）的召回和延迟对比
+
+示例：
+    python evaluation/hybrid_benchmark.py \
+        --vector kb/kb_list/Controlled_chunk_250/vector_store \
+        --output evaluation/results/hybrid.json
+
+查询向量预先算好，三种方式的延迟都不含 query embedding 的 API 调用。
+老的快照没有倒排索引时，第一次检索前从 docstore 现建（不计入延迟）。
+"""
+from __future__ import annotations
+import sys
+from pathlib import Path
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+sys.path.append(str(project_root / 'config'))
+sys.path.append(str(project_root / 'src'))
+sys.path.append(str(project_root / 'kb'))
+
+import argparse
+from config.rag_config import ZHIPUEmbeddings
+from kb_snapshot import resolve_vector_path
+from kb_vector_store import KBVectorStore
+from hybrid_retriever import HybridRetriever
+from bench_utils import (load_dataset, embed_questions, evaluate_search, overlap_at_k,
+                         print_table, save_results)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='比较向量检索、BM25 和混合检索的召回 / 延迟',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--vector', type=Path, help='向量库路径',
+                        default=project_root / 'kb/kb_list/Controlled_chunk_250/vector_store')
+    parser.add_argument('--dataset', type=Path, help='测试集路径',
+                        default=project_root / 'evaluation/test_dataset_annotated.json')
+    parser.add_argument('--output', type=Path, help='输出路径',
+                        default=project_root / 'evaluation/results/hybrid.json')
+    parser.add_argument('--fetch-k', type=int, default=20, help='混合检索每一路的候选数')
+    parser.add_argument('--repeat', type=int, default=20, help='计时重复次数')
+    return parser.parse_args()
+
+
+def doc_ids(docs) -> list:
+    return [doc.metadata.get('id', '') for doc in docs]
+
+
+def main():
+    args = parse_args()
+    vector_path = str(resolve_vector_path(args.vector.expanduser().absolute()))
+    dataset = load_dataset(args.dataset)
+    questions = [item['question'] for item in dataset]
+    query_vectors = embed_questions(ZHIPUEmbeddings, questions)
+    relevant = [item['relevant_docs'] for item in dataset]
+    # evaluate_search 逐条传入查询，这里每条查询是 (问题, 查询向量)
+    queries = list(zip(questions, query_vectors))
+
+    store = KBVectorStore.load_local(vector_path, ZHIPUEmbeddings, allow_dangerous_deserialization=True)
+    store.ensure_bm25()
+    hybrid = HybridRetriever(store, fetch_k=args.fetch_k)
+
+    def vector_search(query, k):
+        return [doc.metadata.get('id', '') for doc, _ in store.similarity_search_with_score_by_vector(query[1], k=k)]
+
+    def bm25_search(query, k):
+        return [doc.metadata.get('id', '') for doc, _ in store.bm25_search_with_score(query[0], k=k)]
+
+    def hybrid_search(query, k):
+        hybrid.k = k
+        return doc_ids(hybrid.search(query[0], vector=query[1]))
+
+    rows = []
+    baseline = None
+    for name, search in [('vector', vector_search), ('bm25', bm25_search), ('hybrid', hybrid_search)]:
+        metrics = evaluate_search(search, queries, relevant, repeat=args.repeat)
+        if baseline is None:
+            baseline = metrics['results']
+        metrics['overlap@5'] = overlap_at_k(metrics['results'], baseline, 5)
+        rows.append({'config': name, **metrics})
+    hybrid.close()
+
+    print_table(rows, ['config', 'recall@3', 'recall@5', 'recall@10', 'mrr', 'p50_ms', 'p95_ms', 'qps'])
+    save_results(rows, args.output)
+
+
+if __name__ == '__main__':
+    main()
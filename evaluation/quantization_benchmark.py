@@ -0,0 +1,81 @@
+"""
+标量量化 benchmark：float32 / fp16 / int8 / int8 + rescore 的召回、延迟、内存对比
+
+示例：
+    python evaluation/quantization_benchmark.py \
+        --vector kb/kb_list/Controlled_chunk_250/vector_store \
+        --output evaluation/results/quantization.json
+
+每种配置都从同一个向量库 rebuild 出对应的索引，用测试集里的同一批查询向量检索。
+overlap@k 是和 float32 结果 top-k 的重合比例。
+"""
+from __future__ import annotations
+import sys
+from pathlib import Path
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+sys.path.append(str(project_root / 'config'))
+sys.path.append(str(project_root / 'src'))
+sys.path.append(str(project_root / 'kb'))
+
+import argparse
+from config.rag_config import ZHIPUEmbeddings
+from kb_snapshot import resolve_vector_path
+from kb_vector_store import KBVectorStore
+from bench_utils import (load_dataset, embed_questions, evaluate_search, index_memory_mb,
+                         overlap_at_k, print_table, save_results)
+
+configs = [
+    ('float32', {'type': 'flat'}),
+    ('fp16', {'type': 'flat', 'storage': 'fp16'}),
+    ('int8', {'type': 'flat', 'storage': 'int8'}),
+    ('int8+rescore', {'type': 'flat', 'storage': 'int8', 'rescore': True}),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='比较不同向量存储精度的召回 / 延迟 / 内存',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--vector', type=Path, help='向量库路径',
+                        default=project_root / 'kb/kb_list/Controlled_chunk_250/vector_store')
+    parser.add_argument('--dataset', type=Path, help='测试集路径',
+                        default=project_root / 'evaluation/test_dataset_annotated.json')
+    parser.add_argument('--output', type=Path, help='输出路径',
+                        default=project_root / 'evaluation/results/quantization.json')
+    parser.add_argument('--repeat', type=int, default=20, help='计时重复次数')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    vector_path = str(resolve_vector_path(args.vector.expanduser().absolute()))
+    dataset = load_dataset(args.dataset)
+    query_vectors = embed_questions(ZHIPUEmbeddings, [item['question'] for item in dataset])
+    relevant = [item['relevant_docs'] for item in dataset]
+
+    rows = []
+    baseline = None
+    for name, spec in configs:
+        store = KBVectorStore.load_local(vector_path, ZHIPUEmbeddings, allow_dangerous_deserialization=True)
+        store.rebuild(spec)
+
+        def search(vec, k):
+            return [doc.metadata.get('id', '') for doc, _ in store.similarity_search_with_score_by_vector(vec, k=k)]
+
+        metrics = evaluate_search(search, query_vectors, relevant, repeat=args.repeat)
+        if baseline is None:
+            baseline = metrics['results']
+        metrics['overlap@5'] = overlap_at_k(metrics['results'], baseline, 5)
+        # rescore 的原始向量在磁盘上（memmap），不计入常驻内存
+        metrics['index_mb'] = index_memory_mb(store.index)
+        rows.append({'config': name, **metrics})
+
+    print_table(rows, ['config', 'recall@5', 'overlap@5', 'mrr', 'p50_ms', 'qps', 'index_mb'])
+    save_results(rows, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+rerank 后端 benchmark：PyTorch（CrossEncoder）/ ONNX fp32 / ONNX int8 的 CPU 延迟和分数一致性
+
+示例：
+    python src/onnx_reranker.py --quantize          # 先导出 ONNX 模型
+    python evaluation/rerank_backend_benchmark.py \
+        --vector kb/kb_list/Controlled_chunk_250/vector_store \
+        --output evaluation/results/rerank_backend.json
+
+候选文档块用测试集问题预先检索好（k=20，和 FullEvaluator 一致），每个请求给一个问题的全部候选打分。
+一致性以 torch 后端为基准：spearman 是每个问题内分数排名的相关系数，overlap@3 是 rerank 后 top-3 的重合比例，
+mean_abs_diff 是分数的平均绝对误差。
+"""
+from __future__ import annotations
+import sys
+from pathlib import Path
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+sys.path.append(str(project_root / 'config'))
+sys.path.append(str(project_root / 'src'))
+sys.path.append(str(project_root / 'kb'))
+
+import argparse
+import time
+import numpy as np
+from config.path_config import BGE_RERANKER_MODEL
+from config.rag_config import ZHIPUEmbeddings
+from kb_snapshot import resolve_vector_path
+from kb_vector_store import KBVectorStore
+from v3_rerank_rag_private import load_reranker
+from bench_utils import load_dataset, embed_questions, print_table, save_results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='比较 rerank 后端的 CPU 延迟和分数一致性',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--vector', type=Path, help='向量库路径',
+                        default=project_root / 'kb/kb_list/Controlled_chunk_250/vector_store')
+    parser.add_argument('--dataset', type=Path, help='测试集路径',
+                        default=project_root / 'evaluation/test_dataset_annotated.json')
+    parser.add_argument('--output', type=Path, help='输出路径',
+                        default=project_root / 'evaluation/results/rerank_backend.json')
+    parser.add_argument('--model', type=str, default=str(BGE_RERANKER_MODEL), help='rerank 模型路径')
+    parser.add_argument('--backends', nargs='+', default=['torch', 'onnx', 'onnx_int8'])
+    parser.add_argument('--k', type=int, default=20, help='每个请求的候选文档块数')
+    parser.add_argument('--repeat', type=int, default=3, help='计时重复次数')
+    return parser.parse_args()
+
+
+def spearman(a: np.ndarray, b: np.ndarray) -> float:
+    if len(a) < 2:
+        return 1.0
+    rank_a = np.argsort(np.argsort(a)).astype(np.float64)
+    rank_b = np.argsort(np.argsort(b)).astype(np.float64)
+    return float(np.corrcoef(rank_a, rank_b)[0, 1])
+
+
+def top_overlap(a: np.ndarray, b: np.ndarray, k: int) -> float:
+    top_a = set(np.argsort(a)[::-1][:k].tolist())
+    top_b = set(np.argsort(b)[::-1][:k].tolist())
+    return len(top_a & top_b) / max(1, min(k, len(a)))
+
+
+def main():
+    args = parse_args()
+    vector_path = str(resolve_vector_path(args.vector.expanduser().absolute()))
+    dataset = load_dataset(args.dataset)
+    questions = [item['question'] for item in dataset]
+    query_vectors = embed_questions(ZHIPUEmbeddings, questions)
+    store = KBVectorStore.load_local(vector_path, ZHIPUEmbeddings, allow_dangerous_deserialization=True)
+    requests = [[[question, doc.page_content] for doc, _ in store.similarity_search_with_score_by_vector(vec, k=args.k)]
+                for question, vec in zip(questions, query_vectors)]
+
+    rows = []
+    baseline = None
+    for backend in args.backends:
+        try:
+            model = load_reranker(args.model, backend=backend)
+        except (ImportError, FileNotFoundError) as e:
+            print(f'跳过 {backend}: {e}')
+            continue
+        # 预热
+        model.predict(requests[0])
+        scores = [np.asarray(model.predict(pairs), dtype=np.float32) for pairs in requests]
+        latencies = []
+        for _ in range(args.repeat):
+            for pairs in requests:
+                start = time.perf_counter()
+                model.predict(pairs)
+                latencies.append(time.perf_counter() - start)
+        latencies = np.array(latencies)
+        if baseline is None:
+            baseline = scores
+        rows.append({
+            'config': backend,
+            'p50_ms': float(np.percentile(latencies, 50) * 1000),
+            'p95_ms': float(np.percentile(latencies, 95) * 1000),
+            'pairs_per_s': float(len(latencies) * args.k / latencies.sum()) if latencies.sum() else 0.0,
+            'spearman': float(np.mean([spearman(s, b) for s, b in zip(scores, baseline)])),
+            'overlap@3': float(np.mean([top_overlap(s, b, 3) for s, b in zip(scores, baseline)])),
+            'mean_abs_diff': float(np.mean([np.abs(s - b).mean() for s, b in zip(scores, baseline)])),
+        })
+        del model
+
+    print_table(rows, ['config', 'p50_ms', 'p95_ms', 'pairs_per_s', 'spearman', 'overlap@3', 'mean_abs_diff'])
+    save_results(rows, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+rerank 微批 benchmark：并发请求下逐请求调用 CrossEncoder 和跨请求微批的吞吐 / 延迟对比
+
+示例：
+    python evaluation/rerank_batch_benchmark.py \
+        --vector kb/kb_list/Controlled_chunk_250/vector_store \
+        --concurrency 1 4 16 --output evaluation/results/rerank_batch.json
+
+候选文档块用测试集问题预先检索好（k=20，和 FullEvaluator 一致），计时只包含 rerank；
+分数缓存关闭，每个请求都真正经过模型。
+"""
+from __future__ import annotations
+import sys
+from pathlib import Path
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+sys.path.append(str(project_root / 'config'))
+sys.path.append(str(project_root / 'src'))
+sys.path.append(str(project_root / 'kb'))
+
+import argparse
+import asyncio
+import time
+import numpy as np
+from config.path_config import BGE_RERANKER_MODEL
+from config.rag_config import ZHIPUEmbeddings
+from kb_snapshot import resolve_vector_path
+from kb_vector_store import KBVectorStore
+from v3_rerank_rag_private import SimpleRerank
+from rerank_batcher import RerankBatcher
+from bench_utils import load_dataset, embed_questions, print_table, save_results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='比较并发 rerank 时逐请求调用和跨请求微批的吞吐 / 延迟',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--vector', type=Path, help='向量库路径',
+                        default=project_root / 'kb/kb_list/Controlled_chunk_250/vector_store')
+    parser.add_argument('--dataset', type=Path, help='测试集路径',
+                        default=project_root / 'evaluation/test_dataset_annotated.json')
+    parser.add_argument('--output', type=Path, help='输出路径',
+                        default=project_root / 'evaluation/results/rerank_batch.json')
+    parser.add_argument('--model', type=str, default=str(BGE_RERANKER_MODEL), help='rerank 模型路径')
+    parser.add_argument('--k', type=int, default=20, help='每个请求的候选文档块数')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help='并发请求数')
+    parser.add_argument('--requests', type=int, default=64, help='每种配置的请求总数')
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    return parser.parse_args()
+
+
+async def run_load(rerank: SimpleRerank, requests: list, concurrency: int) -> dict:
+    """concurrency 个客户端并发地把 requests 依次发完"""
+    latencies = []
+    cursor = iter(requests)
+
+    async def client():
+        for query, docs in cursor:
+            start = time.perf_counter()
+            await rerank._arerank(docs, query)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies)
+    return {
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p95_ms': float(np.percentile(latencies, 95) * 1000),
+        'rps': float(len(latencies) / elapsed) if elapsed else 0.0,
+    }
+
+
+def main():
+    args = parse_args()
+    vector_path = str(resolve_vector_path(args.vector.expanduser().absolute()))
+    dataset = load_dataset(args.dataset)
+    questions = [item['question'] for item in dataset]
+    query_vectors = embed_questions(ZHIPUEmbeddings, questions)
+    store = KBVectorStore.load_local(vector_path, ZHIPUEmbeddings, allow_dangerous_deserialization=True)
+    candidates = [(question, [doc for doc, _ in store.similarity_search_with_score_by_vector(vec, k=args.k)])
+                  for question, vec in zip(questions, query_vectors)]
+    requests = [candidates[i % len(candidates)] for i in range(args.requests)]
+
+    rerank = SimpleRerank(model_name_or_path=args.model, use_cache=False, micro_batch=False)
+    # 预热，避免第一次前向计算的初始化开销算进结果
+    rerank._rerank(candidates[0][1], candidates[0][0])
+
+    rows = []
+    for concurrency in args.concurrency:
+        for mode in ('per_request', 'micro_batch'):
+            batcher = None
+            if mode == 'micro_batch':
+                batcher = RerankBatcher(rerank.model.predict, max_batch_size=args.max_batch_size,
+                                        max_wait_ms=args.max_wait_ms)
+            rerank.batcher = batcher
+            metrics = asyncio.run(run_load(rerank, requests, concurrency))
+            if batcher is not None:
+                metrics['avg_batch_pairs'] = batcher.stats()['avg_batch_pairs']
+                batcher.close()
+            rows.append({'config': f'{mode}@{concurrency}', 'concurrency': concurrency, **metrics})
+
+    print_table(rows, ['config', 'p50_ms', 'p95_ms', 'rps', 'avg_batch_pairs'])
+    save_results(rows, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""
+BM25 倒排索引（和向量库按 index 位置对齐，随快照一起保存）
+
+embedding 检索对精确的标识符 / API 名（assertRaises、git rebase）不敏感，倒排索引用关键词匹配补上这一块。
+
+分词:
+- 英文 / 数字 / 标识符整体作为一个词并转小写（self.assertRaises 同时产出 self.assertraises、self、assertraises），
+  驼峰命名额外拆出各个部分（assertRaises -> assert、raises）
+- 中文装了 jieba 时用 jieba.lcut_for_search，否则退化为相邻两个字的 bigram（单字的片段保留单字）
+- 保存时记录用的是哪种分词，加载后检索用同一种，避免建库和检索的分词不一致
+
+存储: {index_name}.bm25.npz，倒排表是 CSR 格式（每个词的 posting 在 docs / tfs 里连续存放），
+词表是 utf-8 字节流 + 偏移（见 chunk_store.save_strings）；入库新增的文档先放在内存的 dict 里，保存时合并。
+文档长度在 add 时就并进 _doc_len，检索只读不写，可以和其他检索并发
+"""
+import math
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from chunk_store import load_strings, save_strings
+
+try:
+    import jieba
+except ImportError:
+    jieba = None
+
+file_suffix = 'bm25.npz'
+
+_word_pattern = re.compile(r'[A-Za-z0-9_]+(?:\.[A-Za-z0-9_]+)*')
+_camel_pattern = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+')
+_cjk_pattern = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff]+')
+
+
+def default_tokenizer() -> str:
+    return 'jieba' if jieba is not None else 'bigram'
+
+
+def bm25_path(folder_path, index_name: str = 'index') -> Path:
+    return Path(folder_path) / f'{index_name}.{file_suffix}'
+
+
+def _word_tokens(word: str) -> List[str]:
+    tokens = [word.lower()]
+    parts = word.split('.')
+    if len(parts) > 1:
+        tokens.extend(p.lower() for p in parts if p)
+    for part in parts:
+        camel = _camel_pattern.findall(part)
+        if len(camel) > 1:
+            tokens.extend(c.lower() for c in camel)
+    return tokens
+
+
+def _cjk_tokens(segment: str, tokenizer: str) -> List[str]:
+    if tokenizer == 'jieba' and jieba is not None:
+        return [t for t in jieba.lcut_for_search(segment) if t.strip()]
+    if len(segment) == 1:
+        return [segment]
+    return [segment[i:i + 2] for i in range(len(segment) - 1)]
+
+
+def tokenize(text: str, tokenizer: Optional[str] = None) -> List[str]:
+    tokenizer = tokenizer or default_tokenizer()
+    tokens = []
+    for word in _word_pattern.findall(text):
+        tokens.extend(_word_tokens(word))
+    for segment in _cjk_pattern.findall(text):
+        tokens.extend(_cjk_tokens(segment, tokenizer))
+    return tokens
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75, tokenizer: Optional[str] = None):
+        self.k1 = k1
+        self.b = b
+        self.tokenizer = tokenizer or default_tokenizer()
+        if self.tokenizer == 'jieba' and jieba is None:
+            print('[BM25] 索引是用 jieba 分词建的，但当前环境没有安装 jieba，中文改用 bigram，召回会变差')
+        self.vocab: Dict[str, int] = {}
+        # CSR 倒排表: 词 t 的 posting 是 docs[offsets[t]:offsets[t+1]]
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._docs = np.zeros(0, dtype=np.int32)
+        self._tfs = np.zeros(0, dtype=np.int32)
+        self._doc_len = np.zeros(0, dtype=np.int32)
+        # 新增文档的倒排表: 词 id -> [(文档位置, 词频)]
+        self._added: Dict[int, List[Tuple[int, int]]] = {}
+        self._total_len = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def add(self, texts: Iterable[str]):
+        """按顺序追加文档，文档位置接着已有的往后排（和向量库 index 位置一致）"""
+        start = len(self._doc_len)
+        lengths: List[int] = []
+        postings: Dict[int, List[Tuple[int, int]]] = {}
+        for text in texts:
+            counts: Dict[int, int] = {}
+            tokens = tokenize(text or '', self.tokenizer)
+            for token in tokens:
+                term = self.vocab.setdefault(token, len(self.vocab))
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((start + len(lengths), tf))
+            lengths.append(len(tokens))
+        if not lengths:
+            return
+        # 先换上更长的 _doc_len 再挂 posting，并发的检索不会看到超出 _doc_len 的文档位置
+        self._doc_len = np.concatenate([self._doc_len, np.array(lengths, dtype=np.int32)])
+        self._total_len += sum(lengths)
+        for term, items in postings.items():
+            self._added.setdefault(term, []).extend(items)
+
+    def _postings(self, term: int) -> Tuple[np.ndarray, np.ndarray]:
+        if term + 1 < len(self._offsets):
+            start, end = self._offsets[term], self._offsets[term + 1]
+            docs, tfs = self._docs[start:end], self._tfs[start:end]
+        else:
+            docs, tfs = self._docs[:0], self._tfs[:0]
+        # 拷一份，add 可能同时在往这个列表里追加
+        added = list(self._added.get(term, ()))
+        if added:
+            docs = np.concatenate([docs, np.array([d for d, _ in added], dtype=np.int32)])
+            tfs = np.concatenate([tfs, np.array([tf for _, tf in added], dtype=np.int32)])
+        return docs, tfs
+
+    def search(self, query: str, k: int = 10, exclude=None) -> List[Tuple[int, float]]:
+        """返回 [(文档位置, BM25 分数)]，按分数降序；exclude 是要跳过的位置（墓碑）"""
+        doc_len = self._doc_len
+        n = len(doc_len)
+        if not n:
+            return []
+        avgdl = max(self._total_len / n, 1e-6)
+        scores = np.zeros(n, dtype=np.float32)
+        for token in set(tokenize(query, self.tokenizer)):
+            term = self.vocab.get(token)
+            if term is None:
+                continue
+            docs, tfs = self._postings(term)
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            denom = tfs + self.k1 * (1 - self.b + self.b * doc_len[docs] / avgdl)
+            # 同一个词的 posting 里文档不重复，可以直接按下标累加
+            scores[docs] += idf * tfs * (self.k1 + 1) / denom
+        if exclude:
+            scores[np.fromiter(exclude, dtype=np.int64)] = 0
+        candidates = np.nonzero(scores)[0]
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(int(i), float(scores[i])) for i in candidates]
+
+    def _to_csr(self):
+        """把新增部分合并进 CSR 倒排表"""
+        if not self._added:
+            return
+        n_terms = len(self.vocab)
+        counts = np.zeros(n_terms, dtype=np.int64)
+        counts[:len(self._offsets) - 1] = np.diff(self._offsets)
+        for term, postings in self._added.items():
+            counts[term] += len(postings)
+        offsets = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        docs = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.int32)
+        for term in range(n_terms):
+            term_docs, term_tfs = self._postings(term)
+            docs[offsets[term]:offsets[term + 1]] = term_docs
+            tfs[offsets[term]:offsets[term + 1]] = term_tfs
+        self._offsets, self._docs, self._tfs = offsets, docs, tfs
+        self._added = {}
+
+    def take(self, keep: np.ndarray) -> 'BM25Index':
+        """只保留 keep 这些位置并按顺序重新编号（compact / 重建索引后重新对齐）"""
+        self._to_csr()
+        remap = np.full(len(self), -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+        terms = np.repeat(np.arange(len(self._offsets) - 1), np.diff(self._offsets))
+        new_docs = remap[self._docs]
+        mask = new_docs >= 0
+        result = BM25Index(self.k1, self.b, self.tokenizer)
+        result.vocab = self.vocab
+        result._offsets = np.zeros(len(self._offsets), dtype=np.int64)
+        np.cumsum(np.bincount(terms[mask], minlength=len(self._offsets) - 1), out=result._offsets[1:])
+        result._docs = new_docs[mask].astype(np.int32)
+        result._tfs = self._tfs[mask]
+        result._doc_len = self._doc_len[keep]
+        result._total_len = int(result._doc_len.sum())
+        return result
+
+    def save(self, path):
+        self._to_csr()
+        arrays = {'offsets': self._offsets, 'docs': self._docs, 'tfs': self._tfs, 'doc_len': self._doc_len,
+                  'params': np.array([self.k1, self.b]), 'tokenizer': np.array(self.tokenizer)}
+        save_strings(arrays, 'terms', sorted(self.vocab, key=self.vocab.get))
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path) -> 'BM25Index':
+        with np.load(path, allow_pickle=False) as data:
+            k1, b = data['params'].tolist()
+            index = cls(k1, b, str(data['tokenizer']))
+            index.vocab = {term: i for i, term in enumerate(load_strings(data, 'terms'))}
+            index._offsets = data['offsets']
+            index._docs = data['docs']
+            index._tfs = data['tfs']
+            index._doc_len = data['doc_len']
+        index._total_len = int(index._doc_len.sum())
+        return index
@@ -0,0 +1,260 @@
+"""
+入库前的近似重复文档块去重（MinHash + LSH）
+
+wiki / 私有语料里有大量重复的文档块：模板化的段落、chunk_overlap 造成的重叠窗口、
+python_tutorial_full.jsonl 和 python_tutorial_full_1226.jsonl 里相同的章节。
+重复的文档块 embed、存储、rerank 都要花钱，召回时还会挤占 top-k。
+
+- 文本归一化（小写、合并空白）后取字符 5-gram，中英文都适用
+- 完全相同的文本先用 sha1 判重；其余用 MinHash 签名（num_perm 个哈希的最小值）估计 Jaccard 相似度，
+  LSH 分桶只比较落在同一个桶里的候选，不需要两两比较
+- 相似度 >= threshold 的文档块:
+    - mode='drop': 不 embed、不入库，记录到去重台账（重复块 id -> 保留的块 id）
+    - mode='mark': 照常入库，metadata['duplicate_of'] 记下保留的块 id（用来先观察阈值是否合适）
+- 已入库文档块的签名和台账保存在知识库目录的 dedup.npz，后续入库也和已有内容比较
+
+注意：保留的文档块被删除后，之前因为和它重复而没有入库的文档块不会自动补回，
+dependents() 可以找出这些文档块所在的文件，重新同步这些文件即可
+"""
+import hashlib
+import os
+import re
+import uuid
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from chunk_store import load_strings, save_strings
+from token_utils import count_tokens
+
+file_name = 'dedup.npz'
+dedup_modes = ('drop', 'mark')
+
+# MinHash 用的梅森素数，哈希值 < 2^32、系数 < 2^31，乘积不会溢出 uint64
+_prime = np.uint64((1 << 61) - 1)
+_space_pattern = re.compile(r'\s+')
+
+
+def _normalize(text: str) -> str:
+    return _space_pattern.sub(' ', text.lower()).strip()
+
+
+def _lsh_params(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """
+    选 (bands, rows)，bands * rows = num_perm
+
+    相似度为 s 的一对文档至少落进一个桶的概率是 1 - (1 - s^rows)^bands，拐点约在 (1/bands)^(1/rows)；
+    取拐点不超过 threshold 的最大值，宁可多比较几个候选也不漏掉重复
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if (1 / bands) ** (1 / rows) <= threshold:
+            best = (bands, rows)
+    return best
+
+
+class DedupStats:
+    """一次入库的去重统计"""
+
+    def __init__(self):
+        self.chunks = 0
+        self.exact = 0
+        self.near = 0
+        self.chars_saved = 0
+        self.tokens_saved = 0
+
+    @property
+    def duplicates(self) -> int:
+        return self.exact + self.near
+
+    def report(self, bytes_per_vector: int = 0) -> str:
+        ratio = self.duplicates / self.chunks if self.chunks else 0.0
+        index_mb = self.duplicates * bytes_per_vector / 1024 / 1024
+        return (f'去重: {self.chunks} 个文档块中重复 {self.duplicates} 个（{ratio:.1%}，完全相同 {self.exact}，'
+                f'近似 {self.near}），节省 embedding 调用 {self.duplicates} 次 / {self.tokens_saved} tokens，'
+                f'节省索引 {index_mb:.2f}MB、文本 {self.chars_saved / 1024 / 1024:.2f}MB')
+
+
+class ChunkDeduplicator:
+    def __init__(self, threshold: float = 0.9, num_perm: int = 64, shingle_size: int = 5,
+                 mode: str = 'drop', seed: int = 1):
+        if mode not in dedup_modes:
+            raise ValueError(f'不支持的去重方式: {mode}，可选 {dedup_modes}')
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.mode = mode
+        self.bands, self.rows = _lsh_params(num_perm, threshold)
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 1 << 31, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 31, num_perm, dtype=np.uint64)
+        # 已保留的文档块: id -> 签名；sha1 -> id；LSH 桶 -> [id]
+        self._signatures: Dict[str, np.ndarray] = {}
+        self._exact: Dict[str, str] = {}
+        self._buckets: Dict[Tuple[int, bytes], List[str]] = {}
+        # 去重台账: 重复块 id -> (保留的块 id, 相似度, 重复块的 file_name)
+        self.ledger: Dict[str, Tuple[str, float, str]] = {}
+        self.stats = DedupStats()
+        # 这次入库判为重复、没有入库的 id
+        self.dropped_ids: List[str] = []
+        # 这次入库作为保留块记下指纹的 id，签名在 embed 之前就记了，要等 confirm 核对是否真的入库
+        self.kept_ids: List[str] = []
+
+    def signature(self, text: str) -> np.ndarray:
+        n = self.shingle_size
+        shingles = {text[i:i + n] for i in range(max(1, len(text) - n + 1))}
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+        return ((hashes[:, None] * self._a + self._b) % _prime).min(axis=0)
+
+    def _bands(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def find(self, text: str, signature: Optional[np.ndarray] = None) -> Optional[Tuple[str, float]]:
+        """返回 (相似的已保留文档块 id, 估计的相似度)，没有返回 None"""
+        normalized = _normalize(text)
+        exact = self._exact.get(hashlib.sha1(normalized.encode('utf-8')).hexdigest())
+        if exact is not None and exact in self._signatures:
+            return exact, 1.0
+        signature = self.signature(normalized) if signature is None else signature
+        best = None
+        checked = set()
+        for key in self._bands(signature):
+            for candidate in self._buckets.get(key, ()):
+                if candidate in checked or candidate not in self._signatures:
+                    continue
+                checked.add(candidate)
+                similarity = float(np.mean(self._signatures[candidate] == signature))
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (candidate, similarity)
+        return best
+
+    def add(self, doc_id: str, text: str, signature: Optional[np.ndarray] = None):
+        normalized = _normalize(text)
+        signature = self.signature(normalized) if signature is None else signature
+        self._signatures[doc_id] = signature
+        self._exact[hashlib.sha1(normalized.encode('utf-8')).hexdigest()] = doc_id
+        for key in self._bands(signature):
+            self._buckets.setdefault(key, []).append(doc_id)
+
+    def filter(self, docs: Iterable[Document]) -> Iterator[Document]:
+        """
+        入库流水线里的一个阶段：产出要 embed 的文档块
+
+        没有 id 的文档块在这里分配 uuid（流水线会沿用），台账里才能记录保留的是哪一块
+        """
+        for doc in docs:
+            if not getattr(doc, 'id', None):
+                doc.id = str(uuid.uuid4())
+            self.stats.chunks += 1
+            normalized = _normalize(doc.page_content)
+            signature = self.signature(normalized)
+            match = self.find(doc.page_content, signature)
+            if match is None:
+                self.add(doc.id, doc.page_content, signature)
+                self.kept_ids.append(doc.id)
+                yield doc
+                continue
+            canonical, similarity = match
+            if similarity >= 1.0:
+                self.stats.exact += 1
+            else:
+                self.stats.near += 1
+            if self.mode == 'mark':
+                doc.metadata['duplicate_of'] = canonical
+                yield doc
+                continue
+            self.ledger[doc.id] = (canonical, similarity, str(doc.metadata.get('file_name', '')))
+            self.dropped_ids.append(doc.id)
+            self.stats.chars_saved += len(doc.page_content.encode('utf-8'))
+            self.stats.tokens_saved += count_tokens(doc.page_content)
+
+    def forget(self, ids: Iterable[str]):
+        """文档块被删除时调用：不再作为保留块参与比较，台账里它作为重复块的记录也删掉"""
+        for doc_id in ids:
+            self._signatures.pop(doc_id, None)
+            self.ledger.pop(doc_id, None)
+
+    def confirm(self, stored_ids: Iterable[str]) -> List[str]:
+        """
+        入库结束后调用，stored_ids 是这次真正写进向量库（或复用）的 id：
+        这次保留但 embed 失败的块不再作为保留块，和它重复的块也撤销台账记录、不算处理成功（下次同步重新处理）；
+        返回保留块确实在库里的重复块 id
+        """
+        stored_ids = set(stored_ids)
+        failed = {i for i in self.kept_ids if i not in stored_ids}
+        if failed:
+            self.forget(failed)
+            self.ledger = {i: entry for i, entry in self.ledger.items() if entry[0] not in failed}
+            self.dropped_ids = [i for i in self.dropped_ids if i in self.ledger]
+        self.kept_ids = [i for i in self.kept_ids if i not in failed]
+        return self.dropped_ids
+
+    def dependents(self, ids: Iterable[str]) -> Set[str]:
+        """保留块是 ids 之一的重复块所在的文件名（这些保留块被删后，重复块需要重新入库）"""
+        ids = set(ids)
+        return {entry[2] for entry in self.ledger.values() if entry[0] in ids and entry[2]}
+
+    def save(self, path):
+        """先写临时文件再 os.replace，写到一半崩溃不会留下截断的 dedup.npz"""
+        path = Path(path)
+        ids = list(self._signatures)
+        signatures = (np.vstack([self._signatures[i] for i in ids]) if ids
+                      else np.zeros((0, self.num_perm), dtype=np.uint64))
+        texts = {doc_id: digest for digest, doc_id in self._exact.items()}
+        ledger_ids = list(self.ledger)
+        # id / 文件名用 utf-8 字节流 + 偏移存，不用定长 str 数组（一个很长的文件名会让每个元素都那么宽）
+        arrays = {'signatures': signatures,
+                  'ledger_similarity': np.array([self.ledger[i][1] for i in ledger_ids], dtype=np.float32),
+                  'params': np.array([self.threshold, self.num_perm, self.shingle_size])}
+        save_strings(arrays, 'ids', ids)
+        save_strings(arrays, 'digests', [texts.get(i, '') for i in ids])
+        save_strings(arrays, 'ledger_ids', ledger_ids)
+        save_strings(arrays, 'ledger_canonical', [self.ledger[i][0] for i in ledger_ids])
+        save_strings(arrays, 'ledger_file', [self.ledger[i][2] for i in ledger_ids])
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, mode: str = 'drop', threshold: Optional[float] = None,
+             live_ids: Optional[Set[str]] = None) -> 'ChunkDeduplicator':
+        """
+        live_ids: 向量库里现存的 id；给出时丢掉已经不在向量库里的保留块（例如被删除的文件）
+        """
+        with np.load(path, allow_pickle=False) as data:
+            saved_threshold, num_perm, shingle_size = data['params'].tolist()
+            dedup = cls(threshold if threshold is not None else saved_threshold,
+                        int(num_perm), int(shingle_size), mode=mode)
+            for doc_id, signature, digest in zip(load_strings(data, 'ids'), data['signatures'],
+                                                 load_strings(data, 'digests')):
+                if live_ids is not None and doc_id not in live_ids:
+                    continue
+                dedup._signatures[doc_id] = signature
+                if digest:
+                    dedup._exact[digest] = doc_id
+                for key in dedup._bands(signature):
+                    dedup._buckets.setdefault(key, []).append(doc_id)
+            for doc_id, canonical, similarity, file in zip(load_strings(data, 'ledger_ids'),
+                                                           load_strings(data, 'ledger_canonical'),
+                                                           data['ledger_similarity'].tolist(),
+                                                           load_strings(data, 'ledger_file')):
+                dedup.ledger[doc_id] = (canonical, float(similarity), file)
+        return dedup
+
+    @classmethod
+    def for_kb(cls, kb_path, threshold: float, mode: str = 'drop',
+               live_ids: Optional[Set[str]] = None) -> 'ChunkDeduplicator':
+        path = Path(kb_path) / file_name
+        if path.exists():
+            return cls.load(path, mode=mode, threshold=threshold, live_ids=live_ids)
+        return cls(threshold, mode=mode)
@@ -0,0 +1,241 @@
+"""
+内存映射（mmap）的文档块存储，替代 index.pkl 里 pickle 的 docstore
+
+FAISS.load_local 每次都要把 index.pkl 整个 unpickle，所有 Document 连同 metadata 都进内存，
+加载时间和常驻内存都随语料线性增长。这里换成列式的磁盘格式：
+
+  {index_name}.chunks.json   # 头信息：格式版本、文档块数量
+  {index_name}.ids.bin/.off  # docstore id
+  {index_name}.text.bin/.off # 文本（utf-8）
+  {index_name}.meta.bin/.off # metadata（每行一个紧凑 json）
+
+.bin 是所有记录拼接在一起的字节流，.off 是 int64 偏移数组（n+1 个），第 i 条记录是 bin[off[i]:off[i+1]]。
+两者都用 mmap 打开，打开知识库是常数时间；只有检索命中的那几条才会被解码成 Document。
+第 i 行就是 faiss index 的第 i 个位置，检索时按位置直接取，不需要 id -> 行号 的映射。
+
+pack_strings / save_strings 用同样的 字节流 + 偏移 格式把字符串列表存进 npz（BM25 词表、metadata 字段值、去重台账），
+np.array(strings, dtype=str) 是定长的 <U{最长}，一个超长的词（URL、hex、base64）会让每个元素都那么宽。
+"""
+import json
+import mmap
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+format_version = 1
+_columns = ('ids', 'text', 'meta')
+
+
+def chunk_store_exists(folder_path, index_name: str = 'index') -> bool:
+    return (Path(folder_path) / f'{index_name}.chunks.json').exists()
+
+
+def pack_strings(strings: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """字符串列表 -> (utf-8 字节流 uint8 数组, int64 偏移数组)"""
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def unpack_strings(blob: np.ndarray, offsets: np.ndarray) -> List[str]:
+    data = np.asarray(blob, dtype=np.uint8).tobytes()
+    offsets = offsets.tolist()
+    return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+
+def save_strings(arrays: dict, name: str, strings: Iterable[str]):
+    """把字符串列表以 {name}_blob / {name}_offsets 两个数组放进要 np.savez 的 arrays"""
+    arrays[f'{name}_blob'], arrays[f'{name}_offsets'] = pack_strings(strings)
+
+
+def load_strings(data, name: str) -> List[str]:
+    """从 np.load 的结果里读 save_strings 存的字符串列表，兼容旧文件里的定长 str 数组"""
+    if name in data.files:
+        return data[name].tolist()
+    return unpack_strings(data[f'{name}_blob'], data[f'{name}_offsets'])
+
+
+class _BlobColumn:
+    """一列变长记录：mmap 的字节流 + mmap 的偏移数组"""
+
+    def __init__(self, blob_path: Path, offset_path: Path):
+        self._file = None
+        if blob_path.stat().st_size:
+            self._file = open(blob_path, 'rb')
+            self.blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # 空文件不能 mmap
+            self.blob = b''
+        self.offsets = np.memmap(offset_path, dtype=np.int64, mode='r')
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def get(self, row: int) -> str:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return self.blob[start:end].decode('utf-8')
+
+    def close(self):
+        if self._file is not None:
+            self.blob.close()
+            self._file.close()
+            self._file = None
+
+
+class ChunkStore:
+    """只读的列式文档块存储"""
+
+    def __init__(self, folder_path, index_name: str = 'index'):
+        folder_path = Path(folder_path)
+        with open(folder_path / f'{index_name}.chunks.json', 'r', encoding='utf-8') as f:
+            self.header = json.load(f)
+        if self.header.get('format_version') != format_version:
+            raise ValueError(f"不支持的 chunk store 格式版本: {self.header.get('format_version')}")
+        self.columns = {
+            name: _BlobColumn(folder_path / f'{index_name}.{name}.bin', folder_path / f'{index_name}.{name}.off')
+            for name in _columns
+        }
+        self.count = self.header['count']
+
+    def __len__(self) -> int:
+        return self.count
+
+    def id_at(self, row: int) -> str:
+        return self.columns['ids'].get(row)
+
+    def document_at(self, row: int) -> Document:
+        _id = self.id_at(row)
+        return Document(
+            id=_id,
+            page_content=self.columns['text'].get(row),
+            metadata=json.loads(self.columns['meta'].get(row))
+        )
+
+    def close(self):
+        for column in self.columns.values():
+            column.close()
+
+    @staticmethod
+    def write(folder_path, rows: Iterable[Tuple[str, Optional[Document]]], index_name: str = 'index') -> int:
+        """
+        按行写入 (docstore id, Document)，Document 为 None 表示该位置已删除（墓碑），写成空记录
+
+        逐行写文件，只有偏移数组在内存里
+        """
+        folder_path = Path(folder_path)
+        folder_path.mkdir(parents=True, exist_ok=True)
+        files = {name: open(folder_path / f'{index_name}.{name}.bin', 'wb') for name in _columns}
+        offsets = {name: [0] for name in _columns}
+        count = 0
+        try:
+            for _id, doc in rows:
+                values = {
+                    'ids': _id,
+                    'text': doc.page_content if doc is not None else '',
+                    'meta': json.dumps(doc.metadata if doc is not None else {},
+                                       ensure_ascii=False, separators=(',', ':'), default=str),
+                }
+                for name, value in values.items():
+                    data = value.encode('utf-8')
+                    files[name].write(data)
+                    offsets[name].append(offsets[name][-1] + len(data))
+                count += 1
+        finally:
+            for f in files.values():
+                f.close()
+        for name in _columns:
+            np.asarray(offsets[name], dtype=np.int64).tofile(folder_path / f'{index_name}.{name}.off')
+        # 头信息最后写，存在即代表其他文件已经完整
+        with open(folder_path / f'{index_name}.chunks.json', 'w', encoding='utf-8') as f:
+            json.dump({'format_version': format_version, 'count': count}, f)
+        return count
+
+
+class ChunkStoreDocstore(Docstore, AddableMixin):
+    """
+    基于 ChunkStore 的 docstore
+
+    磁盘上的部分只读；入库新增的文档放在内存里的 _added，删除记在 _deleted，
+    下次 save_local 时一起写成新的 chunk store
+    """
+
+    def __init__(self, store: ChunkStore):
+        self.store = store
+        self._added: Dict[str, Document] = {}
+        self._deleted: set = set()
+        # id -> 行号，只有按 id 查找（删除、MMR 等）时才懒加载
+        self._row_of: Optional[Dict[str, int]] = None
+
+    def _rows(self) -> Dict[str, int]:
+        if self._row_of is None:
+            self._row_of = {self.store.id_at(row): row for row in range(len(self.store))}
+        return self._row_of
+
+    def search(self, search: str) -> Union[str, Document]:
+        if search in self._added:
+            return self._added[search]
+        if search in self._deleted:
+            return f'ID {search} not found.'
+        row = self._rows().get(search)
+        if row is None:
+            return f'ID {search} not found.'
+        return self.store.document_at(row)
+
+    def search_at(self, row: int, _id: str) -> Union[str, Document]:
+        """按位置取文档：第 row 行的 id 与 _id 一致时直接读取，否则退回按 id 查找"""
+        if (row < len(self.store) and _id not in self._added and _id not in self._deleted
+                and self.store.id_at(row) == _id):
+            return self.store.document_at(row)
+        return self.search(_id)
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        overlapping = [_id for _id in texts if _id in self._added or
+                       (_id not in self._deleted and _id in self._rows())]
+        if overlapping:
+            raise ValueError(f'Tried to add ids that already exist: {overlapping}')
+        self._added.update(texts)
+
+    def delete(self, ids: List) -> None:
+        for _id in ids:
+            if self._added.pop(_id, None) is None:
+                self._deleted.add(_id)
+
+    def __len__(self) -> int:
+        return len(self.store) - len(self._deleted) + len(self._added)
+
+
+class LazyIndexToId(MutableMapping):
+    """
+    index 位置 -> docstore id 的映射，磁盘部分按需从 ChunkStore 读取
+
+    替代 index_to_docstore_id 这个 dict，加载时不需要把所有 id 读进内存
+    """
+
+    def __init__(self, store: ChunkStore):
+        self.store = store
+        self._overrides: Dict[int, str] = {}
+
+    def __getitem__(self, position: int) -> str:
+        if position in self._overrides:
+            return self._overrides[position]
+        if 0 <= position < len(self.store):
+            return self.store.id_at(int(position))
+        raise KeyError(position)
+
+    def __setitem__(self, position: int, _id: str):
+        self._overrides[position] = _id
+
+    def __delitem__(self, position: int):
+        raise KeyError('index_to_docstore_id 的位置不能单独删除，请使用 compact()')
+
+    def __iter__(self) -> Iterator[int]:
+        yield from range(len(self.store))
+        yield from (p for p in sorted(self._overrides) if p >= len(self.store))
+
+    def __len__(self) -> int:
+        return len(self.store) + sum(1 for p in self._overrides if p >= len(self.store))
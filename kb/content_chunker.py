@@ -0,0 +1,97 @@
+"""
+内容定义的切分（content-defined chunking）
+
+RecursiveCharacterTextSplitter 按固定 chunk_size / chunk_overlap 切，文档开头插入一段后，
+后面所有切分点都跟着平移，整篇文档的文档块都变了，增量同步只能全部重新 embed。
+
+这里的切分点只由附近的内容决定：
+- 候选切分点是换行和句末标点之后的位置（不会把一句话切断）
+- 候选点前 window 个字符的哈希作为这个位置的哈希，哈希落在阈值以下就切；
+  阈值和离上一个候选点的距离成正比，句子密的文本和句子稀的文本平均块长都在 avg_size 附近，
+  空行（段落边界）的权重更高
+- 块长不小于 min_size；超过 chunk_size 时在最后一个候选点强制切，没有候选点就按长度硬切
+
+插入 / 修改一段之后，切分点最多在下一个自然切分点重新对齐，之后的文档块和原来完全一样；
+配合按内容 hash 生成的 chunk id（见 KnowledgeService.sync_documents），未变化的文档块直接复用
+"""
+import hashlib
+import re
+from typing import List, Optional
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter, TextSplitter
+
+# 段落边界 / 换行 / 中文句末标点 / 后面跟空白的英文句末标点
+_candidate_pattern = re.compile(r'\n\s*\n|\n|[。！？；]|[.!?;](?=\s)')
+
+
+class ContentDefinedSplitter(TextSplitter):
+    def __init__(self, chunk_size: int = 500, min_size: Optional[int] = None, avg_size: Optional[int] = None,
+                 window: int = 16, paragraph_weight: float = 4.0, **kwargs):
+        """
+        Args:
+            chunk_size: 块长上限（字符数）
+            min_size: 块长下限，默认 chunk_size 的 1/5
+            avg_size: 期望的平均块长，默认 chunk_size 的 3/5
+            window: 计算位置哈希用的前文长度
+            paragraph_weight: 空行处切分的概率是普通候选点的几倍
+        """
+        kwargs.setdefault('chunk_overlap', 0)
+        super().__init__(chunk_size=chunk_size, **kwargs)
+        self.min_size = min_size if min_size is not None else chunk_size // 5
+        self.avg_size = max(avg_size if avg_size is not None else chunk_size * 3 // 5, self.min_size + 1)
+        self.window = window
+        self.paragraph_weight = paragraph_weight
+
+    def _is_boundary(self, text: str, pos: int, gap: int, weight: float) -> bool:
+        # crc32 是线性的，只差几个字符的窗口哈希值分布很不均匀，这里用 blake2b
+        digest = hashlib.blake2b(text[max(0, pos - self.window):pos].encode('utf-8'), digest_size=8).digest()
+        h = int.from_bytes(digest, 'big') / 0x10000000000000000
+        return h < weight * gap / (self.avg_size - self.min_size)
+
+    def _cut_points(self, text: str) -> List[int]:
+        cuts = []
+        start = 0
+        last = 0  # start 之后最近的一个候选点
+        prev = 0  # 上一个候选点（算距离用，不随切分重置）
+        for match in _candidate_pattern.finditer(text):
+            pos = match.end()
+            while pos - start > self._chunk_size:
+                cut = last if last - start >= self.min_size else start + self._chunk_size
+                cuts.append(cut)
+                start = last = cut
+            weight = self.paragraph_weight if match.group().count('\n') > 1 else 1.0
+            if pos - start >= self.min_size and self._is_boundary(text, pos, pos - prev, weight):
+                cuts.append(pos)
+                start = pos
+            last = prev = pos
+        while len(text) - start > self._chunk_size:
+            cut = last if last - start >= self.min_size else start + self._chunk_size
+            cuts.append(cut)
+            start = last = cut
+        return cuts
+
+    def split_text(self, text: str) -> List[str]:
+        bounds = [0] + self._cut_points(text) + [len(text)]
+        chunks = []
+        for begin, end in zip(bounds, bounds[1:]):
+            chunk = text[begin:end].strip() if self._strip_whitespace else text[begin:end]
+            if not chunk:
+                continue
+            # 结尾太短的尾巴并进上一块（只影响最后一块）
+            if end == len(text) and chunks and len(chunk) < self.min_size \
+                    and len(chunks[-1]) + len(chunk) + 1 <= self._chunk_size:
+                chunks[-1] = chunks[-1] + '\n' + chunk
+                continue
+            chunks.append(chunk)
+        return chunks
+
+
+def make_splitter(chunking: str = 'recursive', chunk_size: int = 500, chunk_overlap: int = 50) -> TextSplitter:
+    """
+    chunking: 'recursive' 为 RecursiveCharacterTextSplitter（固定长度 + 重叠），'content' 为内容定义的切分
+    """
+    if chunking == 'content':
+        return ContentDefinedSplitter(chunk_size=chunk_size, length_function=len)
+    if chunking == 'recursive':
+        return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=len)
+    raise ValueError(f'不支持的切分方式: {chunking}，可选 recursive / content')
@@ -0,0 +1,90 @@
+"""
+把已有知识库的向量库从 index.pkl 转换成 mmap chunk store 格式
+
+示例：
+    python kb/convert_chunk_store.py                  # 转换 kb/kb_list 下的所有知识库
+    python kb/convert_chunk_store.py --kb private_kb wiki
+
+转换结果作为一个新快照写入并切换 CURRENT，原来的 pickle 快照按 keep 规则保留，可以用
+SnapshotStore.activate() 回滚。转换后会分别计时两种格式的加载，并检查文档块逐条一致。
+"""
+import sys
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+kb_dir = str(project_root / 'kb')
+if kb_dir not in sys.path:
+    sys.path.insert(0, kb_dir)
+
+import argparse
+import time
+
+from config.path_config import KB_LIST_DIR
+from chunk_store import chunk_store_exists
+from kb_snapshot import SnapshotStore
+from kb_vector_store import KBVectorStore
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='把知识库的 docstore 转换成 mmap chunk store',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--kb-root', type=Path, default=KB_LIST_DIR, help='知识库根目录')
+    parser.add_argument('--kb', nargs='*', help='只转换这些知识库，默认全部')
+    parser.add_argument('--keep', type=int, default=3, help='保留的快照数量')
+    return parser.parse_args()
+
+
+def load(path: Path):
+    # 只做格式转换，不需要 embedding 模型
+    start = time.perf_counter()
+    store = KBVectorStore.load_local(str(path), None, allow_dangerous_deserialization=True)
+    return store, time.perf_counter() - start
+
+
+def convert(kb_path: Path, keep: int) -> bool:
+    snapshots = SnapshotStore(kb_path / 'vector_store', keep=keep)
+    current = snapshots.current_path()
+    if current is None:
+        print(f'- {kb_path.name}: 没有向量库，跳过')
+        return False
+    if chunk_store_exists(current):
+        print(f'- {kb_path.name}: 已经是 chunk store，跳过')
+        return False
+
+    old_store, old_time = load(current)
+    old_store.docstore_format = 'chunks'
+    name = snapshots.save(old_store)
+    new_store, new_time = load(snapshots.current_path())
+
+    for i in range(old_store.index.ntotal):
+        if i in old_store.tombstones:
+            continue
+        old_doc, new_doc = old_store._doc_at(i), new_store._doc_at(i)
+        if (old_doc.page_content, old_doc.metadata) != (new_doc.page_content, new_doc.metadata):
+            if current.parent == snapshots.snapshot_path:
+                snapshots.activate(current.name)
+            else:
+                # 原来是老布局，删掉 CURRENT 即回到老布局
+                snapshots.pointer_path.unlink()
+            raise ValueError(f'{kb_path.name} 第 {i} 个文档块转换后不一致，已回滚到 {current.name}')
+
+    print(f'- {kb_path.name}: {old_store.index.ntotal} 个向量 -> 快照 {name}，'
+          f'加载耗时 pickle {old_time * 1000:.1f}ms / chunk store {new_time * 1000:.1f}ms')
+    return True
+
+
+def main():
+    args = parse_args()
+    kb_paths = sorted(p for p in args.kb_root.iterdir() if p.is_dir())
+    if args.kb:
+        kb_paths = [p for p in kb_paths if p.name in args.kb]
+    n_converted = sum(convert(p, args.keep) for p in kb_paths)
+    print(f'共转换 {n_converted} 个知识库')
+
+
+if __name__ == '__main__':
+    main()
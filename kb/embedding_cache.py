@@ -0,0 +1,172 @@
+"""
+持久化的 embedding 缓存（按内容寻址）
+
+- key = sha256(模型名 + 规范化后的文本)，同样的 chunk 文本不会第二次发给 API
+- 存在一个 sqlite 文件里，所有知识库共用；WAL 模式 + busy_timeout，多个入库进程可以同时读写
+- 条目数超过 max_entries 时按 last_access 淘汰最久未使用的条目（LRU）；
+  条目数在进程内累加估计，只在估计值超限或每 recount_every 次写入时才 COUNT(*) 校准（其他进程也会写）
+- 统计命中 / 未命中次数
+"""
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from path_config import EMBEDDING_CACHE_DIR, ensure_dir
+
+_whitespace = re.compile(r'\s+')
+# sqlite 单条语句的参数个数有限制，IN 查询分批
+_query_chunk = 500
+# 每写入多少批重新 COUNT(*) 一次，校准其他进程写入的条目
+recount_every = 100
+
+
+def normalize_text(text: str) -> str:
+    """统一 unicode 形式并压缩空白，只用于计算缓存 key"""
+    text = unicodedata.normalize('NFC', text)
+    return _whitespace.sub(' ', text).strip()
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings: Embeddings, cache_path: Optional[str] = None,
+                 model_name: Optional[str] = None, max_entries: int = 500_000):
+        """
+        Args:
+            embeddings: 被包装的 embedding 对象（如 ZHIPUEmbeddings）
+            cache_path: sqlite 文件路径，默认 EMBEDDING_CACHE_DIR/embeddings.sqlite3
+            model_name: 参与 key 计算的模型名，默认从 embeddings 上读取
+            max_entries: 缓存最大条目数，超过后按 LRU 淘汰
+        """
+        self.embeddings = embeddings
+        self.model_name = model_name or getattr(embeddings, 'model', None) \
+            or getattr(embeddings, 'model_name', None) or type(embeddings).__name__
+        if cache_path is None:
+            cache_path = ensure_dir(EMBEDDING_CACHE_DIR) / 'embeddings.sqlite3'
+        self.cache_path = str(cache_path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # 条目数的估计值（只加不减，偏大时会触发一次真正的 COUNT），None 表示还没统计过
+        self._count: Optional[int] = None
+        self._stores = 0
+        self._lock = threading.Lock()
+        # sqlite 连接不能跨线程共享，每个线程一个连接
+        self._local = threading.local()
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.cache_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        Path(self.cache_path).parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings ('
+                'key TEXT PRIMARY KEY, model TEXT, dim INTEGER, vector BLOB, last_access REAL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)')
+
+    def _key(self, text: str) -> str:
+        payload = f'{self.model_name}\x00{normalize_text(text)}'
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> dict:
+        conn = self._connect()
+        found = {}
+        for i in range(0, len(keys), _query_chunk):
+            part = keys[i:i + _query_chunk]
+            placeholders = ','.join('?' * len(part))
+            rows = conn.execute(
+                f'SELECT key, vector FROM embeddings WHERE key IN ({placeholders})', part
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        if found:
+            now = time.time()
+            with conn:
+                conn.executemany('UPDATE embeddings SET last_access = ? WHERE key = ?',
+                                 [(now, key) for key in found])
+        return found
+
+    def _store(self, items: dict):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO embeddings (key, model, dim, vector, last_access) VALUES (?, ?, ?, ?, ?)',
+                [(key, self.model_name, len(vec), np.asarray(vec, dtype=np.float32).tobytes(), now)
+                 for key, vec in items.items()]
+            )
+        self._evict(len(items))
+
+    def _evict(self, n_new: int):
+        """超出上限时淘汰最久未访问的条目，多删 10% 避免每次写入都触发；大表上 COUNT(*) 是全表扫描，不每次都做"""
+        with self._lock:
+            self._stores += 1
+            if self._count is not None:
+                self._count += n_new
+            if self._count is not None and self._count <= self.max_entries and self._stores % recount_every:
+                return
+        conn = self._connect()
+        count = conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+        if count > self.max_entries:
+            n_delete = count - int(self.max_entries * 0.9)
+            with conn:
+                conn.execute(
+                    'DELETE FROM embeddings WHERE key IN '
+                    '(SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)', (n_delete,)
+                )
+            count -= n_delete
+            print(f'[embedding缓存] 淘汰 {n_delete} 条最久未使用的向量')
+        with self._lock:
+            self._count = count
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        cached = self._lookup(list(set(keys)))
+        # 未命中的文本去重后再调用 API
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        n_hit = sum(1 for key in keys if key in cached)
+        with self._lock:
+            self.hits += n_hit
+            self.misses += len(keys) - n_hit
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_items = dict(zip(missing.keys(), vectors))
+            self._store(new_items)
+            cached.update(new_items)
+        return [list(cached[key]) for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        # query 基本不重复，直接透传
+        return self.embeddings.embed_query(text)
+
+    def stats(self) -> dict:
+        conn = self._connect()
+        size = conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            'model': self.model_name,
+            'entries': size,
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
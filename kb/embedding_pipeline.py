@@ -0,0 +1,315 @@
+"""
+并发 embedding 流水线
+
+- 同时保持多个 embedding 批次在途（线程池），在途批次数由 max_in_flight 限制
+- 结果按 chunk 的输入顺序写入 FAISS，index 位置与输入顺序一致
+- 统计吞吐（chunks/s, tokens/s）
+- 批次按 token 预算打包（AdaptiveBatcher），批大小根据延迟和失败情况自动增减；
+  批次失败时二分重试，1 个坏文档块只多花约 2*log2(n) 次调用，而不是逐个重试的 n 次
+- 输入可以是生成器，配合 iter_prefetch 做 加载 -> 切分 -> embed -> 写入 的流式入库，
+  峰值内存只和批次大小、队列长度有关，和语料总量无关
+- embed_model 只需要实现 embed_documents / embed_query，
+  可以直接换成 langchain_core.embeddings.FakeEmbeddings 这类本地假模型来测试
+"""
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from token_utils import count_tokens
+
+
+def iter_batches(docs: Iterable[Document], batch_size: int) -> Iterator[List[Document]]:
+    """把任意可迭代对象切成固定大小的批次，不需要先转成 list"""
+    it = iter(docs)
+    while True:
+        batch = list(islice(it, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class AdaptiveBatcher:
+    """
+    按 token 预算打包批次，批大小随观测到的延迟和失败调整（加性增、乘性减）
+
+    - 一个批次的文档块数不超过 size，token 总数不超过 max_tokens（单个超长文档块自成一批）
+    - 成功且延迟低于 target_latency: size += step，直到 max_size
+    - 延迟超过 target_latency: size 缩小到 3/4；失败: size 减半，不小于 min_size
+    record 在 embedding 线程里调用，batches 在提交批次的线程里读 size，用锁保护
+    """
+
+    def __init__(self, size: int = 32, max_tokens: int = 16384, min_size: int = 1, max_size: int = 64,
+                 target_latency: float = 2.0, step: int = 4):
+        self.size = max(min_size, min(size, max_size))
+        self.max_tokens = max_tokens
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.step = step
+        self._lock = threading.Lock()
+
+    def batches(self, docs: Iterable[Document]) -> Iterator[Tuple[List[Document], List[int]]]:
+        """产出 (批次, 每个文档块的 token 数)"""
+        batch, tokens, total = [], [], 0
+        for doc in docs:
+            n = count_tokens(doc.page_content)
+            if batch and (len(batch) >= self.size or total + n > self.max_tokens):
+                yield batch, tokens
+                batch, tokens, total = [], [], 0
+            batch.append(doc)
+            tokens.append(n)
+            total += n
+        if batch:
+            yield batch, tokens
+
+    def record(self, latency: float, ok: bool = True):
+        with self._lock:
+            if not ok:
+                self.size = max(self.min_size, self.size // 2)
+            elif latency > self.target_latency:
+                self.size = max(self.min_size, self.size * 3 // 4)
+            else:
+                self.size = min(self.max_size, self.size + self.step)
+
+
+_end = object()
+
+
+class _ProducerError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def iter_prefetch(iterable: Iterable, maxsize: int = 256) -> Iterator:
+    """
+    在后台线程里消费 iterable，结果放进有界队列
+
+    用于把 加载/切分（生产者）和 embedding（消费者）并行起来；
+    队列满时生产者阻塞，所以内存里最多只有 maxsize 个待处理元素。
+    生产者抛出的异常会在消费端重新抛出。
+    """
+    q = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_end)
+        except BaseException as e:
+            put(_ProducerError(e))
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = q.get()
+            if item is _end:
+                return
+            if isinstance(item, _ProducerError):
+                raise item.error
+            yield item
+    finally:
+        # 消费端提前退出时通知生产者停止
+        stop.set()
+
+
+class PipelineStats:
+    """一次 embedding 流水线运行的统计信息"""
+
+    def __init__(self):
+        self.chunks = 0
+        self.tokens = 0
+        self.failed = 0
+        self.batches = 0
+        #embedding API 调用次数（包括失败批次二分重试的调用）
+        self.calls = 0
+        self.elapsed = 0.0
+        #成功写入向量库的 docstore id，按写入顺序
+        self.ids = []
+
+    @property
+    def chunks_per_s(self) -> float:
+        return self.chunks / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def tokens_per_s(self) -> float:
+        return self.tokens / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'chunks': self.chunks,
+            'tokens': self.tokens,
+            'failed': self.failed,
+            'batches': self.batches,
+            'calls': self.calls,
+            'elapsed': self.elapsed,
+            'chunks_per_s': self.chunks_per_s,
+            'tokens_per_s': self.tokens_per_s,
+        }
+
+    def __repr__(self):
+        return (f'PipelineStats(chunks={self.chunks}, failed={self.failed}, '
+                f'{self.chunks_per_s:.1f} chunks/s, {self.tokens_per_s:.1f} tokens/s)')
+
+
+class EmbeddingPipeline:
+    def __init__(self, embed_model, batch_size: int = 32, max_in_flight: int = 4, store_cls=FAISS,
+                 max_batch_tokens: int = 16384, max_batch_size: int = 64, target_latency: float = 2.0):
+        """
+        Args:
+            embed_model: 实现了 embed_documents 的 embedding 对象
+            batch_size: 每次 API 调用的初始文档块数量，之后由 AdaptiveBatcher 调整
+            max_in_flight: 同时在途的批次数上限（即并发上限）
+            store_cls: 新建向量库时使用的类（FAISS 或其子类）
+            max_batch_tokens: 每个批次的 token 上限
+            max_batch_size: 批大小上限（embedding API 单次请求的条数限制）
+            target_latency: 单个批次期望的最长耗时（秒），超过就缩小批次
+        """
+        if max_in_flight < 1:
+            raise ValueError('max_in_flight 至少为 1')
+        self.embed_model = embed_model
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.store_cls = store_cls
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.target_latency = target_latency
+
+    def _embed_bisect(self, docs: List[Document]) -> Tuple[List[Document], List[List[float]], int]:
+        """把失败的批次对半拆开分别重试，只继续拆还失败的那一半；返回 (成功的文档, 向量, 调用次数)"""
+        mid = len(docs) // 2
+        kept, vectors, calls = [], [], 0
+        for part in (docs[:mid], docs[mid:]):
+            if not part:
+                continue
+            calls += 1
+            try:
+                vectors.extend(self.embed_model.embed_documents([doc.page_content for doc in part]))
+                kept.extend(part)
+            except Exception as e:
+                if len(part) == 1:
+                    print(f'  - 文档跳过: {e}')
+                    continue
+                part_kept, part_vectors, part_calls = self._embed_bisect(part)
+                kept.extend(part_kept)
+                vectors.extend(part_vectors)
+                calls += part_calls
+        return kept, vectors, calls
+
+    def _embed_batch(self, batcher: AdaptiveBatcher, batch: List[Document],
+                     tokens: List[int]) -> Tuple[List[Document], List[List[float]], int, int, int]:
+        """返回 (成功的文档, 向量, 跳过的文档数, 成功文档的 token 数, API 调用次数)"""
+        texts = [doc.page_content for doc in batch]
+        start = time.perf_counter()
+        try:
+            vectors = self.embed_model.embed_documents(texts)
+        except Exception as e:
+            batcher.record(time.perf_counter() - start, ok=False)
+            if len(batch) == 1:
+                print(f'  - 文档跳过: {e}')
+                return [], [], 1, 0, 1
+            print(f'批次 embedding 失败: {e}，二分重试')
+            kept, vectors, calls = self._embed_bisect(batch)
+            kept_ids = {id(doc) for doc in kept}
+            n_tokens = sum(n for doc, n in zip(batch, tokens) if id(doc) in kept_ids)
+            return kept, vectors, len(batch) - len(kept), n_tokens, calls + 1
+        batcher.record(time.perf_counter() - start)
+        return batch, vectors, 0, sum(tokens), 1
+
+    def make_batcher(self) -> AdaptiveBatcher:
+        return AdaptiveBatcher(self.batch_size, max_tokens=self.max_batch_tokens,
+                               max_size=self.max_batch_size, target_latency=self.target_latency)
+
+    def iter_embeddings(self, docs: Iterable[Document], batcher: Optional[AdaptiveBatcher] = None
+                        ) -> Iterator[Tuple[List[Document], List[List[float]], int, int, int]]:
+        """
+        按输入顺序产出 (batch_docs, vectors, skipped, tokens, calls)
+
+        提交新批次前先检查在途数量，超过 max_in_flight 就等待最早的批次完成，
+        所以内存中最多只有 max_in_flight 个批次的结果。
+        批大小每次运行从 batch_size 开始，按前面批次的延迟 / 失败调整；
+        batcher 属于这一次运行，同一个 EmbeddingPipeline 并发运行时互不影响
+        """
+        batcher = batcher or self.make_batcher()
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            pending = deque()
+            for batch, tokens in batcher.batches(docs):
+                if len(pending) >= self.max_in_flight:
+                    yield pending.popleft().result()
+                pending.append(executor.submit(self._embed_batch, batcher, batch, tokens))
+            while pending:
+                yield pending.popleft().result()
+
+    def run(self, docs: Iterable[Document], vector_store: Optional[FAISS] = None,
+            total: Optional[int] = None, store_kwargs: Optional[dict] = None,
+            store_cls: Optional[type] = None) -> Tuple[Optional[FAISS], PipelineStats]:
+        """
+        embed 所有文档块并按顺序写入向量库
+
+        Args:
+            docs: 文档块（list 或生成器）
+            vector_store: 已有向量库，为 None 时用第一批结果创建
+            total: 文档块总数，仅用于打印进度
+            store_kwargs: 新建向量库时传给 store_cls.from_embeddings 的额外参数（如 index_spec）
+            store_cls: 新建向量库用的类，默认是构造时传入的 store_cls
+
+        Returns:
+            (写入后的向量库, 这次运行的统计)；所有文档都失败时向量库是传入的 vector_store（可能为 None）
+            统计不挂在实例上，共享的 EmbeddingPipeline 被并发调用时各自拿到自己的结果
+        """
+        stats = PipelineStats()
+        batcher = self.make_batcher()
+        start = time.perf_counter()
+        for batch, vectors, skipped, tokens, calls in self.iter_embeddings(docs, batcher):
+            stats.batches += 1
+            stats.failed += skipped
+            stats.calls += calls
+            if not batch:
+                continue
+            texts = [doc.page_content for doc in batch]
+            metadatas = [doc.metadata for doc in batch]
+            # Document 自带 id 时沿用，否则生成 uuid（和 FAISS 默认行为一致）
+            if all(getattr(doc, 'id', None) for doc in batch):
+                ids = [doc.id for doc in batch]
+            else:
+                ids = [str(uuid.uuid4()) for _ in batch]
+            if vector_store is None:
+                vector_store = (store_cls or self.store_cls).from_embeddings(
+                    list(zip(texts, vectors)),
+                    self.embed_model,
+                    metadatas=metadatas,
+                    ids=ids,
+                    **(store_kwargs or {})
+                )
+                stats.ids.extend(ids)
+            else:
+                stats.ids.extend(vector_store.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids))
+            stats.chunks += len(batch)
+            stats.tokens += tokens
+            progress = f'{stats.chunks}/{total}' if total else f'{stats.chunks}'
+            print(f'已处理 {progress} 个文档块')
+        # 需要训练的索引（IVF 等）可能还缓存着向量，结束时全部写入
+        if vector_store is not None and hasattr(vector_store, 'flush'):
+            vector_store.flush()
+        stats.elapsed = time.perf_counter() - start
+        print(f'embedding 完成: {stats.chunks} 个文档块, 失败 {stats.failed} 个, API 调用 {stats.calls} 次, '
+              f'{stats.chunks_per_s:.1f} chunks/s, {stats.tokens_per_s:.1f} tokens/s, 最终批大小 {batcher.size}')
+        return vector_store, stats
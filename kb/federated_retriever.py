@@ -0,0 +1,146 @@
+"""
+跨知识库联合检索（federated search）
+
+一个查询同时检索多个知识库（例如 public 的 wiki 和 private 的 private_kb、技术文档）：
+- 查询只 embed 一次，各个知识库用同一个查询向量检索（所有知识库用的是同一个 embedding 模型）
+- 每个知识库的检索放到线程池里并发执行（faiss 检索时释放 GIL），总耗时接近最慢的那个知识库
+- 向量库通过 KnowledgeService.search_kb 从注册表里取（见 kb_registry.py），不会每次都从磁盘加载
+- 各知识库的分数尺度不同（L2 距离 / 内积、不同的索引类型），合并前先归一化:
+    - fusion='rrf':   倒数排名融合，score = Σ weight / (rrf_k + rank)，只看名次，不受分数尺度影响
+    - fusion='score': 每个知识库的分数 min-max 归一化到 [0, 1]（距离先取反），再按 weight 加权
+- 相同内容的文档块在多个知识库里都出现时合并成一条，分数累加
+- 每个结果是新的 Document，metadata 里加 kb_source（来自哪个知识库）和 fusion_score，
+  不修改向量库里缓存的 Document
+- 各知识库的检索耗时由调用方传入的 timings 字典接收（invoke(query, timings={})），
+  不挂在实例上，并发请求互不覆盖
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+from langchain_core.runnables import Runnable
+
+fusion_methods = ('rrf', 'score')
+
+
+def _similarities(vector_store, scores: List[float]) -> List[float]:
+    """统一成越大越相似"""
+    if vector_store.distance_strategy in (DistanceStrategy.MAX_INNER_PRODUCT, DistanceStrategy.JACCARD):
+        return [float(s) for s in scores]
+    return [-float(s) for s in scores]
+
+
+def min_max_normalize(values: List[float]) -> List[float]:
+    if not values:
+        return []
+    low, high = min(values), max(values)
+    if high == low:
+        return [1.0] * len(values)
+    return [(v - low) / (high - low) for v in values]
+
+
+class FederatedRetriever(Runnable):
+    def __init__(self, knowledge_service, kb_names: Sequence[str], k: int = 3,
+                 fetch_k: Optional[int] = None, fusion: str = 'rrf', rrf_k: int = 60,
+                 weights: Optional[Dict[str, float]] = None, search_kwargs: Optional[dict] = None):
+        """
+        Args:
+            knowledge_service: KnowledgeService，用它的 embedding 模型和 search_kb
+            kb_names: 要联合检索的知识库
+            k: 合并后返回的文档块数
+            fetch_k: 每个知识库取多少个候选，默认 2 * k
+            fusion: 'rrf' 或 'score'
+            rrf_k: RRF 的平滑常数，越大名次靠后的结果权重下降得越慢
+            weights: 知识库权重，默认都是 1
+            search_kwargs: 传给每个知识库 similarity_search 的额外参数（filter / nprobe 等）
+        """
+        if fusion not in fusion_methods:
+            raise ValueError(f'不支持的融合方式: {fusion}，可选 {fusion_methods}')
+        if not kb_names:
+            raise ValueError('至少需要一个知识库')
+        self.knowledge_service = knowledge_service
+        self.embed_model = knowledge_service.document_processor.embed_model
+        self.kb_names = list(kb_names)
+        self.k = k
+        self.fetch_k = fetch_k or 2 * k
+        self.fusion = fusion
+        self.rrf_k = rrf_k
+        self.weights = weights or {}
+        self.search_kwargs = search_kwargs or {}
+        self._executor = ThreadPoolExecutor(max_workers=len(self.kb_names), thread_name_prefix='federated')
+
+    def _search_one(self, kb_name: str, vector: List[float]) -> Tuple[str, list, float]:
+        start = time.perf_counter()
+        try:
+            vector_store = self.knowledge_service.search_kb(kb_name)
+            if not vector_store:
+                return kb_name, [], time.perf_counter() - start
+            hits = vector_store.similarity_search_with_score_by_vector(vector, k=self.fetch_k, **self.search_kwargs)
+            docs = [doc for doc, _ in hits]
+            scores = _similarities(vector_store, [score for _, score in hits])
+        except Exception as e:
+            # 单个知识库出错不影响其他知识库的结果
+            print(f'[联合检索] 知识库{kb_name}检索失败: {e}')
+            return kb_name, [], time.perf_counter() - start
+        return kb_name, list(zip(docs, scores)), time.perf_counter() - start
+
+    def fuse(self, results: List[Tuple[str, list]]) -> List[Document]:
+        """results: [(知识库名, [(Document, 越大越相似的分数), ...]), ...]，每个知识库内按相似度降序"""
+        fused: Dict[str, list] = {}
+        for kb_name, hits in results:
+            weight = self.weights.get(kb_name, 1.0)
+            if self.fusion == 'rrf':
+                contributions = [weight / (self.rrf_k + rank) for rank in range(1, len(hits) + 1)]
+            else:
+                contributions = [weight * s for s in min_max_normalize([score for _, score in hits])]
+            for (doc, _), contribution in zip(hits, contributions):
+                entry = fused.get(doc.page_content)
+                if entry is None:
+                    fused[doc.page_content] = [doc, kb_name, contribution, contribution]
+                    continue
+                entry[2] += contribution
+                if contribution > entry[3]:
+                    # 同一内容在多个知识库里出现，kb_source 记贡献最大的那个
+                    entry[0], entry[1], entry[3] = doc, kb_name, contribution
+        ranked = sorted(fused.values(), key=lambda entry: entry[2], reverse=True)[:self.k]
+        return [Document(page_content=doc.page_content,
+                         metadata={**doc.metadata, 'kb_source': kb_name, 'fusion_score': score})
+                for doc, kb_name, score, _ in ranked]
+
+    @staticmethod
+    def _collect(searched, timings: Dict[str, float]) -> List[Tuple[str, list]]:
+        results = []
+        for kb_name, hits, elapsed in searched:
+            timings[kb_name] = elapsed
+            results.append((kb_name, hits))
+        return results
+
+    def invoke(self, query: str, config=None, timings: Optional[Dict[str, float]] = None,
+               **kwargs) -> List[Document]:
+        """timings: 传入字典时写入每个知识库的检索耗时和总耗时 total（秒）"""
+        start = time.perf_counter()
+        timings = timings if timings is not None else {}
+        vector = self.embed_model.embed_query(query)
+        futures = [self._executor.submit(self._search_one, kb_name, vector) for kb_name in self.kb_names]
+        results = self._collect((future.result() for future in futures), timings)
+        timings['total'] = time.perf_counter() - start
+        return self.fuse(results)
+
+    async def ainvoke(self, query: str, config=None, timings: Optional[Dict[str, float]] = None,
+                      **kwargs) -> List[Document]:
+        start = time.perf_counter()
+        timings = timings if timings is not None else {}
+        loop = asyncio.get_running_loop()
+        vector = await loop.run_in_executor(self._executor, self.embed_model.embed_query, query)
+        searched = await asyncio.gather(*[
+            loop.run_in_executor(self._executor, self._search_one, kb_name, vector) for kb_name in self.kb_names
+        ])
+        results = self._collect(searched, timings)
+        timings['total'] = time.perf_counter() - start
+        return self.fuse(results)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
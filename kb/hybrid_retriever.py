@@ -0,0 +1,96 @@
+"""
+BM25 + 向量的混合检索
+
+- 关键词检索（向量库的 BM25 倒排索引）和向量检索并行执行：关键词检索在线程池里跑，
+  当前线程同时做 query embedding 和 faiss 检索，总耗时约等于两者中较慢的一个
+- 两路结果按倒数排名融合（RRF）：score = Σ weight / (rrf_k + rank)，BM25 分数和向量距离尺度不同，只看名次
+- 关键词命中标识符 / API 名（assertRaises、git rebase），向量检索负责语义相近的表述，
+  不用再靠加大 k 和更贵的 rerank 去补召回
+
+source 可以是向量库，也可以是 HotSwapRetriever（每次检索时取它当前的 vector_store，跟着热切换）
+同一个 HybridRetriever 会被多个请求并发调用，两路耗时不挂在实例上，由调用方传入的 timings 字典接收
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from langchain_core.documents import Document
+from langchain_core.runnables import Runnable
+from langchain_core.runnables.config import run_in_executor
+
+
+class HybridRetriever(Runnable):
+    def __init__(self, source, k: int = 3, fetch_k: int = 20, rrf_k: int = 60,
+                 bm25_weight: float = 1.0, vector_weight: float = 1.0,
+                 search_kwargs: Optional[dict] = None):
+        """
+        Args:
+            source: KBVectorStore 或 HotSwapRetriever
+            k: 融合后返回的文档块数
+            fetch_k: 每一路取多少个候选
+            rrf_k: RRF 的平滑常数
+            bm25_weight / vector_weight: 两路结果的权重
+            search_kwargs: 传给向量检索的额外参数（filter / nprobe 等）
+        """
+        self.source = source
+        self.k = k
+        self.fetch_k = fetch_k
+        self.rrf_k = rrf_k
+        self.bm25_weight = bm25_weight
+        self.vector_weight = vector_weight
+        self.search_kwargs = search_kwargs or {}
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='hybrid')
+
+    @property
+    def vector_store(self):
+        return getattr(self.source, 'vector_store', self.source)
+
+    def _bm25_search(self, vector_store, query: str, timings: Dict[str, float]):
+        start = time.perf_counter()
+        hits = vector_store.bm25_search_with_score(query, k=self.fetch_k, filter=self.search_kwargs.get('filter'))
+        timings['bm25'] = time.perf_counter() - start
+        return hits
+
+    def _vector_search(self, vector_store, query: str, timings: Dict[str, float], vector=None):
+        start = time.perf_counter()
+        if vector is None:
+            vector = vector_store.embeddings.embed_query(query)
+        hits = vector_store.similarity_search_with_score_by_vector(vector, k=self.fetch_k, **self.search_kwargs)
+        timings['vector'] = time.perf_counter() - start
+        return hits
+
+    def fuse(self, bm25_hits, vector_hits) -> List[Document]:
+        fused: Dict[str, list] = {}
+        for hits, weight, source in ((bm25_hits, self.bm25_weight, 'bm25'),
+                                     (vector_hits, self.vector_weight, 'vector')):
+            for rank, (doc, _) in enumerate(hits, start=1):
+                entry = fused.setdefault(doc.page_content, [doc, 0.0, []])
+                entry[1] += weight / (self.rrf_k + rank)
+                entry[2].append(source)
+        ranked = sorted(fused.values(), key=lambda entry: entry[1], reverse=True)[:self.k]
+        # 返回新的 Document，不修改向量库里缓存的对象
+        return [Document(page_content=doc.page_content,
+                         metadata={**doc.metadata, 'fusion_score': score, 'retrieved_by': sources})
+                for doc, score, sources in ranked]
+
+    def search(self, query: str, vector=None, timings: Optional[Dict[str, float]] = None) -> List[Document]:
+        """
+        vector 是预先算好的查询向量（benchmark 用），为空时现场 embed；
+        传入 timings 字典时写入这一次检索两路各自的耗时（秒）
+        """
+        timings = timings if timings is not None else {}
+        vector_store = self.vector_store
+        if vector_store is None:
+            raise ValueError('向量库还没有可用的快照')
+        bm25_future = self._executor.submit(self._bm25_search, vector_store, query, timings)
+        vector_hits = self._vector_search(vector_store, query, timings, vector)
+        return self.fuse(bm25_future.result(), vector_hits)
+
+    def invoke(self, query: str, config=None, **kwargs) -> List[Document]:
+        return self.search(query)
+
+    async def ainvoke(self, query: str, config=None, **kwargs) -> List[Document]:
+        return await run_in_executor(config, self.search, query)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
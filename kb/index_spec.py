@@ -0,0 +1,197 @@
+"""
+知识库的 faiss 索引配置（index spec）
+
+存在 metadata.json 的 index_spec 字段里，例如:
+    {"type": "hnsw", "m": 32, "ef_construction": 200, "ef_search": 64}
+    {"type": "ivf_pq", "nlist": 1024, "nprobe": 16, "pq_m": 16, "nbits": 8}
+
+支持的类型:
+- flat:      暴力搜索，结果精确，耗时随文档块数线性增长（LangChain 默认）
+- ivf_flat:  倒排 + 原始向量，需要训练；nprobe 越大越准越慢
+- hnsw:      图索引，不需要训练；ef_search 越大越准越慢
+- ivf_pq:    倒排 + 乘积量化，需要训练，内存最小；nprobe 同上
+
+向量存储精度（flat / ivf_flat / hnsw 有效，ivf_pq 本身就是量化的）:
+- storage: 'float32'（默认）/ 'fp16'（内存减半，几乎无损）/ 'int8'（内存 1/4，需要训练取值范围）
+- rescore: True 时额外保存一份 float32 原始向量（磁盘 + memmap，不占常驻内存），
+  先从量化索引取 k * rescore_factor 个候选，再用原始向量精确打分取 top-k
+
+二值粗排（任意类型都可以打开）:
+- binary: True 时额外维护一份按符号二值化的向量（每维 1 bit，faiss.IndexBinaryFlat），
+  检索时先用 Hamming 距离取 binary_candidates 个候选，再用全精度向量精排；
+  可以在检索时用 search_kwargs={'binary': False} 临时关闭
+
+关键词检索:
+- bm25: True（默认）时入库的同时建一份 BM25 倒排索引（见 bm25_index.py），给混合检索用
+
+metadata 过滤:
+- metadata_fields: 建倒排索引的 metadata 字段（见 metadata_index.py），按这些字段过滤时检索只在满足条件的位置里进行；
+  默认是 private_kb_parse 产出的 kb_type / category / file_name / doc_title / section_title，以及删除时用的 source
+
+nprobe / ef_search 是检索时的默认值，也可以在检索时覆盖:
+    vector_store.as_retriever(search_kwargs={'k': 3, 'nprobe': 32})
+"""
+from typing import Optional, Union
+
+import faiss
+import numpy as np
+
+index_types = ('flat', 'ivf_flat', 'hnsw', 'ivf_pq')
+
+default_params = {
+    'flat': {},
+    'ivf_flat': {'nlist': 1024, 'nprobe': 16},
+    'hnsw': {'m': 32, 'ef_construction': 200, 'ef_search': 64},
+    'ivf_pq': {'nlist': 1024, 'nprobe': 16, 'pq_m': 16, 'nbits': 8},
+}
+
+default_metadata_fields = ('kb_type', 'category', 'file_name', 'doc_title', 'section_title', 'source')
+
+storage_types = {
+    'float32': None,
+    'fp16': faiss.ScalarQuantizer.QT_fp16,
+    'int8': faiss.ScalarQuantizer.QT_8bit,
+}
+
+# faiss 建议每个聚类中心至少 39 个训练样本
+_points_per_centroid = 39
+# int8 标量量化只需要统计每一维的取值范围，不需要很多样本
+_sq_train_size = 10000
+
+
+def normalize_index_spec(spec: Union[str, dict, None]) -> dict:
+    """
+    补全默认参数并校验
+
+    spec 可以是 None（flat）、类型名（'HNSW'、'IVF-PQ' 等，大小写和 -/_ 不敏感）或字典
+    """
+    if spec is None:
+        spec = {}
+    elif isinstance(spec, str):
+        spec = {'type': spec}
+    spec = dict(spec)
+    index_type = str(spec.get('type', 'flat')).lower().replace('-', '_')
+    if index_type == 'ivf':
+        index_type = 'ivf_flat'
+    if index_type not in index_types:
+        raise ValueError(f'不支持的索引类型: {spec.get("type")}，可选 {index_types}')
+    result = {'type': index_type, **default_params[index_type], 'storage': 'float32', 'rescore': False}
+    result.update({k: v for k, v in spec.items() if k != 'type'})
+    result['storage'] = str(result['storage']).lower()
+    if result['storage'] not in storage_types:
+        raise ValueError(f'不支持的向量存储精度: {result["storage"]}，可选 {tuple(storage_types)}')
+    if result['rescore']:
+        result.setdefault('rescore_factor', 4)
+    result.setdefault('binary', False)
+    result.setdefault('bm25', True)
+    result['metadata_fields'] = list(result.get('metadata_fields', default_metadata_fields) or [])
+    if result['binary']:
+        result.setdefault('binary_candidates', 256)
+    return result
+
+
+def train_size(spec: dict) -> int:
+    """需要训练的索引攒够多少个向量再训练；不需要训练的返回 0"""
+    needs_sq_training = spec['storage'] == 'int8' and spec['type'] != 'ivf_pq'
+    if spec['type'] not in ('ivf_flat', 'ivf_pq') and not needs_sq_training:
+        return 0
+    if spec.get('train_size'):
+        return int(spec['train_size'])
+    if spec['type'] in ('flat', 'hnsw'):
+        return _sq_train_size
+    size = spec['nlist'] * _points_per_centroid
+    if spec['type'] == 'ivf_pq':
+        size = max(size, (1 << spec['nbits']) * _points_per_centroid)
+    return size
+
+
+def build_index(spec: dict, dim: int, metric: int = faiss.METRIC_L2,
+                n_train: Optional[int] = None) -> faiss.Index:
+    """
+    按 spec 创建空索引
+
+    n_train 是实际可用的训练样本数；样本不够时自动调小 nlist，
+    IVF-PQ 的样本不够训练码本时退化为 IVF-Flat
+    """
+    index_type = spec['type']
+    qtype = storage_types[spec['storage']]
+    if index_type == 'flat':
+        if qtype is not None:
+            return faiss.IndexScalarQuantizer(dim, qtype, metric)
+        return faiss.IndexFlatIP(dim) if metric == faiss.METRIC_INNER_PRODUCT else faiss.IndexFlatL2(dim)
+    if index_type == 'hnsw':
+        if qtype is not None:
+            index = faiss.IndexHNSWSQ(dim, qtype, spec['m'], metric)
+        else:
+            index = faiss.IndexHNSWFlat(dim, spec['m'], metric)
+        index.hnsw.efConstruction = spec['ef_construction']
+        index.hnsw.efSearch = spec['ef_search']
+        return index
+
+    nlist = spec['nlist']
+    if n_train is not None:
+        nlist = max(1, min(nlist, n_train // _points_per_centroid))
+        if nlist != spec['nlist']:
+            print(f'[索引] 训练样本只有 {n_train} 个，nlist 从 {spec["nlist"]} 调整为 {nlist}')
+    if index_type == 'ivf_pq' and n_train is not None and n_train < (1 << spec['nbits']):
+        print(f'[索引] 训练样本不足以训练 PQ 码本，退化为 ivf_flat')
+        index_type = 'ivf_flat'
+
+    quantizer = faiss.IndexFlatIP(dim) if metric == faiss.METRIC_INNER_PRODUCT else faiss.IndexFlatL2(dim)
+    if index_type == 'ivf_flat' and qtype is not None:
+        index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, qtype, metric)
+    elif index_type == 'ivf_flat':
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+    else:
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_m(spec['pq_m'], dim), spec['nbits'], metric)
+    # faiss 的 python 封装会在 index 上保存 quantizer 的引用，不用手动管理生命周期
+    index.nprobe = spec['nprobe']
+    return index
+
+
+def _pq_m(pq_m: int, dim: int) -> int:
+    """PQ 子空间数必须整除维度，取不超过 pq_m 的最大约数"""
+    for m in range(min(pq_m, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def search_parameters(index: faiss.Index, spec: dict, selector=None,
+                      nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """
+    构造带查询参数的 faiss SearchParameters；没有任何参数需要传时返回 None
+
+    IVF 类索引必须用 SearchParametersIVF，HNSW 用 SearchParametersHNSW，否则参数会被忽略
+    """
+    if faiss.try_extract_index_ivf(index) is not None:
+        nprobe = nprobe or spec.get('nprobe')
+        if nprobe is None and selector is None:
+            return None
+        params = faiss.SearchParametersIVF()
+        if nprobe is not None:
+            params.nprobe = int(nprobe)
+    elif isinstance(index, faiss.IndexHNSW):
+        ef_search = ef_search or spec.get('ef_search')
+        if ef_search is None and selector is None:
+            return None
+        params = faiss.SearchParametersHNSW()
+        if ef_search is not None:
+            params.efSearch = int(ef_search)
+    elif selector is None:
+        return None
+    else:
+        params = faiss.SearchParameters()
+    if selector is not None:
+        params.sel = selector
+    return params
+
+
+def binary_dim(dim: int) -> int:
+    """二值码的位数，faiss 要求是 8 的倍数"""
+    return (dim + 7) // 8 * 8
+
+
+def binarize(vectors) -> np.ndarray:
+    """按符号二值化并打包成 uint8，每 8 维一个字节"""
+    return np.packbits(np.asarray(vectors) > 0, axis=1)
@@ -0,0 +1,108 @@
+"""
+知识库源文件清单（manifest）
+
+记录每个源文件的内容 hash 以及它产生的 chunk id，用于增量同步：
+只 embed 新增 / 修改过的文件，删除已移除 / 修改过的文件对应的向量。
+
+manifest.json 格式:
+{
+  "files": {
+    "01_Python基础语法.md": {"hash": "...", "size": 1234, "mtime": ..., "chunk_ids": ["01_Python基础语法.md_c0", ...]},
+    ...
+  },
+  "update_time": "..."
+}
+"""
+import hashlib
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+
+def file_hash(file_path) -> str:
+    """流式计算文件 sha256，大文件不会一次读进内存"""
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class KBManifest:
+    file_name = 'manifest.json'
+
+    def __init__(self, kb_path):
+        self.path = Path(kb_path) / self.file_name
+        self.files: Dict[str, dict] = {}
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.files = json.load(f).get('files', {})
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def save(self):
+        """先写临时文件再 os.replace，写到一半崩溃也不会损坏 manifest"""
+        tmp_path = self.path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'files': self.files, 'update_time': datetime.now().isoformat()},
+                      f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def diff(self, file_paths: Iterable[Path]) -> Tuple[List[Path], List[Path], List[str], Dict[str, str]]:
+        """
+        对比当前源文件与 manifest
+
+        Returns:
+            (新增文件, 修改过的文件, 已删除的文件名, {文件名: 当前hash})
+        """
+        added, changed, hashes = [], [], {}
+        seen = set()
+        for path in file_paths:
+            path = Path(path)
+            name = path.name
+            seen.add(name)
+            entry = self.files.get(name)
+            stat = path.stat()
+            # 大小和修改时间都没变就认为没改，不用重新算 hash；没有 hash 的是上次没处理完的文件，必须重新比较
+            if entry and entry.get('hash') and entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime:
+                continue
+            current = file_hash(path)
+            hashes[name] = current
+            if entry is None:
+                added.append(path)
+            elif entry.get('hash') != current:
+                changed.append(path)
+            else:
+                # 只是被 touch 过，内容没变
+                entry['mtime'] = stat.st_mtime
+        removed = [name for name in self.files if name not in seen]
+        return added, changed, removed, hashes
+
+    def chunk_ids(self, names: Iterable[str]) -> List[str]:
+        ids = []
+        for name in names:
+            ids.extend(self.files.get(name, {}).get('chunk_ids', []))
+        return ids
+
+    def record(self, path: Path, chunk_ids: List[str], digest: str):
+        """digest 为空表示文件没处理完：不记大小和修改时间，下次 diff 一定会把它当作修改过的文件"""
+        path = Path(path)
+        entry = {
+            'hash': digest,
+            'chunk_ids': chunk_ids,
+            'sync_time': datetime.now().isoformat(),
+        }
+        if digest:
+            stat = path.stat()
+            entry['size'] = stat.st_size
+            entry['mtime'] = stat.st_mtime
+        self.files[path.name] = entry
+
+    def forget(self, name: str):
+        self.files.pop(name, None)
+
+    def total_chunks(self) -> int:
+        return sum(len(entry.get('chunk_ids', [])) for entry in self.files.values())
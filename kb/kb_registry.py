@@ -0,0 +1,179 @@
+"""
+进程内的知识库注册表：缓存最近使用的向量库，按内存预算做 LRU 淘汰
+
+- get(vector_path, loader): 命中且磁盘上的快照没变时直接返回已加载的向量库，否则重新加载
+- 快照是否变化看 CURRENT 指向的快照名（见 kb_snapshot.py）；老布局没有快照名，看 index.faiss 的修改时间
+- 向量库的内存按快照目录（含分片子目录）的文件大小估算（faiss 索引 + chunk store / index.pkl + 原始向量等），
+  总和超过 memory_budget_mb 时从最久没用的开始淘汰；单个超过预算的向量库也会加载，只是不会和别的一起常驻
+- 同一个向量库同时有多个请求未命中时只加载一次，其他请求等它加载完
+
+被淘汰的向量库只是从注册表里移除，正在使用它的请求持有引用，不受影响
+"""
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+from kb_snapshot import SnapshotStore
+
+#注册表里向量库的内存预算（MB）
+memory_budget_mb = 2048
+
+
+class RegistryStats:
+    """注册表的命中 / 加载统计"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        #因为快照变化而重新加载的次数（也计入 misses）
+        self.reloads = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+
+    def as_dict(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'reloads': self.reloads,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0,
+            'load_seconds': round(self.load_seconds, 3),
+            'avg_load_seconds': round(self.load_seconds / self.misses, 3) if self.misses else 0.0,
+        }
+
+
+class _Entry:
+    def __init__(self, vector_store, version: tuple, size_mb: float):
+        self.vector_store = vector_store
+        self.version = version
+        self.size_mb = size_mb
+        self.last_used = time.time()
+
+
+def snapshot_version(snapshot_store: SnapshotStore) -> Optional[tuple]:
+    """磁盘上当前快照的标识，变化时缓存的向量库作废；没有向量库返回 None"""
+    version = snapshot_store.version()
+    if version is None:
+        return None
+    if version == 'legacy':
+        # 老布局原地覆盖，只能看文件修改时间
+        try:
+            return version, (snapshot_store.vector_path / 'index.faiss').stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+    return version,
+
+
+def _dir_size_mb(path: Path) -> float:
+    return sum(p.stat().st_size for p in Path(path).rglob('*') if p.is_file()) / 1024 / 1024
+
+
+class KBRegistry:
+    def __init__(self, memory_budget_mb: float = memory_budget_mb):
+        self.memory_budget_mb = memory_budget_mb
+        self.stats = RegistryStats()
+        self._entries: 'OrderedDict[Tuple[str, bool], _Entry]' = OrderedDict()
+        self._lock = threading.Lock()
+        # 每个 key 一把加载锁，避免并发未命中时重复加载
+        self._load_locks: Dict[Tuple[str, bool], threading.Lock] = {}
+
+    @property
+    def used_mb(self) -> float:
+        return sum(entry.size_mb for entry in self._entries.values())
+
+    def get(self, vector_path, loader: Callable[[Path], object], mmap: bool = False):
+        """
+        取 vector_store 目录对应的向量库，没有向量库时返回 None
+
+        Args:
+            vector_path: 知识库的 vector_store 目录
+            loader: loader(快照目录) -> 向量库，未命中时调用
+            mmap: 是否只读 mmap 加载；和普通加载的向量库分开缓存
+        """
+        snapshot_store = SnapshotStore(vector_path)
+        key = (str(Path(vector_path).absolute()), mmap)
+        version = snapshot_version(snapshot_store)
+        if version is None:
+            self.invalidate(vector_path)
+            return None
+        with self._lock:
+            entry = self._lookup(key, version)
+            if entry is not None:
+                return entry.vector_store
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            with self._lock:
+                # 等锁期间别的请求可能已经加载好了
+                entry = self._lookup(key, version, count=False)
+                if entry is not None:
+                    self.stats.hits += 1
+                    return entry.vector_store
+                self.stats.misses += 1
+                if key in self._entries:
+                    self.stats.reloads += 1
+                    del self._entries[key]
+            snapshot_path = snapshot_store.current_path()
+            start = time.perf_counter()
+            vector_store = loader(snapshot_path)
+            elapsed = time.perf_counter() - start
+            size_mb = _dir_size_mb(snapshot_path)
+            with self._lock:
+                self.stats.load_seconds += elapsed
+                self._entries[key] = _Entry(vector_store, version, size_mb)
+                self._evict(keep=key)
+            print(f'[注册表] 加载 {snapshot_path}（{size_mb:.1f}MB）用时 {elapsed:.2f}s，'
+                  f'当前占用 {self.used_mb:.1f}/{self.memory_budget_mb}MB')
+            return vector_store
+
+    def _lookup(self, key, version, count: bool = True) -> Optional[_Entry]:
+        """版本一致时返回缓存并移到队尾（最近使用），需要在 self._lock 内调用"""
+        entry = self._entries.get(key)
+        if entry is None or entry.version != version:
+            return None
+        self._entries.move_to_end(key)
+        entry.last_used = time.time()
+        if count:
+            self.stats.hits += 1
+        return entry
+
+    def _evict(self, keep):
+        while self.used_mb > self.memory_budget_mb and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            del self._entries[key]
+            self.stats.evictions += 1
+            print(f'[注册表] 淘汰 {key[0]}')
+
+    def invalidate(self, vector_path=None):
+        """删除某个向量库的缓存（两种加载方式都删）；不传参数时清空"""
+        with self._lock:
+            if vector_path is None:
+                self._entries.clear()
+                return
+            path = str(Path(vector_path).absolute())
+            for key in [key for key in self._entries if key[0] == path]:
+                del self._entries[key]
+
+    def info(self) -> dict:
+        with self._lock:
+            entries = [{'path': key[0], 'mmap': key[1], 'version': entry.version[0],
+                        'size_mb': round(entry.size_mb, 1)} for key, entry in self._entries.items()]
+            return {**self.stats.as_dict(), 'used_mb': round(self.used_mb, 1),
+                    'memory_budget_mb': self.memory_budget_mb, 'entries': entries}
+
+
+_registry: Optional[KBRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> KBRegistry:
+    """进程内共享的注册表"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = KBRegistry()
+        return _registry
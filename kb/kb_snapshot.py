@@ -0,0 +1,187 @@
+"""
+向量库快照（snapshot）与热切换
+
+目录结构:
+vector_store/
+  CURRENT                      # 当前生效的快照名（一行文本）
+  snapshots/
+    v20250101120000000000/     # 每次保存都是一个新的、写完后不再修改的目录
+      index.faiss
+      index.pkl
+      index.tombstones.json
+    v20250102090000000000/
+    ...
+
+- 保存时先写到 snapshots/.tmp_xxx，写完后 rename 成正式目录，再用 os.replace 原子地改写 CURRENT；
+  任何时刻崩溃，CURRENT 要么指向旧快照，要么指向完整的新快照，不会读到写了一半的 index
+- 只保留最近 keep 个快照，当前快照永远不会被删
+- 老的布局（index.faiss 直接放在 vector_store/ 下）仍然可以读取，第一次保存后自动切换到快照布局
+
+HotSwapRetriever: 后台线程轮询 CURRENT，发现新快照后在后台加载好再替换引用；
+正在执行的请求继续使用它开始时拿到的旧向量库，不会被打断
+"""
+import os
+import shutil
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from langchain_core.runnables import Runnable
+
+pointer_name = 'CURRENT'
+snapshot_dir_name = 'snapshots'
+
+
+class SnapshotStore:
+    def __init__(self, vector_path, keep: int = 3):
+        """
+        Args:
+            vector_path: 知识库的 vector_store 目录
+            keep: 保留的快照数量（至少 1）
+        """
+        self.vector_path = Path(vector_path)
+        self.snapshot_path = self.vector_path / snapshot_dir_name
+        self.pointer_path = self.vector_path / pointer_name
+        self.keep = max(1, keep)
+
+    def current_name(self) -> Optional[str]:
+        try:
+            name = self.pointer_path.read_text(encoding='utf-8').strip()
+        except FileNotFoundError:
+            return None
+        return name or None
+
+    def current_path(self) -> Optional[Path]:
+        """当前快照目录；没有快照时兼容老布局，都没有返回 None"""
+        name = self.current_name()
+        if name is not None and (self.snapshot_path / name).is_dir():
+            return self.snapshot_path / name
+        if (self.vector_path / 'index.faiss').exists():
+            return self.vector_path
+        return None
+
+    def version(self) -> Optional[str]:
+        """当前版本标识，用来判断是否需要重新加载；老布局原地覆盖不是原子的，不参与热切换"""
+        name = self.current_name()
+        if name is not None:
+            return name
+        return 'legacy' if (self.vector_path / 'index.faiss').exists() else None
+
+    def list_snapshots(self) -> List[str]:
+        if not self.snapshot_path.exists():
+            return []
+        return sorted(p.name for p in self.snapshot_path.iterdir()
+                      if p.is_dir() and not p.name.startswith('.'))
+
+    def save(self, vector_store) -> str:
+        """把向量库写成一个新快照并切换 CURRENT，返回快照名"""
+        self.snapshot_path.mkdir(parents=True, exist_ok=True)
+        name = 'v' + datetime.now().strftime('%Y%m%d%H%M%S%f')
+        tmp_path = self.snapshot_path / f'.tmp_{name}'
+        vector_store.save_local(str(tmp_path))
+        os.rename(tmp_path, self.snapshot_path / name)
+        self._write_pointer(name)
+        self.prune()
+        return name
+
+    def activate(self, name: str):
+        """切换到指定的已有快照（回滚用）"""
+        if not (self.snapshot_path / name).is_dir():
+            raise ValueError(f'快照不存在: {name}')
+        self._write_pointer(name)
+
+    def _write_pointer(self, name: str):
+        tmp_path = self.vector_path / f'{pointer_name}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(name)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.pointer_path)
+
+    def prune(self):
+        """删除多余的旧快照，以及崩溃残留的临时目录"""
+        current = self.current_name()
+        names = self.list_snapshots()
+        for name in names[:-self.keep]:
+            if name != current:
+                shutil.rmtree(self.snapshot_path / name, ignore_errors=True)
+        for p in self.snapshot_path.glob('.tmp_*'):
+            shutil.rmtree(p, ignore_errors=True)
+
+
+def resolve_vector_path(vector_path) -> Path:
+    """把 vector_store 目录解析成实际要加载的目录（当前快照或老布局本身）"""
+    return SnapshotStore(vector_path).current_path() or Path(vector_path)
+
+
+class HotSwapRetriever(Runnable):
+    def __init__(self, snapshot_store: SnapshotStore, loader: Callable[[Path], object],
+                 search_kwargs: Optional[dict] = None, interval: float = 5.0):
+        """
+        Args:
+            snapshot_store: 要监视的快照目录
+            loader: 根据快照目录加载向量库的函数
+            search_kwargs: 传给 as_retriever 的检索参数
+            interval: 后台轮询 CURRENT 的间隔（秒）
+        """
+        self.snapshot_store = snapshot_store
+        self.loader = loader
+        self.search_kwargs = search_kwargs or {'k': 3}
+        self.interval = interval
+        self.version = None
+        self.vector_store = None
+        self.retriever = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._reload_lock = threading.Lock()
+        self.reload()
+
+    def reload(self) -> bool:
+        """CURRENT 变化时加载新快照并替换，返回是否发生了切换"""
+        with self._reload_lock:
+            version = self.snapshot_store.version()
+            if version is None or version == self.version:
+                return False
+            path = self.snapshot_store.current_path()
+            vector_store = self.loader(path)
+            # 向量库和 retriever 一起换，单次赋值对正在执行的请求是原子的
+            self.vector_store, self.retriever = vector_store, vector_store.as_retriever(search_kwargs=self.search_kwargs)
+            old_version, self.version = self.version, version
+            if old_version is not None:
+                print(f'[热切换] 向量库 {old_version} -> {version}')
+            return True
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.reload()
+            except Exception as e:
+                # 加载失败时继续用旧快照，下一轮再试
+                print(f'[热切换] 加载新快照失败: {e}')
+
+    def invoke(self, query: str, config=None, **kwargs):
+        retriever = self.retriever
+        if retriever is None:
+            raise ValueError('向量库还没有可用的快照')
+        return retriever.invoke(query, config=config, **kwargs)
+
+    async def ainvoke(self, query: str, config=None, **kwargs):
+        retriever = self.retriever
+        if retriever is None:
+            raise ValueError('向量库还没有可用的快照')
+        return await retriever.ainvoke(query, config=config, **kwargs)
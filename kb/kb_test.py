@@ -1,4 +1,5 @@
-from langchain_community.vectorstores import FAISS
+from kb_snapshot import resolve_vector_path
+from sharded_store import load_vector_store
 from rag_config import ZHIPUEmbeddings
 from config.path_config import (
     PROJECT_ROOT, KB_LIST_DIR, KB_DIR, KB_SAVE_PATH_DIR, KB_PARSE_RESULT_DIR,
@@ -9,8 +10,9 @@ from config.path_config import (
 embed = ZHIPUEmbeddings
 import os
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
-path = str(PRIVATE_KB_VECTOR)
-kb = FAISS.load_local(path, embed,allow_dangerous_deserialization=True)
+#知识库目录是快照 + chunk store 布局，加载 CURRENT 指向的快照（分片库也一样）
+path = resolve_vector_path(PRIVATE_KB_VECTOR)
+kb = load_vector_store(path, embed,allow_dangerous_deserialization=True)
 retriever = kb.as_retriever(search_kwargs={'k':3})
 result_page_content=[doc.page_content for doc in retriever.invoke('ACM电脑分类有哪些的')]
 for i ,doc in enumerate(retriever.invoke('ACM电脑分类有哪些')):
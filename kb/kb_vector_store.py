@@ -0,0 +1,625 @@
+"""
+知识库向量库
+
+在 LangChain FAISS 的基础上增加:
+- 按 docstore id / metadata（file_name、source 等）删除文档块，不需要重建整个库
+- 删除只打墓碑标记（tombstone），检索时用 IDSelector 把墓碑从 faiss 搜索里排除，
+  删除的代价只和删除的数量有关
+- compact(): 墓碑积累多了之后真正从 index 中移除这些向量，回收空间
+
+index 位置 -> docstore id 的映射（index_to_docstore_id）就是我们的 ID 映射表：
+墓碑位置在映射里保留，保证 LangChain 追加向量时计算的新位置和 index.ntotal 一致。
+
+index_spec（见 index_spec.py）决定 index 类型（Flat / IVF-Flat / HNSW / IVF-PQ）；需要训练的索引先缓存向量，
+攒够 train_size 个（或入库结束调用 flush）时训练，再把缓存的向量写入。
+
+index_spec 里 rescore=True 时另存一份 float32 原始向量（见 raw_vectors.py），量化索引取出的候选用原始向量精排。
+
+index_spec 里 binary=True 时另存一份按符号二值化的向量（faiss.IndexBinaryFlat），检索时先用 Hamming 距离
+取 binary_candidates 个候选，再用全精度向量（有原始向量用原始向量，否则从 index 取回）精排；
+对外仍然是 as_retriever / similarity_search 接口，search_kwargs={'binary': False} 可以退回 index 检索。
+
+index_spec 里 bm25=True（默认）时入库的同时维护一份按 index 位置对齐的 BM25 倒排索引（见 bm25_index.py），
+bm25_search_with_score 做关键词检索；老的快照没有倒排索引文件，第一次关键词检索时从 docstore 现建。
+
+index_spec 的 metadata_fields 上建 metadata 倒排索引（见 metadata_index.py）：按这些字段过滤时先算出允许的位置，
+候选很少时直接对这些位置精确打分，否则作为 IDSelector 传给 faiss，不再多取 fetch_k 个结果再丢掉。
+
+load_local(mmap=True) 以只读方式 mmap faiss 索引，多个 worker 进程共享同一份 page cache，
+只读的向量库不允许写入 / 删除。
+
+docstore_format = 'chunks' 时，文本和 metadata 不再 pickle 到 index.pkl，
+而是写成 mmap 的 chunk store（见 chunk_store.py），加载是常数时间，只解码命中的文档块。
+"""
+import json
+import operator
+import pickle
+import threading
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy, maximal_marginal_relevance
+from langchain_core.documents import Document
+
+from chunk_store import ChunkStore, ChunkStoreDocstore, LazyIndexToId, chunk_store_exists
+from index_spec import binarize, binary_dim, build_index, normalize_index_spec, search_parameters, train_size
+from raw_vectors import RawVectors, raw_vectors_path
+from bm25_index import BM25Index, bm25_path
+from metadata_index import MetadataIndex, metadata_index_path
+
+# 按 metadata 过滤后剩下的位置不超过这个数时，不走 faiss 索引，直接精确打分
+_scan_limit = 4096
+# 允许的位置占比超过 1/_bitmap_ratio 时用 bitmap 作为 IDSelector，否则用哈希集合
+_bitmap_ratio = 32
+
+
+def match_filter(metadata: dict, filter: Union[Callable, Dict[str, Any], None]) -> bool:
+    """filter 可以是函数，或 {字段: 值 / 值列表} 形式的字典"""
+    if filter is None:
+        return True
+    if callable(filter):
+        return filter(metadata)
+    for key, value in filter.items():
+        if isinstance(value, (list, tuple, set)):
+            if metadata.get(key) not in value:
+                return False
+        elif metadata.get(key) != value:
+            return False
+    return True
+
+
+def _needs_direct_map(index: faiss.Index) -> bool:
+    return hasattr(index, 'make_direct_map') and index.direct_map.type == faiss.DirectMap.NoMap
+
+
+def _build_direct_map(index: faiss.Index):
+    if _needs_direct_map(index):
+        index.make_direct_map()
+
+
+def _faiss_metric(distance_strategy) -> int:
+    if distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT:
+        return faiss.METRIC_INNER_PRODUCT
+    return faiss.METRIC_L2
+
+
+class KBVectorStore(FAISS):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 已删除但还没 compact 的 index 位置
+        self.tombstones: set = set()
+        # docstore id -> index 位置，删除时才懒加载
+        self._id_to_index: Optional[Dict[str, int]] = None
+        self._excluded = None
+        self._selector = None
+        # 保存格式: 'pickle'（LangChain 默认的 index.pkl）或 'chunks'（mmap chunk store）
+        self.docstore_format = 'chunks' if isinstance(self.docstore, ChunkStoreDocstore) else 'pickle'
+        self.index_spec = normalize_index_spec(None)
+        # 索引还没训练时缓存的 (text_embeddings, metadatas, ids)
+        self._pending: List[tuple] = []
+        self._pending_count = 0
+        # mmap 只读加载的向量库不能修改
+        self.read_only = False
+        # rescore 用的 float32 原始向量，按 index 位置对齐
+        self._raw: Optional[RawVectors] = None
+        # 二值粗排用的符号码，按 index 位置对齐
+        self._binary: Optional[faiss.IndexBinaryFlat] = None
+        # 关键词检索用的倒排索引，按 index 位置对齐
+        self._bm25: Optional[BM25Index] = None
+        # metadata 字段值 -> index 位置的倒排索引，按 index 位置对齐
+        self._meta_index: Optional[MetadataIndex] = None
+        # 兜底：direct map 正常在建库 / flush / 加载时就建好，检索线程里不应该再建
+        self._direct_map_lock = threading.Lock()
+
+    def _check_writable(self):
+        if self.read_only:
+            raise ValueError('向量库是只读加载的（mmap），不能修改；请用普通方式加载后再写入')
+
+    @classmethod
+    def from_embeddings(cls, text_embeddings, embedding, metadatas=None, ids=None,
+                        index_spec: Union[str, dict, None] = None, **kwargs):
+        """按 spec 创建（可能需要训练的）索引；index_spec 为空时是 flat，索引和 LangChain 默认的一样"""
+        spec = normalize_index_spec(index_spec)
+        text_embeddings = list(text_embeddings)
+        index = build_index(spec, len(text_embeddings[0][1]),
+                            _faiss_metric(kwargs.get('distance_strategy', DistanceStrategy.EUCLIDEAN_DISTANCE)))
+        store = cls(embedding, index, InMemoryDocstore(), {}, **kwargs)
+        store.index_spec = spec
+        if spec['rescore']:
+            store._raw = RawVectors(index.d)
+        if spec['binary']:
+            store._binary = faiss.IndexBinaryFlat(binary_dim(index.d))
+        if spec['bm25']:
+            store._bm25 = BM25Index()
+        if spec['metadata_fields']:
+            store._meta_index = MetadataIndex(spec['metadata_fields'])
+        store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        store._ensure_direct_map()
+        return store
+
+
+    def _doc_at(self, i: int):
+        """取 index 第 i 个位置的文档，chunk store 按位置直接读"""
+        _id = self.index_to_docstore_id[i]
+        if isinstance(self.docstore, ChunkStoreDocstore):
+            return self.docstore.search_at(int(i), _id)
+        return self.docstore.search(_id)
+
+    # ---------------- 删除 / 压缩 ----------------
+    @property
+    def live_count(self) -> int:
+        return self.index.ntotal - len(self.tombstones)
+
+    @property
+    def deleted_ratio(self) -> float:
+        return len(self.tombstones) / self.index.ntotal if self.index.ntotal else 0.0
+
+    def _reverse_index(self) -> Dict[str, int]:
+        if self._id_to_index is None:
+            self._id_to_index = {
+                _id: i for i, _id in self.index_to_docstore_id.items() if i not in self.tombstones
+            }
+        return self._id_to_index
+
+    def add_embeddings(self, text_embeddings, metadatas=None, ids=None, **kwargs) -> List[str]:
+        self._check_writable()
+        if not self.index.is_trained:
+            # 索引还没训练，先缓存，攒够训练样本再一起写入
+            text_embeddings = list(text_embeddings)
+            ids = ids or [str(uuid.uuid4()) for _ in text_embeddings]
+            self._pending.append((text_embeddings, metadatas, ids))
+            self._pending_count += len(text_embeddings)
+            if self._pending_count >= train_size(self.index_spec):
+                self.flush()
+            return ids
+        if self._raw is not None or self._binary is not None:
+            text_embeddings = list(text_embeddings)
+            vectors = np.array([vec for _, vec in text_embeddings], dtype=np.float32)
+            if self._normalize_L2:
+                faiss.normalize_L2(vectors)
+            if self._raw is not None:
+                self._raw.append(vectors)
+            if self._binary is not None:
+                self._binary.add(binarize(vectors))
+        if self._bm25 is not None or self._meta_index is not None:
+            text_embeddings = list(text_embeddings)
+        start = self.index.ntotal
+        added_ids = super().add_embeddings(text_embeddings, metadatas=metadatas, ids=ids, **kwargs)
+        if self._bm25 is not None:
+            self._bm25.add(text for text, _ in text_embeddings)
+        if self._meta_index is not None:
+            self._meta_index.add(metadatas or [None] * len(text_embeddings))
+        if self._id_to_index is not None:
+            for offset, _id in enumerate(added_ids):
+                self._id_to_index[_id] = start + offset
+        return added_ids
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs) -> List[str]:
+        # LangChain 的 add_texts 不经过 add_embeddings，这里先 embed 再走 add_embeddings，
+        # 保证训练缓存、原始向量、二值码和反向映射都和 index 对齐
+        texts = list(texts)
+        embeddings = self._embed_documents(texts)
+        return self.add_embeddings(zip(texts, embeddings), metadatas=metadatas, ids=ids, **kwargs)
+
+    def flush(self) -> int:
+        """
+        训练索引并写入缓存的向量，返回写入的数量
+
+        入库结束时调用；样本数少于 train_size 时按实际样本数调整索引参数（见 build_index）
+        """
+        if not self._pending:
+            return 0
+        pending, self._pending, self._pending_count = self._pending, [], 0
+        vectors = np.array([vec for batch, _, _ in pending for _, vec in batch], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vectors)
+        index = build_index(self.index_spec, vectors.shape[1], _faiss_metric(self.distance_strategy), n_train=len(vectors))
+        print(f'[索引] 训练 {self.index_spec["type"]} 索引，样本数 {len(vectors)}')
+        index.train(vectors)
+        self.index = index
+        self._ensure_direct_map()
+        for batch, metadatas, ids in pending:
+            self.add_embeddings(batch, metadatas=metadatas, ids=ids)
+        return len(vectors)
+
+    def rebuild(self, index_spec: Union[str, dict, None] = None) -> int:
+        """
+        用全部现存向量重新训练并构建索引（顺带清掉墓碑），返回向量数
+
+        用于切换索引类型，或知识库规模增长很多之后重新训练聚类中心。
+        量化索引（PQ / int8 等）取回的是近似向量，除非保存了 rescore 用的原始向量；
+        要精确重建请重新入库（embedding 缓存会命中）
+        """
+        self._check_writable()
+        self.flush()
+        if index_spec is not None:
+            self.index_spec = normalize_index_spec(index_spec)
+        keep = np.array([i for i in range(self.index.ntotal) if i not in self.tombstones], dtype=np.int64)
+        vectors = self._reconstruct(keep)
+        index = build_index(self.index_spec, self.index.d, _faiss_metric(self.distance_strategy), n_train=len(keep))
+        if not index.is_trained:
+            index.train(vectors)
+        _build_direct_map(index)
+        if len(keep):
+            index.add(vectors)
+        self._replace_index(index, keep)
+        # 从 float32 索引切换到量化 + rescore 时，原始向量就是这里取出来的 vectors
+        self._raw = RawVectors(index.d, vectors) if self.index_spec['rescore'] else None
+        self._binary = self._build_binary(binarize(vectors), index.d) if self.index_spec['binary'] else None
+        if not self.index_spec['bm25']:
+            self._bm25 = None
+        if self._meta_index is not None and self._meta_index.fields != list(self.index_spec['metadata_fields']):
+            # 字段变了，下次过滤时按新字段现建
+            self._meta_index = None
+        print(f'[索引] 重建为 {self.index_spec["type"]} 索引，共 {self.index.ntotal} 个向量')
+        return self.index.ntotal
+
+    def delete_by_ids(self, ids: Iterable[str]) -> int:
+        """按 docstore id 删除，返回实际删除的数量（不存在的 id 忽略）"""
+        self._check_writable()
+        reverse = self._reverse_index()
+        positions, found = [], []
+        for _id in ids:
+            pos = reverse.pop(_id, None)
+            if pos is not None:
+                positions.append(pos)
+                found.append(_id)
+        if not found:
+            return 0
+        self.tombstones.update(positions)
+        self._selector = None
+        self.docstore.delete(found)
+        return len(found)
+
+    def find_ids(self, filter: Union[Callable, Dict[str, Any]]) -> List[str]:
+        """找出 metadata 满足 filter 的所有 docstore id"""
+        positions, filter = self._prefilter(filter)
+        if positions is not None and filter is None:
+            return [self.index_to_docstore_id[int(i)] for i in positions]
+        if positions is None:
+            positions = (i for i in range(self.index.ntotal) if i not in self.tombstones)
+        result = []
+        for i in positions:
+            doc = self._doc_at(int(i))
+            if isinstance(doc, Document) and match_filter(doc.metadata, filter):
+                result.append(self.index_to_docstore_id[int(i)])
+        return result
+
+    def delete_by_metadata(self, **conditions) -> int:
+        """例如 delete_by_metadata(file_name='xx.md') 或 delete_by_metadata(source=[a, b])"""
+        return self.delete_by_ids(self.find_ids(conditions))
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs) -> Optional[bool]:
+        if ids is None:
+            raise ValueError('No ids provided to delete.')
+        self.delete_by_ids(ids)
+        return True
+
+    def compact(self) -> int:
+        """
+        把墓碑向量真正从 index 中删掉，剩余向量保持原来的相对顺序
+
+        Flat 索引直接 remove_ids（顺序保持、位置前移）；
+        其他索引（IVF / HNSW 等）的 label 不会随 remove_ids 重新编号，所以重建一个同配置的空索引再写入
+        """
+        if not self.tombstones:
+            return 0
+        self._check_writable()
+        n_removed = len(self.tombstones)
+        keep = np.array([i for i in range(self.index.ntotal) if i not in self.tombstones], dtype=np.int64)
+        index = self.index
+        # IndexFlat / IndexScalarQuantizer 都是 IndexFlatCodes，remove_ids 后顺序保持
+        if isinstance(index, getattr(faiss, 'IndexFlatCodes', faiss.IndexFlat)):
+            index.remove_ids(np.fromiter(self.tombstones, dtype=np.int64))
+        else:
+            vectors = self._reconstruct(keep)
+            index = faiss.clone_index(self.index)
+            index.reset()
+            _build_direct_map(index)
+            if len(keep):
+                index.add(vectors)
+        if self._raw is not None:
+            self._raw = self._raw.take(keep)
+        if self._binary is not None:
+            codes = faiss.vector_to_array(self._binary.xb).reshape(-1, self._binary.code_size)
+            self._binary = self._build_binary(codes[keep], self._binary.d)
+        self._replace_index(index, keep)
+        print(f'compact 完成: 移除 {n_removed} 个已删除向量，剩余 {self.index.ntotal} 个')
+        return n_removed
+
+    def _replace_index(self, index: faiss.Index, keep: np.ndarray):
+        """换成只包含 keep 这些原位置（按原顺序）的新索引，并重新编号映射"""
+        self.index = index
+        self.index_to_docstore_id = {j: self.index_to_docstore_id[int(i)] for j, i in enumerate(keep)}
+        if self._bm25 is not None:
+            self._bm25 = self._bm25.take(keep)
+        if self._meta_index is not None:
+            self._meta_index = self._meta_index.take(keep)
+        self.tombstones = set()
+        self._id_to_index = None
+        self._selector = None
+
+    @staticmethod
+    def _build_binary(codes: np.ndarray, dim: int) -> faiss.IndexBinaryFlat:
+        index = faiss.IndexBinaryFlat(binary_dim(dim))
+        if len(codes):
+            index.add(np.ascontiguousarray(codes, dtype=np.uint8))
+        return index
+
+    def _ensure_direct_map(self):
+        """
+        IVF 类索引需要 direct map 才能按位置取回向量（rescore / 过滤后精确打分 / MMR）；
+        在向量库交给检索线程之前（建库、flush、重建、加载时）建好，之后 add 会自动维护
+        """
+        if _needs_direct_map(self.index):
+            with self._direct_map_lock:
+                _build_direct_map(self.index)
+
+    def _reconstruct(self, positions: np.ndarray) -> np.ndarray:
+        if self._raw is not None and len(self._raw) == self.index.ntotal:
+            # 有原始向量时用原始向量，量化索引 reconstruct 出来的是近似值
+            return self._raw.get(positions)
+        index = self.index
+        self._ensure_direct_map()
+        if len(positions) == 0:
+            return np.zeros((0, index.d), dtype=np.float32)
+        return index.reconstruct_batch(np.asarray(positions, dtype=np.int64)).astype(np.float32)
+
+    # ---------------- 检索 ----------------
+    def _tombstone_selector(self):
+        """排除墓碑位置的 IDSelector，墓碑集合变化时才重建"""
+        if not self.tombstones:
+            return None
+        if self._selector is None:
+            self._excluded = faiss.IDSelectorBatch(np.fromiter(self.tombstones, dtype=np.int64))
+            self._selector = faiss.IDSelectorNot(self._excluded)
+        return self._selector
+
+    def ensure_metadata_index(self) -> Optional[MetadataIndex]:
+        """返回 metadata 倒排索引；spec 里配置了字段但还没有（老快照）时从 docstore 现建，只在内存里"""
+        fields = list(self.index_spec.get('metadata_fields') or [])
+        if self._meta_index is None and fields:
+            print(f'[metadata] 从 docstore 建立 {fields} 的倒排索引，共 {self.index.ntotal} 个文档块')
+            meta_index = MetadataIndex(fields)
+            meta_index.add(doc.metadata if doc is not None else None for _, doc in self._iter_rows())
+            self._meta_index = meta_index
+        return self._meta_index
+
+    def _prefilter(self, filter) -> Tuple[Optional[np.ndarray], Any]:
+        """用 metadata 倒排索引算出满足 filter 的位置（已去掉墓碑），返回 (位置, 索引处理不了的剩余条件)"""
+        if filter is None or callable(filter) or self.ensure_metadata_index() is None:
+            return None, filter
+        positions, remaining = self._meta_index.positions(filter)
+        if positions is not None and self.tombstones:
+            positions = np.setdiff1d(positions, np.fromiter(self.tombstones, dtype=np.int64), assume_unique=True)
+        return positions, remaining
+
+    def _allowed_selector(self, positions: np.ndarray):
+        """只允许 positions 这些位置的 IDSelector；允许的位置多时用 bitmap，少时用哈希集合"""
+        ntotal = self.index.ntotal
+        if len(positions) * _bitmap_ratio <= ntotal:
+            return faiss.IDSelectorBatch(positions)
+        mask = np.zeros(ntotal, dtype=bool)
+        mask[positions] = True
+        bitmap = np.packbits(mask, bitorder='little')
+        selector = faiss.IDSelectorBitmap(ntotal, faiss.swig_ptr(bitmap))
+        # IDSelectorBitmap 只保存指针，bitmap 要和 selector 一起存活
+        selector.referenced_objects = [bitmap]
+        return selector
+
+    def _search_params(self, allowed: Optional[np.ndarray] = None, **kwargs):
+        """
+        构造 faiss 的 SearchParameters（墓碑过滤 + nprobe / ef_search），没有额外参数时返回 None 走默认搜索
+
+        allowed 是 metadata 过滤后允许的位置（已经去掉了墓碑），给出时只在这些位置里搜
+        """
+        selector = self._allowed_selector(allowed) if allowed is not None else self._tombstone_selector()
+        return search_parameters(self.index, self.index_spec, selector=selector,
+                                 nprobe=kwargs.get('nprobe'), ef_search=kwargs.get('ef_search'))
+
+    def _index_search(self, vector: np.ndarray, n: int, allowed: Optional[np.ndarray] = None,
+                      **kwargs) -> Tuple[np.ndarray, np.ndarray]:
+        params = self._search_params(allowed, **kwargs)
+        if params is None:
+            return self.index.search(vector, n)
+        return self.index.search(vector, n, params=params)
+
+    def _rescore(self, vector: np.ndarray, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """用全精度向量给候选重新打分排序（分数含义和 faiss 一致: L2 为平方距离，IP 为内积）"""
+        candidates = indices[0][indices[0] >= 0]
+        exact = self._reconstruct(candidates)
+        if _faiss_metric(self.distance_strategy) == faiss.METRIC_INNER_PRODUCT:
+            scores = exact @ vector[0]
+            order = np.argsort(-scores)
+        else:
+            scores = ((exact - vector[0]) ** 2).sum(axis=1)
+            order = np.argsort(scores)
+        return scores[order][None, :], candidates[order][None, :]
+
+    def _use_binary(self, **kwargs) -> bool:
+        # 二值码和 index 没对齐（例如还有没训练的缓存）时退回 index 检索
+        return (self._binary is not None and kwargs.get('binary', True)
+                and self._binary.ntotal == self.index.ntotal)
+
+    def _search_rows(self, embedding: List[float], k: int,
+                     filter: Optional[Union[Callable, Dict[str, Any]]] = None,
+                     fetch_k: int = 20, **kwargs: Any) -> List[Tuple[int, Document, float]]:
+        """按分数排序的前 k 个 (index 位置, 文档, 分数)，墓碑和不满足 filter 的已经去掉"""
+        vector = np.array([embedding], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vector)
+        allowed, filter = self._prefilter(filter)
+        n = k if filter is None else fetch_k
+        if allowed is not None and len(allowed) <= max(_scan_limit, n):
+            # 过滤后剩下的很少，直接对这些位置精确打分，比在整个索引里搜更快也更准
+            scores, indices = self._rescore(vector, allowed[None, :])
+        elif allowed is None and self._use_binary(**kwargs):
+            # Hamming 粗排取候选，墓碑在下面逐个跳过
+            n_candidates = max(n, kwargs.get('binary_candidates') or self.index_spec.get('binary_candidates', 256))
+            _, indices = self._binary.search(binarize(vector), n_candidates)
+            scores, indices = self._rescore(vector, indices)
+        else:
+            rescore = self._raw is not None and self.index_spec.get('rescore')
+            if rescore:
+                n *= self.index_spec.get('rescore_factor', 4)
+            scores, indices = self._index_search(vector, n, allowed, **kwargs)
+            if rescore:
+                scores, indices = self._rescore(vector, indices)
+        rows = []
+        for j, i in enumerate(indices[0]):
+            if i == -1 or i in self.tombstones:
+                continue
+            doc = self._doc_at(i)
+            if not isinstance(doc, Document):
+                raise ValueError(f'Could not find document for id {self.index_to_docstore_id[i]}, got {doc}')
+            if not match_filter(doc.metadata, filter):
+                continue
+            rows.append((int(i), doc, scores[0][j]))
+            if len(rows) >= k:
+                # 结果已经按分数排好序，后面的不会再进 top-k
+                break
+        return rows
+
+    def similarity_search_with_score_by_vector(
+            self, embedding: List[float], k: int = 4,
+            filter: Optional[Union[Callable, Dict[str, Any]]] = None,
+            fetch_k: int = 20, **kwargs: Any) -> List[Tuple[Document, float]]:
+        docs = [(doc, score) for _, doc, score in self._search_rows(embedding, k, filter, fetch_k, **kwargs)]
+        score_threshold = kwargs.get('score_threshold')
+        if score_threshold is not None:
+            cmp = (operator.ge if self.distance_strategy in
+                   (DistanceStrategy.MAX_INNER_PRODUCT, DistanceStrategy.JACCARD) else operator.le)
+            docs = [(doc, score) for doc, score in docs if cmp(score, score_threshold)]
+        return docs[:k]
+
+    def max_marginal_relevance_search_with_score_by_vector(
+            self, embedding: List[float], *, k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5,
+            filter: Optional[Union[Callable, Dict[str, Any]]] = None, **kwargs: Any) -> List[Tuple[Document, float]]:
+        """
+        LangChain 的实现直接搜 index、按位置查 docstore，不认墓碑（会返回已删除的文档块或者报错），
+        这里先和 similarity_search 一样取 fetch_k 个候选（去掉墓碑、按 filter 过滤），再按候选位置取回向量做 MMR
+        """
+        rows = self._search_rows(embedding, fetch_k, filter, fetch_k=fetch_k * 2, **kwargs)
+        if not rows:
+            return []
+        vector = np.array([embedding], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vector)
+        vectors = self._reconstruct(np.array([i for i, _, _ in rows], dtype=np.int64))
+        selected = maximal_marginal_relevance(vector, list(vectors), k=k, lambda_mult=lambda_mult)
+        return [(rows[j][1], rows[j][2]) for j in selected]
+
+    def ensure_bm25(self) -> Optional[BM25Index]:
+        """返回倒排索引；spec 打开了 bm25 但还没有（老快照）时从 docstore 现建，只在内存里"""
+        if self._bm25 is None and self.index_spec.get('bm25'):
+            print(f'[BM25] 从 docstore 建立倒排索引，共 {self.index.ntotal} 个文档块')
+            bm25 = BM25Index()
+            bm25.add(doc.page_content if doc is not None else '' for _, doc in self._iter_rows())
+            self._bm25 = bm25
+        return self._bm25
+
+    def bm25_search_with_score(self, query: str, k: int = 4,
+                               filter: Optional[Union[Callable, Dict[str, Any]]] = None,
+                               fetch_k: int = 20) -> List[Tuple[Document, float]]:
+        """关键词检索，分数是 BM25 分数（越大越相关）"""
+        bm25 = self.ensure_bm25()
+        if bm25 is None:
+            raise ValueError('向量库没有倒排索引，index_spec 里 bm25=False')
+        docs = []
+        for i, score in bm25.search(query, k if filter is None else fetch_k, exclude=self.tombstones):
+            doc = self._doc_at(i)
+            if isinstance(doc, Document) and match_filter(doc.metadata, filter):
+                docs.append((doc, score))
+        return docs[:k]
+
+    # ---------------- 持久化 ----------------
+    @staticmethod
+    def _read_index(index_path: Path, mmap: bool) -> faiss.Index:
+        if not mmap:
+            return faiss.read_index(str(index_path))
+        # 新版本 faiss 的 IO_FLAG_MMAP_IFC 零拷贝映射 Flat 向量和 IVF 倒排表；老版本退回 IO_FLAG_MMAP（只映射倒排表）。
+        # 两个标志不能同时给：IVF 的 OnDisk 倒排表读取要求普通文件 reader，会直接报错
+        flags = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        return faiss.read_index(str(index_path), flags)
+
+    def save_local(self, folder_path: str, index_name: str = 'index') -> None:
+        self.flush()
+        if self.docstore_format == 'chunks':
+            path = Path(folder_path)
+            path.mkdir(parents=True, exist_ok=True)
+            faiss.write_index(self.index, str(path / f'{index_name}.faiss'))
+            ChunkStore.write(path, self._iter_rows(), index_name=index_name)
+        else:
+            super().save_local(folder_path, index_name)
+        with open(Path(folder_path) / f'{index_name}.tombstones.json', 'w', encoding='utf-8') as f:
+            json.dump(sorted(int(i) for i in self.tombstones), f)
+        with open(Path(folder_path) / f'{index_name}.spec.json', 'w', encoding='utf-8') as f:
+            json.dump(self.index_spec, f, ensure_ascii=False)
+        if self._raw is not None:
+            self._raw.save(raw_vectors_path(folder_path, index_name))
+        if self._binary is not None:
+            faiss.write_index_binary(self._binary, str(Path(folder_path) / f'{index_name}.binary'))
+        if self._bm25 is not None:
+            self._bm25.save(bm25_path(folder_path, index_name))
+        if self._meta_index is not None:
+            self._meta_index.save(metadata_index_path(folder_path, index_name))
+
+    def _iter_rows(self):
+        """按 index 位置产出 (docstore id, Document)，墓碑位置的 Document 为 None"""
+        for i in range(self.index.ntotal):
+            _id = self.index_to_docstore_id[i]
+            doc = None if i in self.tombstones else self._doc_at(i)
+            yield _id, doc if isinstance(doc, Document) else None
+
+    @classmethod
+    def load_local(cls, folder_path: str, embeddings, index_name: str = 'index', mmap: bool = False, **kwargs):
+        """
+        Args:
+            mmap: 只读 mmap 加载 faiss 索引，多个进程加载同一个快照时共享物理内存；
+                  加载出来的向量库 read_only=True
+        """
+        path = Path(folder_path)
+        if chunk_store_exists(folder_path, index_name):
+            # chunk store 不需要 unpickle
+            kwargs.pop('allow_dangerous_deserialization', None)
+            index = cls._read_index(path / f'{index_name}.faiss', mmap)
+            chunk_store = ChunkStore(folder_path, index_name)
+            store = cls(embeddings, index, ChunkStoreDocstore(chunk_store), LazyIndexToId(chunk_store), **kwargs)
+        elif mmap:
+            if not kwargs.pop('allow_dangerous_deserialization', False):
+                raise ValueError('加载 index.pkl 需要反序列化 pickle，请确认来源可信后传入 '
+                                 'allow_dangerous_deserialization=True')
+            index = cls._read_index(path / f'{index_name}.faiss', mmap)
+            with open(path / f'{index_name}.pkl', 'rb') as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+            store = cls(embeddings, index, docstore, index_to_docstore_id, **kwargs)
+        else:
+            store = super().load_local(folder_path, embeddings, index_name=index_name, **kwargs)
+        store.read_only = mmap
+        tombstone_path = Path(folder_path) / f'{index_name}.tombstones.json'
+        if tombstone_path.exists():
+            with open(tombstone_path, 'r', encoding='utf-8') as f:
+                store.tombstones = set(json.load(f))
+            if isinstance(store.docstore, ChunkStoreDocstore):
+                store.docstore._deleted.update(store.index_to_docstore_id[i] for i in store.tombstones)
+        spec_path = Path(folder_path) / f'{index_name}.spec.json'
+        if spec_path.exists():
+            with open(spec_path, 'r', encoding='utf-8') as f:
+                store.index_spec = normalize_index_spec(json.load(f))
+        if raw_vectors_path(folder_path, index_name).exists():
+            store._raw = RawVectors.load(raw_vectors_path(folder_path, index_name), store.index.d)
+        binary_path = Path(folder_path) / f'{index_name}.binary'
+        if binary_path.exists():
+            store._binary = faiss.read_index_binary(str(binary_path))
+        if bm25_path(folder_path, index_name).exists():
+            store._bm25 = BM25Index.load(bm25_path(folder_path, index_name))
+        if metadata_index_path(folder_path, index_name).exists():
+            store._meta_index = MetadataIndex.load(metadata_index_path(folder_path, index_name))
+        # 加载完、交给检索线程之前建好 direct map（mmap 只读的索引也可以，direct map 在内存里）
+        store._ensure_direct_map()
+        return store
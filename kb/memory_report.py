@@ -0,0 +1,58 @@
+"""
+进程内存报告：区分私有内存和共享内存
+
+mmap 加载的 faiss 索引 / chunk store 在多个 worker 进程之间共享同一份 page cache，
+只看 RSS 会把共享的部分在每个进程里重复计算一次。这里读取:
+- rss:     常驻内存（含共享页）
+- pss:     按共享进程数均摊后的内存，所有进程的 pss 相加 ≈ 实际占用的物理内存
+- shared:  和其他进程共享的页（Shared_Clean + Shared_Dirty）
+- private: 本进程独占的页（Private_Clean + Private_Dirty）
+
+Linux 上读 /proc/self/smaps_rollup；其他平台退化为 psutil（只有 rss/shared 等部分字段）
+"""
+import os
+from typing import Dict
+
+_smaps_fields = {
+    'Rss': 'rss',
+    'Pss': 'pss',
+    'Shared_Clean': 'shared',
+    'Shared_Dirty': 'shared',
+    'Private_Clean': 'private',
+    'Private_Dirty': 'private',
+}
+
+
+def process_memory(pid: int = None) -> Dict[str, float]:
+    """返回以 MB 为单位的内存统计"""
+    pid = pid or os.getpid()
+    smaps = f'/proc/{pid}/smaps_rollup'
+    if os.path.exists(smaps):
+        result = {'rss': 0.0, 'pss': 0.0, 'shared': 0.0, 'private': 0.0}
+        with open(smaps, 'r') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in _smaps_fields:
+                    # smaps 的单位是 kB
+                    result[_smaps_fields[key]] += int(value.split()[0]) / 1024
+        return result
+    try:
+        import psutil
+    except ImportError:
+        return {}
+    info = psutil.Process(pid).memory_info()
+    result = {'rss': info.rss / 1024 / 1024}
+    if hasattr(info, 'shared'):
+        result['shared'] = info.shared / 1024 / 1024
+        result['private'] = result['rss'] - result['shared']
+    return result
+
+
+def format_memory(memory: Dict[str, float]) -> str:
+    if not memory:
+        return '内存统计不可用'
+    return ', '.join(f'{key}={value:.1f}MB' for key, value in memory.items())
+
+
+def print_memory_report(tag: str = ''):
+    print(f'[内存]{tag} pid={os.getpid()} {format_memory(process_memory())}')
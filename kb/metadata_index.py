@@ -0,0 +1,136 @@
+"""
+metadata 倒排索引：字段值 -> index 位置列表（posting list），和向量库按 index 位置对齐
+
+按 category / file_name 等字段过滤时，先用倒排索引算出允许的 index 位置，
+再把它作为 faiss 的 IDSelector 传进检索（见 kb_vector_store.py），不需要多取很多结果再丢掉。
+
+- 过滤条件的语义和 match_filter 一致：{字段: 值} 等于，{字段: [值, ...]} 属于其中之一，多个字段之间是"且"
+- 字段值按类型区分：字符串 's:xxx'，其他值 'j:' + json（1 和 '1' 是不同的值，和 match_filter 一致）
+- 存储: {index_name}.meta.npz，每个字段一组 (keys, offsets, positions) 的 CSR 数组，
+  字段名和字段值是 utf-8 字节流 + 偏移（见 chunk_store.save_strings）；入库新增的位置先放在内存的列表里，保存时合并
+"""
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from chunk_store import load_strings, save_strings
+
+file_suffix = 'meta.npz'
+
+
+def metadata_index_path(folder_path, index_name: str = 'index') -> Path:
+    return Path(folder_path) / f'{index_name}.{file_suffix}'
+
+
+def _key(value: Any) -> Optional[str]:
+    if isinstance(value, str):
+        return 's:' + value
+    try:
+        return 'j:' + json.dumps(value, ensure_ascii=False, sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+
+
+_empty = np.zeros(0, dtype=np.int64)
+
+
+class MetadataIndex:
+    def __init__(self, fields: Sequence[str]):
+        self.fields = list(fields)
+        self._count = 0
+        # 字段 -> 值 -> 位置数组（加载 / 合并后的部分）
+        self._base: Dict[str, Dict[str, np.ndarray]] = {field: {} for field in self.fields}
+        # 字段 -> 值 -> 新增的位置
+        self._added: Dict[str, Dict[str, List[int]]] = {field: {} for field in self.fields}
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, metadatas: Iterable[Optional[dict]]):
+        """按顺序追加文档块的 metadata，位置接着已有的往后排"""
+        for metadata in metadatas:
+            metadata = metadata or {}
+            for field in self.fields:
+                key = _key(metadata.get(field))
+                if key is not None:
+                    self._added[field].setdefault(key, []).append(self._count)
+            self._count += 1
+
+    def _posting(self, field: str, key: Optional[str]) -> np.ndarray:
+        if key is None:
+            return _empty
+        base = self._base[field].get(key, _empty)
+        added = self._added[field].get(key)
+        if added:
+            return np.concatenate([base, np.array(added, dtype=np.int64)])
+        return base
+
+    def positions(self, filter) -> Tuple[Optional[np.ndarray], Any]:
+        """
+        返回 (满足条件的位置（升序）, 剩下索引不能处理的条件)
+
+        filter 是函数或者没有任何字段建了索引时返回 (None, filter)，调用方按原来的方式过滤
+        """
+        if filter is None or callable(filter):
+            return None, filter
+        indexed = {field: value for field, value in filter.items() if field in self._base}
+        if not indexed:
+            return None, filter
+        result = None
+        for field, value in indexed.items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            postings = [self._posting(field, _key(v)) for v in values]
+            allowed = np.unique(np.concatenate(postings)) if postings else _empty
+            result = allowed if result is None else np.intersect1d(result, allowed, assume_unique=True)
+        remaining = {field: value for field, value in filter.items() if field not in self._base}
+        return result, remaining or None
+
+    def _merge(self):
+        for field in self.fields:
+            for key in list(self._added[field]):
+                self._base[field][key] = self._posting(field, key)
+            self._added[field] = {}
+
+    def take(self, keep: np.ndarray) -> 'MetadataIndex':
+        """只保留 keep 这些位置并按顺序重新编号（compact / 重建索引后重新对齐）"""
+        self._merge()
+        remap = np.full(self._count, -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+        result = MetadataIndex(self.fields)
+        result._count = len(keep)
+        for field in self.fields:
+            for key, positions in self._base[field].items():
+                positions = remap[positions]
+                positions = positions[positions >= 0]
+                if len(positions):
+                    result._base[field][key] = positions
+        return result
+
+    def save(self, path):
+        self._merge()
+        arrays = {'count': np.array(self._count)}
+        save_strings(arrays, 'fields', self.fields)
+        for i, field in enumerate(self.fields):
+            keys = sorted(self._base[field])
+            postings = [self._base[field][key] for key in keys]
+            offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+            np.cumsum([len(p) for p in postings], out=offsets[1:])
+            save_strings(arrays, f'keys_{i}', keys)
+            arrays[f'offsets_{i}'] = offsets
+            arrays[f'positions_{i}'] = np.concatenate(postings) if postings else _empty
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path) -> 'MetadataIndex':
+        with np.load(path, allow_pickle=False) as data:
+            index = cls(load_strings(data, 'fields'))
+            index._count = int(data['count'])
+            for i, field in enumerate(index.fields):
+                offsets = data[f'offsets_{i}']
+                positions = data[f'positions_{i}']
+                for j, key in enumerate(load_strings(data, f'keys_{i}')):
+                    index._base[field][key] = positions[offsets[j]:offsets[j + 1]]
+        return index
@@ -0,0 +1,70 @@
+"""
+多进程文档解析
+
+加载 + 切分是纯 CPU 的工作，单进程时只能用满一个核。这里把文件分发到进程池：
+- 结果按输入文件的顺序产出，和单进程时的顺序完全一致，chunk id / global_chunk_index 稳定
+- 单个文件失败只影响这个文件，异常随结果一起返回，由调用方决定怎么处理
+- 在途文件数由 max_pending 限制，已解析但还没被消费的结果不会无限堆积
+
+worker 函数必须是模块级函数（进程池需要能 pickle），所以放在这个只依赖 langchain 的轻量模块里，
+子进程不用导入 rag_config 等重模块
+"""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+
+def default_workers() -> int:
+    return max(1, (os.cpu_count() or 1) - 1)
+
+
+def iter_parallel(fn: Callable, items: Iterable, workers: int = 1,
+                  max_pending: Optional[int] = None) -> Iterator[Tuple[object, object, Optional[Exception]]]:
+    """
+    用进程池对每个 item 执行 fn，按输入顺序产出 (item, 结果, 异常)
+
+    Args:
+        fn: 可 pickle 的函数（模块级函数或其 functools.partial）
+        items: 输入（通常是文件路径）
+        workers: 进程数，<= 1 时在当前进程里串行执行
+        max_pending: 同时提交到进程池的 item 上限，默认 workers * 2
+    """
+    if workers <= 1:
+        for item in items:
+            try:
+                yield item, fn(item), None
+            except Exception as e:
+                yield item, None, e
+        return
+
+    max_pending = max_pending or workers * 2
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            if len(pending) >= max_pending:
+                yield _collect(*pending.popleft())
+            pending.append((item, executor.submit(fn, item)))
+        while pending:
+            yield _collect(*pending.popleft())
+
+
+def _collect(item, future):
+    try:
+        return item, future.result(), None
+    except Exception as e:
+        return item, None, e
+
+
+def load_split_file(file_path: str, loaders: Dict[str, type], text_splitter) -> List[Document]:
+    """DocumentProcessor 的 worker：加载单个文件并切分"""
+    ext = os.path.splitext(str(file_path))[1].lower()
+    if ext not in loaders:
+        raise ValueError(f'不支持的文件格式{ext}')
+    loader = loaders[ext](str(file_path))
+    chunks = []
+    for page in loader.lazy_load():
+        chunks.extend(text_splitter.split_documents([page]))
+    return chunks
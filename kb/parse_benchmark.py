@@ -0,0 +1,106 @@
+"""
+解析并行度 benchmark：比较 1 个进程和 N 个进程解析自带文档的耗时
+
+示例：
+    python kb/parse_benchmark.py --workers 1 2 4 --repeat 5
+
+--repeat 会把 DOCUMENTS_DIR 下的文件复制多份到临时目录，模拟更大的语料。
+每个 workers 配置都会检查产出的 chunk id 顺序和 1 进程时完全一致。
+"""
+import sys
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+kb_dir = str(project_root / 'kb')
+if kb_dir not in sys.path:
+    sys.path.insert(0, kb_dir)
+
+import argparse
+import contextlib
+import io
+import shutil
+import tempfile
+import time
+from functools import partial
+
+from langchain_community.document_loaders import Docx2txtLoader, TextLoader, UnstructuredMarkdownLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from config.path_config import DOCUMENTS_DIR
+from parallel_parse import default_workers, iter_parallel, load_split_file
+from private_kb_parse import parse
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='比较不同进程数下的文档解析耗时',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--source', type=Path, default=DOCUMENTS_DIR, help='文档目录')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, default_workers()], help='要比较的进程数')
+    parser.add_argument('--repeat', type=int, default=5, help='文件复制份数')
+    parser.add_argument('--chunk-size', type=int, default=250)
+    parser.add_argument('--chunk-overlap', type=int, default=50)
+    return parser.parse_args()
+
+
+def build_corpus(source: Path, target: Path, repeat: int) -> int:
+    files = sorted(p for p in source.iterdir() if p.suffix in ('.md', '.docx'))
+    for r in range(repeat):
+        for p in files:
+            shutil.copy(p, target / f'{p.stem}_r{r}{p.suffix}')
+    return len(files) * repeat
+
+
+def run_private_parse(folder: Path, workers: int, args) -> list:
+    # parse 每个文件都会打印日志，benchmark 时屏蔽掉
+    with contextlib.redirect_stdout(io.StringIO()):
+        docs = parse(str(folder), chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap, workers=workers)
+    return [doc.metadata['id'] for doc in docs]
+
+
+def run_loader_split(folder: Path, workers: int, args) -> list:
+    """和 DocumentProcessor.iter_split_documents 相同的路径：loader + RecursiveCharacterTextSplitter"""
+    splitter = RecursiveCharacterTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap,
+                                              length_function=len)
+    loaders = {'.txt': TextLoader, '.docx': Docx2txtLoader, '.md': UnstructuredMarkdownLoader}
+    worker = partial(load_split_file, loaders=loaders, text_splitter=splitter)
+    files = sorted(folder.iterdir())
+    result = []
+    for file_path, chunks, error in iter_parallel(worker, files, workers=workers):
+        if error is not None:
+            print(f'❌ {file_path.name}: {error}')
+            continue
+        result.extend(f'{file_path.name}:{doc.page_content[:20]}' for doc in chunks)
+    return result
+
+
+def bench(name: str, fn, folder: Path, n_files: int, args):
+    print(f'\n=== {name} ===')
+    baseline = None
+    base_time = None
+    for workers in args.workers:
+        start = time.perf_counter()
+        ids = fn(folder, workers, args)
+        elapsed = time.perf_counter() - start
+        if baseline is None:
+            baseline, base_time = ids, elapsed
+        same = '一致' if ids == baseline else '不一致!'
+        print(f'workers={workers:<3d} {elapsed:7.2f}s  {n_files / elapsed:7.1f} files/s  '
+              f'{len(ids)} chunks  加速 {base_time / elapsed:4.2f}x  顺序{same}')
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = Path(tmp)
+        n_files = build_corpus(args.source, folder, args.repeat)
+        print(f'语料: {n_files} 个文件（{args.source} x {args.repeat}）')
+        bench('private_kb_parse.parse', run_private_parse, folder, n_files, args)
+        bench('loader + splitter', run_loader_split, folder, n_files, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -20,10 +20,13 @@ warnings.filterwarnings('ignore', category=UserWarning,
 from langchain_community.document_loaders import UnstructuredMarkdownLoader, Docx2txtLoader
 import re
 import json
+from functools import partial
 from pathlib import Path
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_text_splitters import TextSplitter
 from langchain_core.documents import Document
-from typing import List, Tuple, Dict
+from typing import Dict, Iterator, List, Optional, Tuple
+from parallel_parse import iter_parallel
+from content_chunker import make_splitter
 
 def _extract_sections(file_path: Path) -> Tuple[List[Dict], str]:
 
@@ -167,11 +170,7 @@ def _extract_word_sections(file_path: Path) -> Tuple[List[Dict], str]:
 
 
 
-def parse(folder_path: str, kb_type: str = 'private', category: str = None,
-          chunk_size: int = 500, chunk_overlap: int = 50) -> List[Document]:
-
-    folder_path = Path(folder_path)
-
+def _list_source_files(folder_path: Path) -> List[Path]:
     # 检查路径是否存在
     if not folder_path.exists():
         print('路径不存在')
@@ -179,99 +178,132 @@ def parse(folder_path: str, kb_type: str = 'private', category: str = None,
     #     folder_path.mkdir(parents=True, exist_ok=True)
 
     # 获取所有 .md 和 .docx 文件
-    all_files = []
     if folder_path.is_dir():
-        md_files = list(folder_path.glob('*.md'))
-        docx_files = list(folder_path.glob('*.docx'))
+        # 排序保证每次解析的文件顺序（以及 global_chunk_index）一致
+        md_files = sorted(folder_path.glob('*.md'))
+        docx_files = sorted(folder_path.glob('*.docx'))
         all_files = md_files + docx_files
 
         if not all_files:
             print(f'⚠️ 文件夹中没有找到 .md 或 .docx 文件: {folder_path}')
             return []
         print(f'📁 在文件夹中找到 {len(md_files)} 个 .md 文件, {len(docx_files)} 个 .docx 文件')
+        return all_files
     elif folder_path.is_file() and folder_path.suffix in ['.md', '.docx']:
-
-        all_files = [folder_path]
         print(f'📄 检测到单个 {folder_path.suffix} 文件')
+        return [folder_path]
     else:
         print(f'⚠️ 不是文件夹或支持的文件类型: {folder_path}')
         return []
 
-    # 创建文本分割器
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        length_function=len
-    )
 
-    # 处理所有文件
-    all_docs = []
+def iter_parse(folder_path: str, kb_type: str = 'private', category: str = None,
+               chunk_size: int = 500, chunk_overlap: int = 50, workers: int = 1,
+               chunking: str = 'recursive') -> Iterator[Document]:
+    """
+    parse 的流式版本：逐个文件解析，边解析边产出文档块
 
-    for file in all_files:
+    global_chunk_index 在产出时就写好；total_chunks 需要知道总数，这里不写，
+    由 parse（收集成列表后）或 stream_parse_to_jsonl（写完文件后回填）补上。
+    workers > 1 时用进程池并行解析文件，产出顺序和单进程一致
+    chunking: 长章节的切分方式，'content' 时切分点由内容决定（见 content_chunker.py）
+    """
+    all_files = _list_source_files(Path(folder_path))
+    worker = partial(_parse_file_worker, kb_type=kb_type, category=category,
+                     chunk_size=chunk_size, chunk_overlap=chunk_overlap, chunking=chunking)
+
+    global_idx = 0
+    for file, file_docs, error in iter_parallel(worker, all_files, workers=workers):
         print(f'\n📖 开始解析文件: {file.name}')
+        if error is not None:
+            print(f'❌ 处理文件 {file.name} 失败: {error}')
+            continue
+        if file_docs is None:
+            continue
 
-        try:
-            # 根据文件类型选择解析函数
-            if file.suffix == '.md':
-                sections, doc_title = _extract_sections(file)
-            elif file.suffix == '.docx':
-                sections, doc_title = _extract_word_sections(file)
-            else:
-                print(f'⚠️ 不支持的文件类型: {file.suffix}')
-                continue
+        for chunk in file_docs:
+            chunk.metadata['global_chunk_index'] = global_idx
+            global_idx += 1
+            yield chunk
 
-            if not sections:
-                print(f'⚠️ 文件 {file.name} 未提取到任何章节，跳过')
-                continue
+        print(f'✅ {file.name} 解析完成')
 
-            print(f'📚 文档标题: {doc_title}')
-            print(f'📑 提取到 {len(sections)} 个章节')
-
-            # 2. 获取文件名和分类
-            file_name = file.stem
-            current_category = category if category else doc_title
-
-            # 3. 处理每个章节
-            for section_idx, section in enumerate(sections):
-                # 创建初始 Document
-                doc = Document(
-                    page_content=section['content'],
-                    metadata={
-                        'doc_title': doc_title,
-                        'section_title': section['title'],
-                        'source': str(file),
-                        'file_name': file_name,
-                        'kb_type': kb_type,
-                        'category': current_category,
-                        'section_index': section_idx
-                    }
-                )
-
-                # 如果章节太长，进一步切分
-                if len(section['content']) > chunk_size:
-                    print(f"  ✂️  章节 '{section['title']}' 较长 ({len(section['content'])} 字符)，切分中...")
-                    chunks = text_splitter.split_documents([doc])
-                else:
-                    chunks = [doc]
-
-                # 为每个 chunk 添加详细的 metadata
-                for chunk_idx, chunk in enumerate(chunks):
-                    chunk.metadata.update({
-                        'id': f"{file_name}_s{section_idx}_c{chunk_idx}",
-                        'title': section['title'],  # 章节标题作为 title
-                        'chunk_index_in_section': chunk_idx,
-                        'total_chunks_in_section': len(chunks)
-                    })
-                    all_docs.append(chunk)
 
-            print(f'✅ {file.name} 解析完成')
+def _parse_file_worker(file: Path, kb_type: str, category: str,
+                       chunk_size: int, chunk_overlap: int, chunking: str = 'recursive') -> Optional[List[Document]]:
+    """进程池 worker：在子进程里创建分割器并解析单个文件"""
+    text_splitter = make_splitter(chunking, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return _parse_file(file, kb_type, category, chunk_size, text_splitter)
 
-        except Exception as e:
-            print(f'❌ 处理文件 {file.name} 失败: {e}')
-            continue
 
-    for global_idx, doc in enumerate(all_docs):
-        doc.metadata['global_chunk_index'] = global_idx
+def _parse_file(file: Path, kb_type: str, category: str, chunk_size: int,
+                text_splitter: TextSplitter) -> Optional[List[Document]]:
+    """解析单个文件，返回该文件的所有文档块；没有章节时返回 None"""
+    # 根据文件类型选择解析函数
+    if file.suffix == '.md':
+        sections, doc_title = _extract_sections(file)
+    elif file.suffix == '.docx':
+        sections, doc_title = _extract_word_sections(file)
+    else:
+        print(f'⚠️ 不支持的文件类型: {file.suffix}')
+        return None
+
+    if not sections:
+        print(f'⚠️ 文件 {file.name} 未提取到任何章节，跳过')
+        return None
+
+    print(f'📚 文档标题: {doc_title}')
+    print(f'📑 提取到 {len(sections)} 个章节')
+
+    # 2. 获取文件名和分类
+    file_name = file.stem
+    current_category = category if category else doc_title
+
+    # 3. 处理每个章节
+    file_docs = []
+    for section_idx, section in enumerate(sections):
+        # 创建初始 Document
+        doc = Document(
+            page_content=section['content'],
+            metadata={
+                'doc_title': doc_title,
+                'section_title': section['title'],
+                'source': str(file),
+                'file_name': file_name,
+                'kb_type': kb_type,
+                'category': current_category,
+                'section_index': section_idx
+            }
+        )
+
+        # 如果章节太长，进一步切分
+        if len(section['content']) > chunk_size:
+            print(f"  ✂️  章节 '{section['title']}' 较长 ({len(section['content'])} 字符)，切分中...")
+            chunks = text_splitter.split_documents([doc])
+        else:
+            chunks = [doc]
+
+        # 为每个 chunk 添加详细的 metadata
+        for chunk_idx, chunk in enumerate(chunks):
+            chunk.metadata.update({
+                'id': f"{file_name}_s{section_idx}_c{chunk_idx}",
+                'title': section['title'],  # 章节标题作为 title
+                'chunk_index_in_section': chunk_idx,
+                'total_chunks_in_section': len(chunks)
+            })
+            file_docs.append(chunk)
+    return file_docs
+
+
+def parse(folder_path: str, kb_type: str = 'private', category: str = None,
+          chunk_size: int = 500, chunk_overlap: int = 50, workers: int = 1,
+          chunking: str = 'recursive') -> List[Document]:
+
+    all_docs = list(iter_parse(folder_path, kb_type=kb_type, category=category,
+                               chunk_size=chunk_size, chunk_overlap=chunk_overlap, workers=workers,
+                               chunking=chunking))
+
+    for doc in all_docs:
         doc.metadata['total_chunks'] = len(all_docs)
 
     print(f'\n✅ 总计解析完成，共生成 {len(all_docs)} 个文档块\n')
@@ -279,33 +311,62 @@ def parse(folder_path: str, kb_type: str = 'private', category: str = None,
     return all_docs
 
 
+def _to_jsonl_item(doc: Document) -> dict:
+    return {
+        'id': doc.metadata['id'],
+        'title': doc.metadata['title'],
+        'contents': doc.page_content,
+        'metadata': {
+            'doc_title': doc.metadata.get('doc_title'),
+            'section_title': doc.metadata.get('section_title'),
+            'source': doc.metadata.get('source'),
+            'file_name': doc.metadata.get('file_name'),
+            'kb_type': doc.metadata.get('kb_type'),
+            'category': doc.metadata.get('category'),
+            'section_index': doc.metadata.get('section_index'),
+            'chunk_index_in_section': doc.metadata.get('chunk_index_in_section'),
+            'total_chunks_in_section': doc.metadata.get('total_chunks_in_section'),
+            'global_chunk_index': doc.metadata.get('global_chunk_index'),
+            'total_chunks': doc.metadata.get('total_chunks')
+        }
+    }
+
+
 def save_to_jsonl_with_full_metadata(docs: List[Document], output_path: str):
 
     with open(output_path, 'w', encoding='utf-8') as f:
         for doc in docs:
-            item = {
-                'id': doc.metadata['id'],
-                'title': doc.metadata['title'],
-                'contents': doc.page_content,
-                'metadata': {
-                    'doc_title': doc.metadata.get('doc_title'),
-                    'section_title': doc.metadata.get('section_title'),
-                    'source': doc.metadata.get('source'),
-                    'file_name': doc.metadata.get('file_name'),
-                    'kb_type': doc.metadata.get('kb_type'),
-                    'category': doc.metadata.get('category'),
-                    'section_index': doc.metadata.get('section_index'),
-                    'chunk_index_in_section': doc.metadata.get('chunk_index_in_section'),
-                    'total_chunks_in_section': doc.metadata.get('total_chunks_in_section'),
-                    'global_chunk_index': doc.metadata.get('global_chunk_index'),
-                    'total_chunks': doc.metadata.get('total_chunks')
-                }
-            }
-            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+            f.write(json.dumps(_to_jsonl_item(doc), ensure_ascii=False) + '\n')
 
     print(f'💾 已保存 {len(docs)} 个文档块（含完整metadata）到: {output_path}')
 
 
+def stream_parse_to_jsonl(folder_path: str, output_path: str, **kwargs) -> int:
+    """
+    边解析边写 JSONL，不把全部文档块放进内存
+
+    第一遍写到临时文件（total_chunks 未知），结束后逐行回填 total_chunks 写到 output_path，
+    两遍都是逐行处理。kwargs 透传给 iter_parse，返回文档块数量
+    """
+    output_path = Path(output_path)
+    tmp_path = output_path.with_suffix(output_path.suffix + '.tmp')
+    total = 0
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for doc in iter_parse(folder_path, **kwargs):
+            f.write(json.dumps(_to_jsonl_item(doc), ensure_ascii=False) + '\n')
+            total += 1
+
+    with open(tmp_path, 'r', encoding='utf-8') as src, open(output_path, 'w', encoding='utf-8') as dst:
+        for line in src:
+            item = json.loads(line)
+            item['metadata']['total_chunks'] = total
+            dst.write(json.dumps(item, ensure_ascii=False) + '\n')
+    tmp_path.unlink()
+
+    print(f'💾 已流式保存 {total} 个文档块（含完整metadata）到: {output_path}')
+    return total
+
+
 
 if __name__ == '__main__':
     folder_path = str(DOCUMENTS_DIR)
@@ -1,11 +1,12 @@
 import json
+import hashlib
+from collections import Counter
 from pathlib import Path
 from datetime import datetime
 import shutil
 from langchain_community.embeddings.zhipuai import ZhipuAIEmbeddings
 import os
 from dotenv import load_dotenv
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import TextLoader,PyPDFLoader,Docx2txtLoader,UnstructuredMarkdownLoader
 from path_config import (
     PROJECT_ROOT, KB_LIST_DIR, KB_DIR, KB_SAVE_PATH_DIR, KB_PARSE_RESULT_DIR,
@@ -17,8 +18,39 @@ from langchain_community.vectorstores import FAISS
 from typing import Optional,Union
 from langchain_core.documents import Document
 from rag_config import ZHIPUEmbeddings
+from embedding_pipeline import EmbeddingPipeline,iter_prefetch
+from embedding_cache import CachedEmbeddings
+from kb_manifest import KBManifest
+from kb_vector_store import KBVectorStore
+from parallel_parse import iter_parallel,load_split_file
+from kb_snapshot import SnapshotStore,HotSwapRetriever
+from index_spec import normalize_index_spec
+from kb_registry import KBRegistry,get_registry
+from federated_retriever import FederatedRetriever
+from hybrid_retriever import HybridRetriever
+from sharded_store import ShardedVectorStore,live_embeddings,live_ids,load_vector_store
+from chunk_dedup import ChunkDeduplicator,file_name as dedup_file_name
+from content_chunker import make_splitter
+from functools import partial
 load_dotenv()
+#embedding 的初始批大小，入库过程中按延迟和失败自动调整
 batch_size = 32
+#每个 embedding 批次的 token 上限
+max_batch_tokens = 16384
+#同时在途的embedding批次数
+max_in_flight = 4
+#已删除向量占比超过这个值时自动compact
+compact_ratio = 0.2
+#加载/切分线程和embedding之间的队列长度（文档块数）
+prefetch_size = 256
+#每个知识库保留的向量库快照数
+keep_snapshots = 3
+#向量库保存格式: 'chunks' 为 mmap 的 chunk store（加载快、按需解码），'pickle' 为 LangChain 默认的 index.pkl
+docstore_format = 'chunks'
+#入库前近似重复文档块的 MinHash 相似度阈值，None 关闭去重（默认关闭，已有知识库的入库结果不变；建议先用 0.9 + 'mark' 观察）
+dedup_threshold = None
+#'drop' 重复块不入库，只记在 dedup.npz 的台账里；'mark' 照常入库并在 metadata['duplicate_of'] 标出保留块
+dedup_mode = 'mark'
 class KnowledgeBaseManager:
     """
     """
@@ -26,8 +58,18 @@ class KnowledgeBaseManager:
         self.kb_name = kb_path_or_name
         self.base_path = Path(kb_path_or_name)
         self.base_path.mkdir(exist_ok=True)
+        #metadata.json 路径 -> (修改时间, metadata)，文件没变就不重新解析
+        self._metadata_cache = {}
     def create_kb(self,kb_name:str,
-                  description:str):
+                  description:str,
+                  index_spec:Union[str,dict,None] = None,
+                  num_shards:int = 1,
+                  shard_by:str = 'id'):
+        """
+        index_spec: faiss 索引类型及参数，如 'hnsw' 或 {'type':'ivf_pq','nlist':4096}，默认 flat，
+        见 index_spec.py
+        num_shards: 大于 1 时向量库拆成多个分片（见 sharded_store.py），shard_by 为 'id' 或 metadata 字段名（如 'source'）
+        """
         kb_path = self.base_path / kb_name
         if kb_path.exists():
             print(f'{kb_name} already exists')
@@ -44,7 +86,9 @@ class KnowledgeBaseManager:
             'create_time':datetime.now().isoformat(),
             'update_time':datetime.now().isoformat(),
             'doc_count':0,
-            'chunk_count':0
+            'chunk_count':0,
+            'index_spec':normalize_index_spec(index_spec),
+            'sharding':{'num_shards':num_shards,'shard_by':shard_by}
         }
         with open(kb_path/'metadata.json','w',encoding='utf-8') as f:
             json.dump(metadata,f,ensure_ascii=False)
@@ -65,13 +109,26 @@ class KnowledgeBaseManager:
         kb_list = []
         for kb_name in self.base_path.iterdir():
             if kb_name.is_dir():
-                metadata_path = kb_name / 'metadata.json'
-                if metadata_path.exists():
-                    with open(metadata_path,'r',encoding='utf-8') as f:
-                        metadata = json.load(f)
+                metadata = self._read_metadata(kb_name / 'metadata.json')
+                if metadata is not None:
                     kb_list.append(metadata)
         return kb_list
 
+    def _read_metadata(self,metadata_path:Path) -> Optional[dict]:
+        """按修改时间缓存 metadata.json，返回副本，调用方修改不影响缓存"""
+        try:
+            stat = metadata_path.stat()
+            mtime = (stat.st_mtime_ns,stat.st_size)
+        except FileNotFoundError:
+            self._metadata_cache.pop(metadata_path,None)
+            return None
+        cached = self._metadata_cache.get(metadata_path)
+        if cached is None or cached[0] != mtime:
+            with open(metadata_path,'r',encoding='utf-8') as f:
+                cached = (mtime,json.load(f))
+            self._metadata_cache[metadata_path] = cached
+        return dict(cached[1])
+
     def get_kb_path(self,kb_name:str):
         if not kb_name:
             return None
@@ -81,6 +138,18 @@ class KnowledgeBaseManager:
         self.create_kb(kb_name,description='wiki数据')
         return self.base_path / kb_name
 
+    def get_index_spec(self,kb_name:str) -> dict:
+        """知识库的索引配置，老的知识库没有这个字段，按 flat 处理"""
+        metadata = self._read_metadata(self.base_path / kb_name / 'metadata.json')
+        if metadata is None:
+            return normalize_index_spec(None)
+        return normalize_index_spec(metadata.get('index_spec'))
+
+    def get_sharding(self,kb_name:str) -> dict:
+        """知识库的分片配置，老的知识库没有这个字段，不分片"""
+        metadata = self._read_metadata(self.base_path / kb_name / 'metadata.json') or {}
+        return {'num_shards':1,'shard_by':'id',**(metadata.get('sharding') or {})}
+
     def update_metadata(self,kb_name:str,**kwargs):
         kb_path = self.get_kb_path(kb_name=kb_name)
         if not kb_path:
@@ -99,36 +168,237 @@ class KnowledgeBaseManager:
         with open(metadata_path, 'w', encoding='utf-8') as f:
             json.dump(metadata, f, ensure_ascii=False, indent=2)
 class DocumentProcessor:
-    def __init__(self):
-        self.embed_model =  ZHIPUEmbeddings
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500,
-            chunk_overlap = 50,
-            #按照Len的长度来进行切割，也可以按照字符数来进行切割word_count
-            length_function=len
-        )
+    loaders ={
+        '.txt':TextLoader,
+        '.pdf':PyPDFLoader,
+        '.docx':Docx2txtLoader,
+        '.md':UnstructuredMarkdownLoader
+    }
+    def __init__(self,use_embedding_cache:bool = True,workers:int = 1,chunking:str = 'recursive'):
+        """
+        chunking: 'recursive' 固定长度 + 重叠切分；'content' 切分点由内容决定（见 content_chunker.py），
+                  文档小改动后大部分文档块不变，sync_documents 可以直接复用它们的向量
+        """
+        #相同文本的embedding走本地缓存，不重复调用API
+        self.workers = workers
+        self.embed_model = CachedEmbeddings(ZHIPUEmbeddings) if use_embedding_cache else ZHIPUEmbeddings
+        #按照Len的长度来进行切割，也可以按照字符数来进行切割word_count
+        self.text_splitter = make_splitter(chunking,chunk_size=500,chunk_overlap=50)
     def load_split_document(self,file_path:str):
+        return list(self.iter_split_document(file_path))
+
+    def iter_split_document(self,file_path:str):
+        """逐页加载、逐页切分，不把整个文件的内容一次性读进内存"""
         ext = Path(file_path).suffix.lower()
         print(ext)
-        loaders ={
-            '.txt':TextLoader,
-            '.pdf':PyPDFLoader,
-            '.docx':Docx2txtLoader,
-            '.md':UnstructuredMarkdownLoader
-        }
-        if ext not in loaders:
+        if ext not in self.loaders:
             raise ValueError(f'不支持的文件格式{ext}')
-        loader = loaders[ext](file_path)
-        loader=loader.load()
+        loader = self.loaders[ext](file_path)
         #处理documents格式
-        split_doc=self.text_splitter.split_documents(loader)
-        return split_doc
+        for page in loader.lazy_load():
+            yield from self.text_splitter.split_documents([page])
+
+    def iter_split_documents(self,file_paths:list):
+        """
+        按输入顺序产出 (file_path, chunks, error)
+
+        workers <= 1 时 chunks 是 iter_split_document 的生成器（逐页流式，出错时在迭代中抛出）；
+        workers > 1 时文件分发到进程池并行解析，chunks 是整个文件的文档块列表，失败时 error 为异常
+        """
+        if self.workers <= 1:
+            for file_path in file_paths:
+                yield file_path,self.iter_split_document(str(file_path)),None
+            return
+        worker = partial(load_split_file,loaders=self.loaders,text_splitter=self.text_splitter)
+        yield from iter_parallel(worker,[str(p) for p in file_paths],workers=self.workers)
 
 class KnowledgeService:
     public_name = ['wiki', 'wiki2', 'wiki_latest']
-    def __init__(self,kb_manager: KnowledgeBaseManager, document_processor: DocumentProcessor):
+    def __init__(self,kb_manager: KnowledgeBaseManager, document_processor: DocumentProcessor,
+                 max_in_flight:int = max_in_flight,mmap_search:bool = False,
+                 registry:Optional[KBRegistry] = None):
+        """
+        mmap_search: search_kb / hot_swap_retriever 以只读 mmap 方式加载索引，
+                     同一台机器上的多个服务进程共享索引内存；只用于检索的进程（服务端）建议打开
+        registry: search_kb 用的向量库缓存，默认是进程内共享的注册表（见 kb_registry.py）
+        """
         self.kb_manager = kb_manager
+        self.mmap_search = mmap_search
+        self.registry = registry if registry is not None else get_registry()
+        #最近一次入库的去重统计（DedupStats）
+        self.last_dedup_stats = None
         self.document_processor = document_processor
+        self.embedding_pipeline = EmbeddingPipeline(
+            self.document_processor.embed_model,
+            batch_size=batch_size,
+            max_in_flight=max_in_flight,
+            store_cls=KBVectorStore,
+            max_batch_tokens=max_batch_tokens
+        )
+
+    def _load_vector_store(self,kb_path:Path,mmap:bool = False) -> Optional[KBVectorStore]:
+        #只读取 CURRENT 指向的完整快照，入库写到一半的新快照不会被读到
+        vector_path = SnapshotStore(kb_path / 'vector_store').current_path()
+        if vector_path is None:
+            return None
+        return self._load_snapshot(vector_path,mmap=mmap)
+
+    def _load_snapshot(self,vector_path:Path,mmap:bool = False) -> Union[KBVectorStore,ShardedVectorStore]:
+        return load_vector_store(
+            str(vector_path),
+            self.document_processor.embed_model,
+            allow_dangerous_deserialization=True,
+            mmap=mmap
+        )
+
+    def _save_vector_store(self,kb_path:Path,vector_store:KBVectorStore) -> str:
+        """写一个新快照并原子地切换 CURRENT，不会覆盖正在被读取的文件"""
+        vector_store.docstore_format = docstore_format
+        name = SnapshotStore(kb_path / 'vector_store',keep=keep_snapshots).save(vector_store)
+        #快照名变了注册表本来也会重新加载，这里提前释放旧向量库的内存
+        self.registry.invalidate(kb_path / 'vector_store')
+        print(f'向量库快照已保存: {name}')
+        return name
+
+    def _deduplicator(self,kb_path:Path,vector_store,ids:Optional[set] = None) -> Optional[ChunkDeduplicator]:
+        """加载知识库已有文档块的指纹，已经不在向量库里的文档块不再参与比较；ids 是已经算好的 live_ids"""
+        if dedup_threshold is None:
+            return None
+        if ids is None:
+            ids = live_ids(vector_store) if vector_store is not None else set()
+        return ChunkDeduplicator.for_kb(kb_path,dedup_threshold,mode=dedup_mode,live_ids=ids)
+
+    @staticmethod
+    def _dedup_stage(dedup:Optional[ChunkDeduplicator],docs):
+        return docs if dedup is None else dedup.filter(docs)
+
+    @staticmethod
+    def _bytes_per_vector(vector_store) -> int:
+        """每个向量在索引里占的字节数，用来估算去重省下的索引空间"""
+        if isinstance(vector_store,ShardedVectorStore):
+            shards = [shard for shard in vector_store.shards if shard is not None]
+            if not shards:
+                return 0
+            vector_store = shards[0]
+        try:
+            return vector_store.index.sa_code_size()
+        except RuntimeError:
+            return vector_store.index.d * 4
+
+    def _save_dedup(self,kb_path:Path,dedup:Optional[ChunkDeduplicator],vector_store,stored_ids):
+        """stored_ids 是这次写进向量库（或复用）的 id，保留块 embed 失败的重复块记录先撤掉再保存"""
+        if dedup is None:
+            return
+        dedup.confirm(stored_ids)
+        dedup.save(kb_path / dedup_file_name)
+        self.last_dedup_stats = dedup.stats
+        print(dedup.stats.report(self._bytes_per_vector(vector_store) if vector_store is not None else 0))
+
+    def _store_kwargs(self,kb_name:str) -> dict:
+        """新建向量库时按知识库的 index_spec 创建对应类型的 faiss 索引，配置了分片时带上分片参数"""
+        kwargs = {'index_spec':self.kb_manager.get_index_spec(kb_name)}
+        sharding = self.kb_manager.get_sharding(kb_name)
+        if sharding['num_shards'] > 1:
+            kwargs.update(sharding)
+        return kwargs
+
+    def _store_cls(self,kb_name:str) -> type:
+        return ShardedVectorStore if self.kb_manager.get_sharding(kb_name)['num_shards'] > 1 else KBVectorStore
+
+    def rebuild_index(self,kb_name:str,index_spec:Union[str,dict,None] = None,shard:Optional[int] = None):
+        """
+        用现有向量重新训练、构建索引
+
+        index_spec 不为空时切换到新的索引类型并写回 metadata.json；
+        IVF 类索引在知识库规模增长很多之后也应该重建一次，让聚类中心跟上数据分布
+        shard: 分片的知识库只重建这一个分片（不能同时切换索引类型），其他分片的文件直接复用
+        """
+        kb_path = self.kb_manager.get_kb_path(kb_name=kb_name)
+        vector_store = self._load_vector_store(kb_path)
+        if vector_store is None:
+            print(f'知识库{kb_name}没有添加文档')
+            return False
+        if shard is not None:
+            if not isinstance(vector_store,ShardedVectorStore):
+                raise ValueError(f'知识库{kb_name}没有分片')
+            if index_spec is not None:
+                raise ValueError('单独重建一个分片时不能切换索引类型，所有分片的索引类型要一致')
+            vector_store.rebuild_shard(shard)
+            self._save_vector_store(kb_path,vector_store)
+            return True
+        spec = normalize_index_spec(index_spec) if index_spec is not None else self.kb_manager.get_index_spec(kb_name)
+        vector_store.rebuild(spec)
+        self._save_vector_store(kb_path,vector_store)
+        self.kb_manager.update_metadata(kb_name,index_spec=spec,chunk_count=vector_store.live_count)
+        return True
+
+    def reshard_kb(self,kb_name:str,num_shards:int,shard_by:str = 'id'):
+        """
+        把知识库拆成 num_shards 个分片（或重新分片），现存向量直接复用，不重新 embed；
+        num_shards 为 1 时合并回普通向量库
+        """
+        kb_path = self.kb_manager.get_kb_path(kb_name=kb_name)
+        vector_store = self._load_vector_store(kb_path)
+        if vector_store is None:
+            print(f'知识库{kb_name}没有添加文档')
+            return False
+        if num_shards > 1:
+            vector_store = ShardedVectorStore.from_vector_store(vector_store,num_shards,shard_by)
+        elif isinstance(vector_store,ShardedVectorStore):
+            text_embeddings,metadatas,ids = live_embeddings(vector_store)
+            merged = KBVectorStore.from_embeddings(text_embeddings,self.document_processor.embed_model,
+                                                   metadatas=metadatas,ids=ids,index_spec=vector_store.index_spec,
+                                                   **vector_store.store_kwargs)
+            merged.flush()
+            vector_store = merged
+        self._save_vector_store(kb_path,vector_store)
+        self.kb_manager.update_metadata(kb_name,sharding={'num_shards':num_shards,'shard_by':shard_by})
+        print(f'知识库{kb_name}已拆分为{num_shards}个分片（按{shard_by}）')
+        return True
+
+    def hot_swap_retriever(self,kb_name:str,search_kwargs:Optional[dict] = None,
+                           interval:float = 5.0) -> Optional[HotSwapRetriever]:
+        """
+        返回一个会自动切换到最新快照的 retriever（已启动后台监视线程）
+
+        其他进程入库保存新快照后，interval 秒内切换过来；用完后调用 stop()
+        """
+        kb_path = self.kb_manager.get_kb_path(kb_name = kb_name)
+        if not kb_path:
+            print(f'{kb_name}不存在')
+            return None
+        retriever = HotSwapRetriever(
+            SnapshotStore(kb_path / 'vector_store',keep=keep_snapshots),
+            loader=partial(self._load_snapshot,mmap=self.mmap_search),
+            search_kwargs=search_kwargs,
+            interval=interval
+        )
+        if retriever.vector_store is None:
+            print(f'知识库{kb_name}没有添加文档')
+        return retriever.start()
+
+    def hybrid_retriever(self,kb_name:str,k:int = 3,fetch_k:int = 20,
+                         interval:float = 5.0,**kwargs) -> Optional[HybridRetriever]:
+        """
+        BM25 + 向量的混合检索（见 hybrid_retriever.py），底层是会自动切换快照的 HotSwapRetriever；
+        用完后调用 source.stop()
+        """
+        hot_swap = self.hot_swap_retriever(kb_name,{'k':fetch_k},interval=interval)
+        if hot_swap is None:
+            return None
+        return HybridRetriever(hot_swap,k=k,fetch_k=fetch_k,**kwargs)
+
+    def federated_retriever(self,kb_names:Optional[list] = None,k:int = 3,
+                            fusion:str = 'rrf',**kwargs) -> FederatedRetriever:
+        """
+        同时检索多个知识库并融合结果的 retriever（见 federated_retriever.py），
+        结果的 metadata['kb_source'] 标明来自哪个知识库
+
+        kb_names 为空时检索所有知识库，例如 public 的 wiki 和 private 的 private_kb 一起查
+        """
+        if kb_names is None:
+            kb_names = [metadata['name'] for metadata in self.kb_manager.list_kb()]
+        return FederatedRetriever(self,kb_names,k=k,fusion=fusion,**kwargs)
 
     def add_documents(self,kb_name:str,file_path:Union[list[str],str],description:str):
         kb_path = self.kb_manager.get_kb_path(kb_name=kb_name)
@@ -136,130 +406,303 @@ class KnowledgeService:
             print(f'{kb_name}不存在')
             self.kb_manager.create_kb(kb_name,description)
             kb_path = self.kb_manager.get_kb_path(kb_name)
-        all_chunk = []
         if  isinstance(file_path,str):
             file_path = [file_path]
-        for file_i in file_path:
-            try:
-                chunk =self.document_processor.load_split_document(file_path = file_i)
-                all_chunk.extend(chunk)
-                shutil.copy(file_i,kb_path/'documents'/Path(file_i).name)
-            except Exception as e:
-                print(f"❌ 处理文件 {file_i} 失败: {e}")
-                continue
-        if not all_chunk:
-            print(f'没有处理到任何文件')
-            return False
-        vector_path = kb_path /'vector_store'
-        max_length = 1500
-        cleaned_chunks = []
-        for doc in all_chunk:
-            content = doc.page_content.strip()
-            if content and len(content) <= max_length:
-                # 移除可能导致问题的特殊字符
-                content = content.replace('\x00', '').replace('\r', '\n')
-                doc.page_content = content
-                cleaned_chunks.append(doc)
-        all_chunk = cleaned_chunks
-        print(f"总共处理了 {len(all_chunk)} 个文档块")
-        if (vector_path/'index.faiss').exists():
+        vector_store = self._load_vector_store(kb_path)
+        if vector_store is not None:
             print('本地加载faiss')
-            vector_store = FAISS.load_local(
-                str(vector_path),
-                self.document_processor.embed_model,
-                allow_dangerous_deserialization=True
-            )
-            for i in range(0, len(all_chunk), batch_size):
-                batch = all_chunk[i:i+batch_size]
-                try:
-                    vector_store.add_documents(batch)
-                    print(f'已处理 {min(i + batch_size, len(all_chunk))}/{len(all_chunk)} 个文档块')
-                except Exception as e:
-                    print(f'批次 {i}-{i+batch_size} 处理失败: {e}')
-                    for j, doc in enumerate(batch):
-                        try:
-                            vector_store.add_documents([doc])
-                            print(f'  - 文档 {i+j} 处理成功')
-                        except Exception as doc_error:
-                            print(f'  - 文档 {i+j} 跳过: {doc_error}')
-                            continue
         else:
             print(f'创建新向量库')
-            first_batch = all_chunk[:batch_size]
-            try:
-                vector_store = FAISS.from_documents(
-                    first_batch,
-                    self.document_processor.embed_model
-                )
-                print(f'已处理 {len(first_batch)}/{len(all_chunk)} 个文档块')
-            except Exception as e:
-                print(f'创建向量库失败: {e}')
-                # 尝试逐个添加来创建向量库
-                print('尝试逐个处理文档...')
-                vector_store = None
-                for i, doc in enumerate(first_batch):
-                    try:
-                        if vector_store is None:
-                            vector_store = FAISS.from_documents([doc], self.document_processor.embed_model)
-                            print(f'  - 文档 {i} 成功创建向量库')
-                        else:
-                            vector_store.add_documents([doc])
-                            print(f'  - 文档 {i} 处理成功')
-                    except Exception as doc_error:
-                        print(f'  - 文档 {i} 跳过: {doc_error}')
-                        continue
-                #这里最后再检测一下vector_store是不是创建成功，属于是最后检测了。
-                if vector_store is None:
-                    print('无法创建向量库，所有文档都失败了')
-                    return False
-
-            if len(all_chunk) > batch_size:
-                for i in range(batch_size, len(all_chunk), batch_size):
-                    batch = all_chunk[i:i + batch_size]
-                    try:
-                        vector_store.add_documents(batch)
-                        print(f'已处理 {min(i + batch_size, len(all_chunk))}/{len(all_chunk)} 个文档块')
-                    except Exception as e:
-                        print(f'批次 {i}-{i+batch_size} 处理失败: {e}')
-                        # 尝试逐个添加来找出有问题的文档
-                        for j, doc in enumerate(batch):
-                            try:
-                                vector_store.add_documents([doc])
-                                print(f'  - 文档 {i+j} 处理成功')
-                            except Exception as doc_error:
-                                print(f'  - 文档 {i+j} 跳过: {doc_error}')
-                                continue
+        #加载/切分/清洗在后台线程里流式产出，embedding 边收边处理
+        finished_files = []
+        dedup = self._deduplicator(kb_path,vector_store)
+        #去重在后台线程里和切分一起做，重复块不进入 embedding
+        chunks = iter_prefetch(self._dedup_stage(dedup,self._iter_file_chunks(kb_path,file_path,finished_files)),
+                               maxsize=prefetch_size)
+        vector_store,stats = self.embedding_pipeline.run(chunks, vector_store=vector_store,
+                                                         store_kwargs=self._store_kwargs(kb_name),
+                                                         store_cls=self._store_cls(kb_name))
+        if not stats.chunks:
+            if dedup is not None and dedup.dropped_ids:
+                #文档块全部和已有内容重复，向量库不变
+                self._save_dedup(kb_path,dedup,vector_store,stats.ids)
+            print(f'没有处理到任何文件')
+            return False
         # save_vectorstore
-        #因为这里的vector_path还是path，但是在langchain中期待传入的还是str的
-        vector_store.save_local(str(vector_path))
+        self._save_vector_store(kb_path,vector_store)
+        self._save_dedup(kb_path,dedup,vector_store,stats.ids)
         #更新metadata
         metadata_path = kb_path / 'metadata.json'
         with open(metadata_path,'r',encoding='utf-8') as f:
             metadata = json.load(f)
-        metadata['doc_count'] += len(file_path)
-        metadata['chunk_count'] = metadata.get('chunk_count',0)+len(all_chunk)
+        metadata['doc_count'] += len(finished_files)
+        metadata['chunk_count'] = metadata.get('chunk_count',0)+stats.chunks
         metadata['update_time'] = datetime.now().isoformat()
         with open(metadata_path,'w',encoding='utf-8') as f:
             json.dump(metadata,f,ensure_ascii=False,indent=2)
-        print(f'成功添加{len(file_path)}个文档，共有{len(all_chunk)}个文档块')
+        print(f'成功添加{len(finished_files)}个文档，共有{stats.chunks}个文档块')
         return True
 
+    def _iter_file_chunks(self,kb_path:Path,file_paths:list,finished_files:list,on_chunk=None):
+        """
+        逐个文件加载、切分、清洗并产出文档块
+
+        单个文件失败只跳过这个文件；处理完的文件会复制到 documents/ 并追加到 finished_files。
+        on_chunk(file_path, idx, doc) 可以在产出前给文档块补充 id 等信息
+        """
+        for file_i,file_chunks,error in self.document_processor.iter_split_documents(file_paths):
+            file_i = Path(file_i)
+            try:
+                if error is not None:
+                    raise error
+                for idx,doc in enumerate(self._iter_clean_chunks(file_chunks)):
+                    if on_chunk is not None:
+                        on_chunk(file_i,idx,doc)
+                    yield doc
+            except Exception as e:
+                print(f"❌ 处理文件 {file_i} 失败: {e}")
+                continue
+            target = kb_path/'documents'/file_i.name
+            if not target.exists() or file_i.resolve() != target.resolve():
+                shutil.copy(file_i,target)
+            finished_files.append(file_i)
+
+    @staticmethod
+    def _iter_clean_chunks(chunks,max_length:int = 1500):
+        for doc in chunks:
+            content = doc.page_content.strip()
+            if content and len(content) <= max_length:
+                # 移除可能导致问题的特殊字符
+                content = content.replace('\x00', '').replace('\r', '\n')
+                doc.page_content = content
+                yield doc
+
+    def sync_documents(self,kb_name:str,folder_path:Union[list[str],str],description:str = ''):
+        """
+        增量同步：根据 manifest 只处理变化的文件
+
+        - 新增文件: 切分 + embed + 写入
+        - 修改文件: 重新切分，内容没变的文档块复用原来的向量，其余的写入新向量、删除旧向量
+        - 删除文件: 删除对应向量
+        - 未变化文件: 不动
+        """
+        kb_path = self.kb_manager.get_kb_path(kb_name=kb_name)
+        if isinstance(folder_path,str) and Path(folder_path).is_dir():
+            files = sorted(p for p in Path(folder_path).iterdir()
+                           if p.is_file() and p.suffix.lower() in self.document_processor.loaders)
+        else:
+            files = [Path(p) for p in ([folder_path] if isinstance(folder_path,str) else folder_path)]
+
+        manifest = KBManifest(kb_path)
+        vector_store = self._load_vector_store(kb_path)
+        if vector_store is not None:
+            if not manifest.exists():
+                print(f'⚠️ {kb_name} 已有向量但没有manifest，这些向量不会被同步管理')
+        elif manifest.files:
+            print(f'⚠️ {kb_name} 向量库不存在，manifest作废，全部重新同步')
+            manifest.files = {}
+
+        added,changed,removed,hashes = manifest.diff(files)
+        print(f'同步 {kb_name}: 新增 {len(added)}, 修改 {len(changed)}, 删除 {len(removed)}, '
+              f'未变化 {len(files)-len(added)-len(changed)}')
+        if not (added or changed or removed):
+            manifest.save()
+            return True
+
+        #修改过和已删除文件的旧文档块，等新的文档块写入后再删除（内容没变的文档块直接复用）
+        stale_ids = manifest.chunk_ids([p.name for p in changed] + removed)
+        existing_ids = live_ids(vector_store) if vector_store is not None else set()
+        dedup = self._deduplicator(kb_path,vector_store,existing_ids)
+        if dedup is not None:
+            #保留块要被删掉时，和它重复而没有入库的文档块所在的文件也要重新处理，否则这些内容会丢失
+            dependents = dedup.dependents(stale_ids) - {p.name for p in added + changed}
+            orphaned = [p for p in files if p.name in dependents]
+            if orphaned:
+                print(f'{len(orphaned)} 个文件中有和被删除文档块重复的内容，一起重新同步')
+                changed += orphaned
+                stale_ids = manifest.chunk_ids([p.name for p in changed] + removed)
+            dedup.forget(stale_ids)
+        for name in removed:
+            manifest.forget(name)
+            (kb_path/'documents'/name).unlink(missing_ok=True)
+
+        #新增和修改的文件重新切分，chunk id 用 文件名_内容hash：内容没变的文档块 id 不变，
+        #同一文件里内容完全相同的文档块按出现顺序加 _1、_2 区分
+        file_chunk_ids = {}
+        file_id_counts = {}
+        def assign_id(file_i,idx,doc):
+            ids = file_chunk_ids.setdefault(file_i,[])
+            counts = file_id_counts.setdefault(file_i,Counter())
+            doc.id = f"{file_i.name}_{hashlib.sha1(doc.page_content.encode('utf-8')).hexdigest()[:16]}"
+            n = counts[doc.id]
+            counts[doc.id] += 1
+            if n:
+                doc.id = f'{doc.id}_{n}'
+            doc.metadata['id'] = doc.id
+            doc.metadata['file_name'] = file_i.name
+            ids.append(doc.id)
+        #向量库里已有同一 id（同一文件、同样内容）的文档块不用重新 embed
+        reusable = set(stale_ids) & existing_ids
+        reused = set()
+        def skip_reused(docs):
+            for doc in docs:
+                if doc.id in reusable:
+                    reused.add(doc.id)
+                    continue
+                yield doc
+        for file_i in added + changed:
+            manifest.forget(file_i.name)
+        finished_files = []
+        chunks = self._iter_file_chunks(kb_path,added + changed,finished_files,on_chunk=assign_id)
+        chunks = iter_prefetch(skip_reused(self._dedup_stage(dedup,chunks)),maxsize=prefetch_size)
+        vector_store,stats = self.embedding_pipeline.run(chunks,vector_store=vector_store,
+                                                         store_kwargs=self._store_kwargs(kb_name),
+                                                         store_cls=self._store_cls(kb_name))
+        if vector_store is None:
+            print('无法创建向量库，所有文档都失败了')
+            manifest.save()
+            return False
+        embedded_ids = set(stats.ids)
+        #这次重新 embed 的 id 可能和旧 id 相同（例如之前判为重复没入库、保留块被删后重新入库的文档块），不能删
+        obsolete = [i for i in stale_ids if i not in reused and i not in embedded_ids]
+        if obsolete:
+            n_deleted = vector_store.delete_by_ids(obsolete)
+            print(f'已删除 {n_deleted} 个旧文档块')
+        if reused:
+            print(f'复用 {len(reused)} 个内容没变的文档块')
+        added_ids = embedded_ids | reused
+        if dedup is not None:
+            #判为重复而没有入库的文档块，保留块确实在库里（已有的、这次 embed 成功的或复用的）才算处理成功
+            added_ids.update(dedup.confirm(added_ids))
+        finished = set(finished_files)
+        for file_i in finished:
+            #没切出任何文档块的文件也记下来，避免每次同步都重新解析
+            file_chunk_ids.setdefault(file_i,[])
+        for file_i,ids in file_chunk_ids.items():
+            ok_ids = [i for i in ids if i in added_ids]
+            #有chunk失败或文件中途出错时不记录hash，下次同步会重新处理这个文件
+            complete = file_i in finished and len(ok_ids) == len(ids)
+            manifest.record(file_i,ok_ids,hashes.get(file_i.name) if complete else '')
+
+        if vector_store.deleted_ratio > compact_ratio:
+            vector_store.compact()
+        self._save_vector_store(kb_path,vector_store)
+        self._save_dedup(kb_path,dedup,vector_store,added_ids)
+        manifest.save()
+        self.kb_manager.update_metadata(
+            kb_name,
+            doc_count=len(manifest.files),
+            chunk_count=vector_store.live_count
+        )
+        print(f'{kb_name} 同步完成，当前共 {vector_store.live_count} 个文档块')
+        return True
+
+    def delete_documents(self,kb_name:str,ids:Optional[list[str]] = None,
+                         file_name:Optional[Union[list[str],str]] = None,
+                         source:Optional[Union[list[str],str]] = None):
+        """
+        从知识库中删除文档块，不需要重建整个向量库
+
+        Args:
+            ids: docstore id 列表
+            file_name: metadata 中的 file_name（单个或列表）
+            source: metadata 中的 source（单个或列表）
+
+        Returns:
+            删除的文档块数量
+        """
+        kb_path = self.kb_manager.get_kb_path(kb_name=kb_name)
+        vector_store = self._load_vector_store(kb_path)
+        if vector_store is None:
+            print(f'知识库{kb_name}没有添加文档')
+            return 0
+        conditions = {}
+        if file_name is not None:
+            conditions['file_name'] = file_name
+        if source is not None:
+            conditions['source'] = source
+        target_ids = list(ids or [])
+        #多个条件之间是"或"的关系
+        for key,value in conditions.items():
+            target_ids.extend(vector_store.find_ids({key:value}))
+        n_deleted = vector_store.delete_by_ids(target_ids)
+        if not n_deleted:
+            print('没有匹配的文档块')
+            return 0
+        if vector_store.deleted_ratio > compact_ratio:
+            vector_store.compact()
+        self._save_vector_store(kb_path,vector_store)
+
+        #去重台账: 和被删除文档块重复、没有入库的文档块需要在下次同步时补回来
+        orphaned = set()
+        dedup_path = kb_path / dedup_file_name
+        if dedup_path.exists():
+            dedup = ChunkDeduplicator.load(dedup_path)
+            orphaned = dedup.dependents(target_ids)
+            dedup.forget(target_ids)
+            dedup.save(dedup_path)
+
+        #manifest 里同步去掉这些 chunk，文件的 chunk 全删光了就移出 manifest
+        manifest = KBManifest(kb_path)
+        if manifest.exists():
+            deleted = set(target_ids)
+            for name in list(manifest.files):
+                entry = manifest.files[name]
+                entry['chunk_ids'] = [i for i in entry.get('chunk_ids',[]) if i not in deleted]
+                if not entry['chunk_ids']:
+                    manifest.forget(name)
+                elif name in orphaned:
+                    #清掉 hash，下次同步当作修改过的文件重新处理
+                    entry['hash'] = ''
+            manifest.save()
+        if orphaned - set(manifest.files):
+            print(f'⚠️ 以下文件中有和被删除文档块重复、没有入库的内容，需要重新添加: {sorted(orphaned - set(manifest.files))}')
+        self.kb_manager.update_metadata(kb_name,chunk_count=vector_store.live_count)
+        print(f'已从{kb_name}删除 {n_deleted} 个文档块，剩余 {vector_store.live_count} 个')
+        return n_deleted
+
+    def compact_kb(self,kb_name:str):
+        """手动压缩：把已删除的向量从 index 中真正移除"""
+        kb_path = self.kb_manager.get_kb_path(kb_name=kb_name)
+        vector_store = self._load_vector_store(kb_path)
+        if vector_store is None:
+            return 0
+        n_removed = vector_store.compact()
+        if n_removed:
+            self._save_vector_store(kb_path,vector_store)
+        return n_removed
+
     def search_kb(self,kb_name:str):
+        """
+        返回知识库的向量库，从注册表缓存里取，快照变化后自动重新加载
+
+        返回的向量库会被其他请求共享，只用来检索，不要在上面增删文档
+        """
         kb_path = self.kb_manager.get_kb_path(kb_name = kb_name)
         if not kb_path:
             print(f'{kb_name}不存在')
             return None
-        vector_path = kb_path / 'vector_store'
-        if not (vector_path / 'index.faiss').exists():
+        vector_store = self.registry.get(kb_path / 'vector_store',
+                                         partial(self._load_snapshot,mmap=self.mmap_search),
+                                         mmap=self.mmap_search)
+        if vector_store is None:
             print(f'知识库{kb_name}没有添加文档')
             return []
-        vector_store = FAISS.load_local(
-            str(vector_path),
-            self.document_processor.embed_model,
-            allow_dangerous_deserialization=True
-        )
         return vector_store
 
+    @staticmethod
+    def _iter_jsonl_chunks(file_path:str,kb_type:str):
+        """逐行读取 jsonl 文档块，不把整个文件读进内存"""
+        with open(file_path,'r',encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                yield Document(
+                    page_content=chunk['contents'],
+                    metadata = {'id':chunk['id'],'title':chunk['title'],'kb_type':kb_type}
+                )
+
     def add_chunk2vector(self,kb_name:str,file_path:str,description:str):
         kb_path = self.kb_manager.get_kb_path(kb_name = kb_name)
 
@@ -267,39 +710,12 @@ class KnowledgeService:
             kb_type = 'private'
         else:
             kb_type = 'public'
-        with open(file_path,'r',encoding='utf-8') as f:
-            all_chunk = [json.loads(line) for line in f]
-        docs = [
-            Document(
-                page_content=chunk['contents'],
-                metadata = {'id':chunk['id'],'title':chunk['title'],'kb_type':kb_type}
-        ) for chunk in all_chunk]
-
-        print(f'共读取 {len(docs)} 个文档块')
-
-        vector_store_path = kb_path / 'vector_store' / 'index.faiss'
-        batch_size = 32
         shutil.copy(file_path,kb_path/'documents'/Path(file_path).name)
         # 判断向量库是否存在
-        if vector_store_path.exists():
+        vector_store = self._load_vector_store(kb_path)
+        if vector_store is not None:
             # 加载已有向量库
             print(f'本地知识库{kb_name}已经存在，loading中')
-            vector_store = FAISS.load_local(
-                str(kb_path/'vector_store'),
-                embeddings=self.document_processor.embed_model,
-                allow_dangerous_deserialization=True
-            )
-
-            # 批量添加文档
-            for i in range(0, len(docs), batch_size):
-                batch = docs[i:i + batch_size]
-                vector_store.add_documents(batch)
-                print(f'已处理 {min(i + batch_size, len(docs))}/{len(docs)} 个文档块')
-
-            # 保存向量库
-            vector_store.save_local(folder_path=str(kb_path/'vector_store'))
-            print(f'成功添加 {len(docs)} 个文档块')
-
         else:
             # 创建新向量库
             print(f'创建新向量库 {kb_name}')
@@ -307,26 +723,23 @@ class KnowledgeService:
                 self.kb_manager.create_kb(kb_name=kb_name, description=description)
                 kb_path = self.kb_manager.get_kb_path(kb_name)
 
-            # 先创建初始向量库
-            first_batch = docs[:batch_size]
-            vector_store = FAISS.from_documents(
-                documents=first_batch,
-                embedding=self.document_processor.embed_model
-            )
-            print(f'已处理 {len(first_batch)}/{len(docs)} 个文档块')
-            if len(docs) > batch_size:
-                for i in range(batch_size, len(docs), batch_size):
-                    batch = docs[i:i + batch_size]
-                    vector_store.add_documents(batch)
-                    print(f'已处理 {min(i + batch_size, len(docs))}/{len(docs)} 个文档块')
-
-            vector_store.save_local(folder_path=str(kb_path / 'vector_store'))
-            print(f'{kb_name}知识库创建成功')
+        dedup = self._deduplicator(kb_path,vector_store)
+        docs = iter_prefetch(self._dedup_stage(dedup,self._iter_jsonl_chunks(file_path,kb_type)),maxsize=prefetch_size)
+        vector_store,stats = self.embedding_pipeline.run(docs, vector_store=vector_store,
+                                                         store_kwargs=self._store_kwargs(kb_name),
+                                                         store_cls=self._store_cls(kb_name))
+        if vector_store is None:
+            print('无法创建向量库，所有文档都失败了')
+            return False
+        n_added = stats.chunks
+        self._save_vector_store(kb_path,vector_store)
+        self._save_dedup(kb_path,dedup,vector_store,stats.ids)
+        print(f'成功添加 {n_added} 个文档块')
 
         with open(kb_path/'metadata.json','r',encoding='utf-8') as f:
             metadata = json.load(f)
         metadata['doc_count'] += 1
-        metadata['chunk_count'] = metadata.get('chunk_count', 0) + len(docs)
+        metadata['chunk_count'] = metadata.get('chunk_count', 0) + n_added
         metadata['update_time'] = datetime.now().isoformat()
         with open(kb_path/'metadata.json','w',encoding='utf-8') as f:
             json.dump(metadata, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,68 @@
+"""
+原始 float32 向量的旁路存储
+
+量化索引（fp16 / int8 / PQ）里存的是近似向量，精排（rescore）时需要原始向量。
+这里按 index 位置对齐保存一份 float32 向量：
+- 落盘为 {index_name}.vectors.f32（行优先的裸 float32 数组），加载时用 np.memmap 只读映射，
+  检索时只会读到候选向量所在的页，不占常驻内存
+- 入库新增的向量先放在内存里，保存快照时和磁盘部分一起写进新文件
+"""
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+file_suffix = 'vectors.f32'
+# 保存时每次拷贝的行数，避免把 memmap 整个读进内存
+_copy_rows = 65536
+
+
+def raw_vectors_path(folder_path, index_name: str = 'index') -> Path:
+    return Path(folder_path) / f'{index_name}.{file_suffix}'
+
+
+class RawVectors:
+    def __init__(self, dim: int, base: Optional[np.ndarray] = None):
+        self.dim = dim
+        # 磁盘上的部分（memmap）或一个完整的数组
+        self.base = base if base is not None else np.zeros((0, dim), dtype=np.float32)
+        self._added: List[np.ndarray] = []
+        self._n_added = 0
+
+    @classmethod
+    def load(cls, path, dim: int) -> 'RawVectors':
+        return cls(dim, np.memmap(path, dtype=np.float32, mode='r').reshape(-1, dim))
+
+    def __len__(self) -> int:
+        return len(self.base) + self._n_added
+
+    def append(self, vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        self._added.append(vectors)
+        self._n_added += len(vectors)
+
+    def get(self, positions) -> np.ndarray:
+        positions = np.asarray(positions, dtype=np.int64)
+        n_base = len(self.base)
+        if not self._added or (len(positions) and positions.max() < n_base):
+            return np.asarray(self.base[positions], dtype=np.float32)
+        # 新增部分合并成一个数组，磁盘部分保持 memmap 不动
+        if len(self._added) > 1:
+            self._added = [np.vstack(self._added)]
+        added = self._added[0]
+        result = np.empty((len(positions), self.dim), dtype=np.float32)
+        in_base = positions < n_base
+        result[in_base] = self.base[positions[in_base]]
+        result[~in_base] = added[positions[~in_base] - n_base]
+        return result
+
+    def take(self, keep: np.ndarray) -> 'RawVectors':
+        """只保留 keep 这些位置（compact / 重建索引后重新对齐）"""
+        return RawVectors(self.dim, self.get(keep))
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            for start in range(0, len(self.base), _copy_rows):
+                np.asarray(self.base[start:start + _copy_rows], dtype=np.float32).tofile(f)
+            for vectors in self._added:
+                vectors.tofile(f)
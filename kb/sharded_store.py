@@ -0,0 +1,361 @@
+"""
+分片向量库：一个知识库拆成 N 个 KBVectorStore 分片，每个分片有自己的 faiss 索引文件
+
+- 分片方式 shard_by: 'id' 按文档块 id 的哈希；或者 metadata 字段名（如 'source'），同一个文件的文档块落在同一个分片
+- 入库时按分片分组，各分片在线程池里并行写入 / 训练（faiss 的 add / train 会释放 GIL）
+- 检索时所有分片并行检索，每个分片的结果已经按分数排好序，用堆做 k 路归并取全局 top-k
+- 每个分片可以单独重建（rebuild_shard），从快照加载后没有改动的分片保存时直接硬链接旧文件，不重新写
+
+保存在一个快照目录里（和单个向量库一样走 SnapshotStore 的原子切换）:
+snapshot/
+  shards.json        # {"num_shards": 4, "shard_by": "id", "index_spec": {...}}
+  shard_0/           # 一个完整的 KBVectorStore（index.faiss、chunk store 等）
+  shard_1/
+  ...
+"""
+import heapq
+import json
+import os
+import shutil
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from index_spec import normalize_index_spec
+from kb_vector_store import KBVectorStore
+
+manifest_name = 'shards.json'
+
+
+def is_sharded(folder_path) -> bool:
+    return (Path(folder_path) / manifest_name).exists()
+
+
+def load_vector_store(folder_path, embeddings, **kwargs):
+    """按目录内容加载分片向量库或普通向量库"""
+    if is_sharded(folder_path):
+        return ShardedVectorStore.load_local(str(folder_path), embeddings, **kwargs)
+    return KBVectorStore.load_local(str(folder_path), embeddings, **kwargs)
+
+
+def live_embeddings(vector_store) -> Tuple[list, list, list]:
+    """取出向量库（普通或分片）里所有未删除的 ((文本, 向量), metadata, id)，用于重新分片，不重新 embed"""
+    if isinstance(vector_store, ShardedVectorStore):
+        text_embeddings, metadatas, ids = [], [], []
+        for shard in vector_store.shards:
+            if shard is not None:
+                part = live_embeddings(shard)
+                text_embeddings += part[0]
+                metadatas += part[1]
+                ids += part[2]
+        return text_embeddings, metadatas, ids
+    rows = [(i, _id, doc) for i, (_id, doc) in enumerate(vector_store._iter_rows()) if doc is not None]
+    vectors = vector_store._reconstruct(np.array([i for i, _, _ in rows], dtype=np.int64))
+    return ([(doc.page_content, vec) for (_, _, doc), vec in zip(rows, vectors)],
+            [doc.metadata for _, _, doc in rows],
+            [_id for _, _id, _ in rows])
+
+
+def live_ids(vector_store) -> set:
+    """向量库（普通或分片）里所有未删除的 docstore id"""
+    if isinstance(vector_store, ShardedVectorStore):
+        return set().union(*(live_ids(shard) for shard in vector_store.shards if shard is not None))
+    return set(vector_store._reverse_index())
+
+
+def _link_dir(src: Path, dst: Path):
+    """快照里的文件写完后不再修改，没改动的分片用硬链接复用，跨文件系统时退化为复制"""
+    dst.mkdir(parents=True, exist_ok=True)
+    for p in src.iterdir():
+        if not p.is_file():
+            continue
+        try:
+            os.link(p, dst / p.name)
+        except OSError:
+            shutil.copy2(p, dst / p.name)
+
+
+class ShardedVectorStore(VectorStore):
+    def __init__(self, embedding, num_shards: int, shard_by: str = 'id',
+                 index_spec: Union[str, dict, None] = None, **store_kwargs):
+        """
+        Args:
+            embedding: embedding 模型，所有分片共用
+            num_shards: 分片数
+            shard_by: 'id' 或 metadata 字段名
+            index_spec: 每个分片的索引配置（见 index_spec.py）
+            store_kwargs: 新建分片时传给 KBVectorStore 的参数（distance_strategy / normalize_L2）
+        """
+        if num_shards < 1:
+            raise ValueError('分片数至少为 1')
+        self.embedding = embedding
+        self.shards: List[Optional[KBVectorStore]] = [None] * num_shards
+        self.shard_by = shard_by
+        self.index_spec = normalize_index_spec(index_spec)
+        self.store_kwargs = store_kwargs
+        self.read_only = False
+        self._docstore_format = 'chunks'
+        # 加载时每个分片所在的目录；没有改动的分片保存时直接硬链接
+        self._sources: List[Optional[Path]] = [None] * num_shards
+        self._dirty = set(range(num_shards))
+        self._executor = ThreadPoolExecutor(max_workers=num_shards, thread_name_prefix='shard')
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    @property
+    def num_shards(self) -> int:
+        return len(self.shards)
+
+    @property
+    def distance_strategy(self):
+        return self.store_kwargs.get('distance_strategy', DistanceStrategy.EUCLIDEAN_DISTANCE)
+
+    @property
+    def docstore_format(self) -> str:
+        return self._docstore_format
+
+    @docstore_format.setter
+    def docstore_format(self, value: str):
+        for i, shard in enumerate(self.shards):
+            if shard is not None and shard.docstore_format != value:
+                shard.docstore_format = value
+                self._dirty.add(i)
+        self._docstore_format = value
+
+    def _check_writable(self):
+        if self.read_only:
+            raise ValueError('向量库是只读加载的（mmap），不能修改；请用普通方式加载后再写入')
+
+    def shard_of(self, doc_id: str, metadata: Optional[dict] = None) -> int:
+        if self.shard_by == 'id':
+            key = doc_id
+        else:
+            key = str((metadata or {}).get(self.shard_by, doc_id))
+        # crc32 在不同进程 / 不同机器上结果一致，不能用内置的 hash
+        return zlib.crc32(key.encode('utf-8')) % self.num_shards
+
+    def _map(self, fn: Callable, shard_ids: Iterable[int]) -> Dict[int, Any]:
+        """在线程池里对各分片并行执行 fn(分片序号)，按分片序号返回结果"""
+        futures = {i: self._executor.submit(fn, i) for i in shard_ids}
+        return {i: future.result() for i, future in futures.items()}
+
+    def _live_shards(self) -> List[int]:
+        return [i for i, shard in enumerate(self.shards) if shard is not None]
+
+    # ---------------- 写入 ----------------
+    @classmethod
+    def from_embeddings(cls, text_embeddings, embedding, metadatas=None, ids=None,
+                        index_spec: Union[str, dict, None] = None, num_shards: int = 2,
+                        shard_by: str = 'id', **kwargs) -> 'ShardedVectorStore':
+        store = cls(embedding, num_shards, shard_by, index_spec, **kwargs)
+        store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        return store
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding, metadatas=None, ids=None, **kwargs) -> 'ShardedVectorStore':
+        return cls.from_embeddings(list(zip(texts, embedding.embed_documents(texts))), embedding,
+                                   metadatas=metadatas, ids=ids, **kwargs)
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs) -> List[str]:
+        texts = list(texts)
+        return self.add_embeddings(zip(texts, self.embedding.embed_documents(texts)), metadatas=metadatas, ids=ids)
+
+    def add_embeddings(self, text_embeddings, metadatas=None, ids=None, **kwargs) -> List[str]:
+        """按分片分组后并行写入，返回的 id 和输入顺序一致"""
+        self._check_writable()
+        text_embeddings = list(text_embeddings)
+        ids = ids or [str(uuid.uuid4()) for _ in text_embeddings]
+        metadatas = metadatas or [{} for _ in text_embeddings]
+        groups: Dict[int, Tuple[list, list, list]] = {}
+        for text_embedding, metadata, _id in zip(text_embeddings, metadatas, ids):
+            group = groups.setdefault(self.shard_of(_id, metadata), ([], [], []))
+            group[0].append(text_embedding)
+            group[1].append(metadata)
+            group[2].append(_id)
+
+        def add(i):
+            batch, batch_metadatas, batch_ids = groups[i]
+            if self.shards[i] is None:
+                self.shards[i] = KBVectorStore.from_embeddings(
+                    batch, self.embedding, metadatas=batch_metadatas, ids=batch_ids,
+                    index_spec=self.index_spec, **self.store_kwargs)
+                self.shards[i].docstore_format = self._docstore_format
+            else:
+                self.shards[i].add_embeddings(batch, metadatas=batch_metadatas, ids=batch_ids)
+
+        self._map(add, groups)
+        self._dirty.update(groups)
+        return list(ids)
+
+    def flush(self) -> int:
+        flushed = self._map(lambda i: self.shards[i].flush(), self._live_shards())
+        self._dirty.update(i for i, n in flushed.items() if n)
+        return sum(flushed.values())
+
+    # ---------------- 删除 / 压缩 / 重建 ----------------
+    @property
+    def live_count(self) -> int:
+        return sum(self.shards[i].live_count for i in self._live_shards())
+
+    @property
+    def deleted_ratio(self) -> float:
+        total = sum(self.shards[i].index.ntotal for i in self._live_shards())
+        deleted = sum(len(self.shards[i].tombstones) for i in self._live_shards())
+        return deleted / total if total else 0.0
+
+    def delete_by_ids(self, ids: Iterable[str]) -> int:
+        self._check_writable()
+        ids = list(ids)
+        if self.shard_by == 'id':
+            # 按 id 分片时直接路由到所在的分片
+            routed: Dict[int, List[str]] = {}
+            for _id in ids:
+                routed.setdefault(self.shard_of(_id), []).append(_id)
+            targets = [i for i in routed if self.shards[i] is not None]
+            deleted = self._map(lambda i: self.shards[i].delete_by_ids(routed[i]), targets)
+        else:
+            deleted = self._map(lambda i: self.shards[i].delete_by_ids(ids), self._live_shards())
+        self._dirty.update(i for i, n in deleted.items() if n)
+        return sum(deleted.values())
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs) -> Optional[bool]:
+        if ids is None:
+            raise ValueError('No ids provided to delete.')
+        self.delete_by_ids(ids)
+        return True
+
+    def find_ids(self, filter) -> List[str]:
+        found = self._map(lambda i: self.shards[i].find_ids(filter), self._live_shards())
+        return [_id for i in sorted(found) for _id in found[i]]
+
+    def delete_by_metadata(self, **conditions) -> int:
+        return self.delete_by_ids(self.find_ids(conditions))
+
+    def compact(self) -> int:
+        self._check_writable()
+        targets = [i for i in self._live_shards() if self.shards[i].tombstones]
+        removed = self._map(lambda i: self.shards[i].compact(), targets)
+        self._dirty.update(targets)
+        return sum(removed.values())
+
+    def rebuild_shard(self, i: int, index_spec: Union[str, dict, None] = None) -> int:
+        """单独重建一个分片，其他分片不受影响"""
+        self._check_writable()
+        if self.shards[i] is None:
+            return 0
+        n = self.shards[i].rebuild(index_spec)
+        self._dirty.add(i)
+        return n
+
+    def rebuild(self, index_spec: Union[str, dict, None] = None) -> int:
+        """所有分片并行重建"""
+        if index_spec is not None:
+            self.index_spec = normalize_index_spec(index_spec)
+        rebuilt = self._map(lambda i: self.rebuild_shard(i, self.index_spec), self._live_shards())
+        return sum(rebuilt.values())
+
+    # ---------------- 检索 ----------------
+    def _merge(self, results: List[List[Tuple[Document, float]]], k: int,
+               higher_is_better: bool) -> List[Tuple[Document, float]]:
+        """每个分片的结果已经按分数排好序，堆归并取前 k 个"""
+        return list(islice(heapq.merge(*results, key=lambda hit: hit[1], reverse=higher_is_better), k))
+
+    def _higher_is_better(self) -> bool:
+        return self.distance_strategy in (DistanceStrategy.MAX_INNER_PRODUCT, DistanceStrategy.JACCARD)
+
+    def _embed_query(self, query: str) -> List[float]:
+        return self.embedding.embed_query(query)
+
+    def similarity_search_with_score_by_vector(
+            self, embedding: List[float], k: int = 4,
+            filter: Optional[Union[Callable, Dict[str, Any]]] = None,
+            fetch_k: int = 20, **kwargs: Any) -> List[Tuple[Document, float]]:
+        results = self._map(
+            lambda i: self.shards[i].similarity_search_with_score_by_vector(
+                embedding, k=k, filter=filter, fetch_k=fetch_k, **kwargs),
+            self._live_shards())
+        return self._merge(list(results.values()), k, self._higher_is_better())
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self._embed_query(query), k=k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=k, **kwargs)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, **kwargs)]
+
+    def bm25_search_with_score(self, query: str, k: int = 4, filter=None,
+                               fetch_k: int = 20) -> List[Tuple[Document, float]]:
+        results = self._map(
+            lambda i: self.shards[i].bm25_search_with_score(query, k=k, filter=filter, fetch_k=fetch_k),
+            self._live_shards())
+        return self._merge(list(results.values()), k, higher_is_better=True)
+
+    # ---------------- 持久化 ----------------
+    def save_local(self, folder_path: str, index_name: str = 'index') -> None:
+        path = Path(folder_path)
+        path.mkdir(parents=True, exist_ok=True)
+        self.flush()
+
+        def save(i):
+            shard_path = path / f'shard_{i}'
+            if i not in self._dirty and self._sources[i] is not None:
+                _link_dir(self._sources[i], shard_path)
+            else:
+                self.shards[i].save_local(str(shard_path), index_name)
+
+        self._map(save, self._live_shards())
+        with open(path / manifest_name, 'w', encoding='utf-8') as f:
+            json.dump({'num_shards': self.num_shards, 'shard_by': self.shard_by, 'index_spec': self.index_spec},
+                      f, ensure_ascii=False)
+
+    @classmethod
+    def load_local(cls, folder_path: str, embeddings, index_name: str = 'index', mmap: bool = False, **kwargs):
+        path = Path(folder_path)
+        with open(path / manifest_name, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        store_kwargs = {k: v for k, v in kwargs.items() if k != 'allow_dangerous_deserialization'}
+        store = cls(embeddings, manifest['num_shards'], manifest['shard_by'], manifest['index_spec'], **store_kwargs)
+        present = [i for i in range(store.num_shards) if (path / f'shard_{i}').is_dir()]
+
+        def load(i):
+            return KBVectorStore.load_local(str(path / f'shard_{i}'), embeddings,
+                                            index_name=index_name, mmap=mmap, **kwargs)
+
+        for i, shard in store._map(load, present).items():
+            store.shards[i] = shard
+            store._sources[i] = path / f'shard_{i}'
+        if present:
+            store._docstore_format = store.shards[present[0]].docstore_format
+        store._dirty = set()
+        store.read_only = mmap
+        return store
+
+    @classmethod
+    def from_vector_store(cls, vector_store: KBVectorStore, num_shards: int, shard_by: str = 'id',
+                          index_spec: Union[str, dict, None] = None) -> 'ShardedVectorStore':
+        """把一个向量库（普通或分片）按新的分片方式拆开（现存向量直接复用，不重新 embed）"""
+        if isinstance(vector_store, ShardedVectorStore):
+            embedding, store_kwargs = vector_store.embedding, vector_store.store_kwargs
+        else:
+            embedding = vector_store.embedding_function
+            store_kwargs = {'distance_strategy': vector_store.distance_strategy,
+                            'normalize_L2': vector_store._normalize_L2}
+        store = cls(embedding, num_shards, shard_by,
+                    index_spec if index_spec is not None else vector_store.index_spec, **store_kwargs)
+        store.docstore_format = vector_store.docstore_format
+        text_embeddings, metadatas, ids = live_embeddings(vector_store)
+        store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        store.flush()
+        return store
@@ -11,6 +11,7 @@ from typing import Optional
 from rag_config import rerank_url,get_device,llm,_rerank_model
 from rag_with_async_table import invoke_save,engine,get_rag_chain_session,get_session_history
 from contextlib import asynccontextmanager
+from memory_report import print_memory_report
 class RAGApplication:
     def __init__(self,kb_path:str,kb_name:str,use_rerank:bool = True):
         self.kb_path = kb_path
@@ -39,10 +40,17 @@ class RAGApplication:
             self._load_knowledge_service
         )
         print('知识库服务初始化完成')
-        self.vector_store =await asyncio.to_thread(
-            self.knowledge_service.search_kb,self.kb_name
+        #retriever 在后台监视知识库快照，入库产生新快照后自动切换，不影响正在处理的请求
+        self.retriever =await asyncio.to_thread(
+            self.knowledge_service.hot_swap_retriever,self.kb_name,{'k': 3}
         )
-        self.retriever = self.vector_store.as_retriever(search_kwargs={'k': 3})
+        if self.retriever is None:
+            raise RuntimeError(f'知识库 {self.kb_name} 不存在（{self.kb_path}），请先创建知识库并添加文档')
+        if self.retriever.vector_store is None:
+            await asyncio.to_thread(self.retriever.stop)
+            raise RuntimeError(f'知识库 {self.kb_name} 还没有可用的向量库快照，请先添加文档再启动服务')
+        self.vector_store = self.retriever.vector_store
+        print_memory_report(' 知识库加载完成')
 
         if self.use_rerank:
             print(f'正在加载rerank模型')
@@ -71,9 +79,11 @@ class RAGApplication:
         self.is_initialized = True
 
     def _load_knowledge_service(self):
+        #只做检索，索引用只读 mmap 加载，多个进程共享同一份内存
         return KnowledgeService(
             KnowledgeBaseManager(kb_path_or_name = self.kb_path),
-                                 document_processor=DocumentProcessor())
+                                 document_processor=DocumentProcessor(),
+                                 mmap_search=True)
 
     def _load_rerank_model(self):
         return SimpleRerank(
@@ -92,6 +102,8 @@ class RAGApplication:
             print('正在关闭数据库连接')
             await engine.dispose()
             print('数据库连接池已经关闭')
+        if self.retriever is not None:
+            await asyncio.to_thread(self.retriever.stop)
         self.vector_store = None
         self.retriever = None
         self.rerank_model = None
@@ -10,7 +10,9 @@ from config.path_config import (
     VECTOR_STORE_DIR, DB_DIR, BGE_RERANKER_MODEL
 )
 sys.path.append(str(DB_DIR))
+sys.path.append(str(KB_DIR))
 from rag_with_async_table import main,invoke_save,single_question,rag_chain
+from memory_report import process_memory
 import uvicorn
 import os
 import json
@@ -55,6 +57,11 @@ async def chat_stream(question:str,session_id:str):
             yield json_str
     return EventSourceResponse(generate())
 
+#当前worker进程的内存统计，rss包含和其他worker共享的mmap索引页，pss是均摊后的值
+@app.get('/memory')
+async def memory_info():
+    return {'pid':os.getpid(),**process_memory()}
+
 # 挂载静态文件目录（放在最后）
 static_dir = os.path.join(os.path.dirname(__file__), "static")
 if os.path.exists(static_dir):
@@ -0,0 +1,119 @@
+"""
+BGE reranker 的 ONNX Runtime 后端（CPU）
+
+服务器没有 GPU，CrossEncoder 走 PyTorch 在 CPU 上跑 bge-reranker-large，rerank 成了请求延迟里最大的一段。
+这里把模型导出成 ONNX，可选再做 int8 动态量化（权重 int8，激活运行时量化），用 onnxruntime 推理：
+
+- 导出: python src/onnx_reranker.py --model $BGE_RERANKER_MODEL --quantize
+  生成 {model}/onnx/model.onnx 和 model_int8.onnx，tokenizer 仍然用原模型目录里的
+- OnnxCrossEncoder.predict 和 CrossEncoder.predict 接口一致（[[query, text], ...] -> 分数数组），
+  单输出的模型和 CrossEncoder 一样过 sigmoid，分数可以直接混用 / 比较
+- 在 rag_config.rerank_backend（环境变量 RERANK_BACKEND）里选择 torch / onnx / onnx_int8
+- 和 PyTorch 后端的延迟、分数一致性见 evaluation/rerank_backend_benchmark.py
+
+onnxruntime 是可选依赖，只有选了 onnx 后端时才需要安装（pip install -r requirements-onnx.txt）
+"""
+import os
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+onnx_dir_name = 'onnx'
+model_file_names = {'onnx': 'model.onnx', 'onnx_int8': 'model_int8.onnx'}
+
+
+def onnx_model_path(model_path, backend: str = 'onnx') -> Path:
+    return Path(model_path) / onnx_dir_name / model_file_names[backend]
+
+
+def export_onnx(model_path, quantize: bool = True, opset: int = 17) -> Path:
+    """把 HuggingFace 格式的 reranker 导出成 ONNX，quantize 时额外生成 int8 动态量化版本"""
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    output = onnx_model_path(model_path, 'onnx')
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(str(model_path))
+    model = AutoModelForSequenceClassification.from_pretrained(str(model_path)).eval()
+    sample = tokenizer([['query', 'document']], padding=True, truncation=True, return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['logits'] = {0: 'batch'}
+    with torch.no_grad():
+        torch.onnx.export(model, tuple(sample[name] for name in input_names), str(output),
+                          input_names=input_names, output_names=['logits'],
+                          dynamic_axes=dynamic_axes, opset_version=opset)
+    print(f'已导出 ONNX 模型: {output}')
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantized = onnx_model_path(model_path, 'onnx_int8')
+        quantize_dynamic(str(output), str(quantized), weight_type=QuantType.QInt8)
+        print(f'已导出 int8 量化模型: {quantized}')
+    return output
+
+
+class OnnxCrossEncoder:
+    def __init__(self, model_path, backend: str = 'onnx', max_length: int = 512, batch_size: int = 32,
+                 num_threads: Optional[int] = None):
+        """
+        Args:
+            model_path: 原模型目录（tokenizer 从这里加载，ONNX 文件在 {model_path}/onnx/ 下）
+            backend: 'onnx'（fp32）或 'onnx_int8'
+            max_length: 截断长度，和 CrossEncoder 的 max_length 一致
+            batch_size: 一次推理的 pair 数
+            num_threads: onnxruntime 的算子内线程数，默认用满所有核
+        """
+        if ort is None:
+            raise ImportError('onnx rerank 后端需要安装 onnxruntime: pip install -r requirements-onnx.txt')
+        from transformers import AutoTokenizer
+
+        path = onnx_model_path(model_path, backend)
+        if not path.exists():
+            raise FileNotFoundError(f'{path} 不存在，先运行 python src/onnx_reranker.py --model {model_path} 导出')
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_path))
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads or os.cpu_count() or 1
+        self.session = ort.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def predict(self, pairs: Sequence[Sequence[str]], batch_size: Optional[int] = None, **kwargs) -> np.ndarray:
+        batch_size = batch_size or self.batch_size
+        scores: List[np.ndarray] = []
+        for start in range(0, len(pairs), batch_size):
+            batch = [list(pair) for pair in pairs[start:start + batch_size]]
+            encoded = self.tokenizer(batch, padding=True, truncation=True, max_length=self.max_length,
+                                     return_tensors='np')
+            feeds = {name: encoded[name].astype(np.int64) for name in self.input_names if name in encoded}
+            logits = self.session.run(None, feeds)[0]
+            if logits.ndim == 2 and logits.shape[1] == 1:
+                # 和 CrossEncoder 对单输出模型的默认激活一致
+                scores.append(1 / (1 + np.exp(-logits[:, 0])))
+            else:
+                scores.append(logits)
+        if not scores:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(scores).astype(np.float32)
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+    from config.path_config import BGE_RERANKER_MODEL
+
+    parser = argparse.ArgumentParser(description='把 BGE reranker 导出成 ONNX（可选 int8 动态量化）',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--model', type=Path, default=BGE_RERANKER_MODEL, help='reranker 模型目录')
+    parser.add_argument('--quantize', action='store_true', help='同时生成 int8 动态量化模型')
+    parser.add_argument('--opset', type=int, default=17)
+    args = parser.parse_args()
+    export_onnx(args.model, quantize=args.quantize, opset=args.opset)
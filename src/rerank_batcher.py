@@ -0,0 +1,140 @@
+"""
+跨请求的 rerank 微批处理
+
+每个请求各自 asyncio.to_thread(CrossEncoder.predict) 时，并发的请求各跑一堆小批次的前向计算，
+互相抢 CPU，矩阵运算的利用率很低。这里用一个后台线程统一调用模型：
+
+- 请求把 (query, 文本) 对放进队列，拿到一个 Future
+- 后台线程取到第一个请求后，最多再等 max_wait_ms 毫秒收集其他请求，pair 数凑够 max_batch_size 就立即开始
+- 合并成一次 predict，再按每个请求的 pair 数把分数切回去
+- 单个请求的 pair 数超过 max_batch_size 时自成一批（不拆开）
+
+- 等待中的请求被取消（客户端断开、asyncio.wait_for 超时）时直接丢掉，不影响后台线程
+
+延迟的额外代价最多是 max_wait_ms；并发越高，每次前向计算的批次越大，吞吐越高
+"""
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+_stop = object()
+
+
+class RerankBatcher:
+    def __init__(self, predict: Callable[[List[list]], Sequence[float]], max_batch_size: int = 64,
+                 max_wait_ms: float = 5.0):
+        """
+        Args:
+            predict: 对 [[query, text], ...] 打分的函数，通常是 CrossEncoder.predict，需要接受 batch_size 参数
+            max_batch_size: 一次前向计算最多的 pair 数
+            max_wait_ms: 收到第一个请求后最多等待多久再开始计算
+        """
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # 统计：前向计算次数、请求数、pair 数
+        self.batches = 0
+        self.requests = 0
+        self.pairs = 0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True, name='rerank-batcher')
+                    self._thread.start()
+
+    def submit(self, pairs: List[list]) -> Future:
+        future = Future()
+        if not pairs:
+            future.set_result(np.zeros(0, dtype=np.float32))
+            return future
+        self._ensure_started()
+        self._queue.put((pairs, future))
+        return future
+
+    def score(self, pairs: List[list]) -> np.ndarray:
+        return self.submit(pairs).result()
+
+    async def ascore(self, pairs: List[list]) -> np.ndarray:
+        return await asyncio.wrap_future(self.submit(pairs))
+
+    @staticmethod
+    def _start(item) -> bool:
+        """把 Future 标记为运行中，之后就不能再被取消；已经取消的请求返回 False"""
+        return item[1].set_running_or_notify_cancel()
+
+    @staticmethod
+    def _resolve(future: Future, result=None, error: Optional[BaseException] = None):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _collect(self, first) -> list:
+        batch = [first]
+        size = len(first[0])
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while size < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _stop:
+                # 先把手上的批次算完再退出
+                self._queue.put(_stop)
+                break
+            if not self._start(item):
+                continue
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _stop:
+                return
+            if not self._start(first):
+                continue
+            batch = [first]
+            try:
+                batch = self._collect(first)
+                pairs = [pair for request_pairs, _ in batch for pair in request_pairs]
+                # 合并后的 pair 一次前向计算，不再按 predict 默认的 batch_size 拆开
+                scores = np.asarray(self.predict(pairs, batch_size=len(pairs)), dtype=np.float32)
+            except BaseException as e:
+                # 后台线程不能死掉，否则之后所有请求都会一直等下去
+                for _, future in batch:
+                    self._resolve(future, error=e)
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            self.pairs += len(pairs)
+            offset = 0
+            for request_pairs, future in batch:
+                self._resolve(future, scores[offset:offset + len(request_pairs)])
+                offset += len(request_pairs)
+
+    def stats(self) -> dict:
+        return {'batches': self.batches, 'requests': self.requests, 'pairs': self.pairs,
+                'avg_batch_pairs': self.pairs / self.batches if self.batches else 0.0}
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(_stop)
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,93 @@
+"""
+rerank 分数缓存
+
+同一个（改写后的）问题会被很多用户反复问到，召回的候选文档块也基本一样，
+CrossEncoder 每次都把所有 (query, chunk) 重新算一遍。这里缓存每一对的分数：
+
+- key = (规范化后的 query, chunk id, 知识库版本)；知识库换了快照（版本变了）旧分数自然失效
+- chunk 没有 id（直接传字符串）时用内容的 sha1 当 id
+- 容量上限按 LRU 淘汰，超过 ttl 秒的条目视为过期
+- 只有没命中的 pair 送进模型，hits / misses / hit_ratio 可以用来观察热门问题省了多少计算
+"""
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+
+_whitespace = re.compile(r'\s+')
+
+
+def normalize_query(query: str) -> str:
+    return _whitespace.sub(' ', unicodedata.normalize('NFC', query)).strip()
+
+
+def chunk_key(doc) -> str:
+    """Document 优先用 metadata['id'] / doc.id，字符串或没有 id 时用内容 hash"""
+    metadata = getattr(doc, 'metadata', None) or {}
+    doc_id = metadata.get('id') or getattr(doc, 'id', None)
+    if doc_id:
+        return str(doc_id)
+    text = getattr(doc, 'page_content', doc)
+    return 'sha1:' + hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class RerankScoreCache:
+    def __init__(self, max_entries: int = 50_000, ttl: Optional[float] = 3600):
+        """
+        Args:
+            max_entries: 最多缓存的 pair 数
+            ttl: 条目有效期（秒），None 不过期
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (分数, 写入时间)
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(query: str, doc, version: Optional[str] = None) -> Tuple[str, str, Optional[str]]:
+        return normalize_query(query), chunk_key(doc), version
+
+    def get_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, float]:
+        """返回命中的 {key: 分数}"""
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and (self.ttl is None or now - entry[1] <= self.ttl):
+                    self._entries.move_to_end(key)
+                    found[key] = entry[0]
+                    self.hits += 1
+                else:
+                    if entry is not None:
+                        del self._entries[key]
+                    self.misses += 1
+        return found
+
+    def put_many(self, items: Iterable[Tuple[Hashable, float]]):
+        now = time.monotonic()
+        with self._lock:
+            for key, score in items:
+                self._entries[key] = (float(score), now)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': self.hit_ratio}
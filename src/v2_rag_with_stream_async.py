@@ -16,6 +16,7 @@ from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.runnables import RunnableWithMessageHistory
 from langchain_community.embeddings.zhipuai import ZhipuAIEmbeddings
 import asyncio
+from config.rate_limiter import ChatRateLimiter, ChatTokenUsage, RateLimitedEmbeddings
 
 # 项目根目录
 PROJECT_ROOT = Path(__file__).parent.parent
@@ -26,14 +27,16 @@ VECTOR_STORE_DIR = PROJECT_ROOT / "vector_store"
 llm = ChatOpenAI(
     model_name=os.getenv('ZHIPU_MODEL_NAME'),
     api_key=os.getenv('ZHIPUAI_API_KEY'),
-    base_url=os.getenv('ZHIPUAI_URL')
+    base_url=os.getenv('ZHIPUAI_URL'),
+    rate_limiter=ChatRateLimiter(),
+    callbacks=[ChatTokenUsage()]
 )
 
 # 初始化Embedding模型
-embed_model = ZhipuAIEmbeddings(
+embed_model = RateLimitedEmbeddings(ZhipuAIEmbeddings(
     model_name='embedding-2',
     api_key=os.getenv('ZHIPUAI_API_KEY')
-)
+))
 
 
 def load_split_documents(documents_name: str) -> list:
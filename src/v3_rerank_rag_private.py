@@ -4,44 +4,180 @@ import numpy as np
 from langchain_core.runnables import Runnable, RunnableConfig
 from langchain_core.runnables.utils import Input, Output
 import asyncio
-from rag_config import get_device
+from rag_config import get_device,rerank_backend
 from sentence_transformers import CrossEncoder
+from typing import Callable, Optional, Union
+from rerank_cache import RerankScoreCache
+from rerank_batcher import RerankBatcher
+from onnx_reranker import OnnxCrossEncoder,model_file_names
 from config.path_config import (
     PROJECT_ROOT, KB_LIST_DIR, KB_DIR, KB_SAVE_PATH_DIR, KB_PARSE_RESULT_DIR,
     PRIVATE_KB_DIR, PRIVATE_KB_VECTOR, DATA_DIR, RAW_DATA_DIR, DOCUMENTS_DIR,
     EVALUATION_DIR, EVALUATION_RESULTS_DIR, TEST_DATASET_PATH,
     VECTOR_STORE_DIR, DB_DIR, BGE_RERANKER_MODEL
 )
+#rerank 分数缓存的容量（query-chunk 对数）和有效期（秒）
+rerank_cache_size = 50_000
+rerank_cache_ttl = 3600
+#跨请求微批：一次前向计算最多的 pair 数、收到第一个请求后最多等待的毫秒数
+rerank_max_batch_size = 64
+rerank_max_wait_ms = 5.0
+#级联 rerank 时第一阶段保留给大模型打分的文档块数
+cascade_first_stage_k = 8
+def load_reranker(model_name_or_path:str,backend:str = 'torch',max_length:int = 512,device:Optional[str] = None):
+    """按后端加载 reranker，返回的对象都有 predict([[query, text], ...])"""
+    if backend in model_file_names:
+        return OnnxCrossEncoder(model_name_or_path,backend=backend,max_length=max_length)
+    if backend != 'torch':
+        raise ValueError(f'不支持的 rerank 后端: {backend}，可选 torch / {" / ".join(model_file_names)}')
+    return CrossEncoder(model_name_or_path=model_name_or_path,max_length=max_length,device=device or get_device())
 class SimpleRerank(Runnable):
-    def __init__(self,model_name_or_path:str,
+    def __init__(self,model_name_or_path:Optional[str] = None,
                  max_length:int =512,
                  base_retriever = None,
                  initial_k:int =10,
-                 final_k :int = 3):
-        self.device = get_device()
-        print(f'已经加载到rerank模型:{model_name_or_path}')
-        self.model = CrossEncoder(
-            model_name_or_path=model_name_or_path,
-            max_length=max_length,
-            device = self.device)
+                 final_k :int = 3,
+                 cache:Optional[RerankScoreCache] = None,
+                 use_cache:bool = True,
+                 kb_version:Union[str,Callable[[],Optional[str]],None] = None,
+                 micro_batch:bool = True,
+                 reranker = None,
+                 backend:Optional[str] = None,
+                 first_stage = None,
+                 first_stage_k:int = cascade_first_stage_k):
+        """
+        cache: (query, chunk) 分数缓存，默认每个 SimpleRerank 一个；多个实例可以传同一个 cache 共享
+        kb_version: 知识库版本（字符串或返回版本的函数），参与缓存 key，换快照后旧分数失效；
+                    默认取 base_retriever.version（HotSwapRetriever 的当前快照名）
+        micro_batch: 并发请求的 pair 合并成一次 predict（见 rerank_batcher.py），关掉时每个请求各自调用模型
+        reranker: 已经加载好的模型（有 predict 方法，如 CrossEncoder），传了就不再加载 model_name_or_path
+        backend: 推理后端 torch / onnx / onnx_int8，默认取 rag_config.rerank_backend
+        first_stage: 级联 rerank 的第一阶段，先把候选池缩小到 first_stage_k 个再交给大模型打分：
+                     'vector' 直接按召回顺序（向量相似度）取前几个，不额外计算；
+                     小 cross-encoder 的模型路径（同一个 backend 加载）或有 predict 方法的模型对象；
+                     None 不做级联，大模型给全部候选打分
+        first_stage_k: 第一阶段保留的文档块数，不能小于 final_k
+        """
+        self.cache = (cache if cache is not None else RerankScoreCache(rerank_cache_size,rerank_cache_ttl)) \
+            if use_cache else None
+        self.kb_version = kb_version
+        if reranker is not None:
+            self.model = reranker
+        else:
+            model_name_or_path = model_name_or_path or BGE_RERANKER_MODEL
+            backend = backend or rerank_backend
+            self.model = load_reranker(model_name_or_path,backend=backend,max_length=max_length)
+            print(f'已经加载到rerank模型:{model_name_or_path}（{backend}）')
         self.base_retriever = base_retriever
         self.final_k = final_k
+        if isinstance(first_stage,str) and first_stage != 'vector':
+            first_stage = load_reranker(first_stage,backend=backend or rerank_backend,max_length=max_length)
+            print('已经加载到第一阶段rerank模型')
+        self.first_stage = first_stage
+        self.first_stage_k = max(first_stage_k,final_k)
+        self.batcher = RerankBatcher(self.model.predict,max_batch_size=rerank_max_batch_size,
+                                     max_wait_ms=rerank_max_wait_ms) if micro_batch else None
+    def _version(self) -> Optional[str]:
+        version = self.kb_version
+        if version is None:
+            version = getattr(self.base_retriever,'version',None)
+        return version() if callable(version) else version
+
+    def _lookup(self,document_list:list,query:str):
+        """返回 (分数, 缓存没命中的下标, 缓存 key)，没命中的位置分数先填 0"""
+        if self.cache is None:
+            return np.zeros(len(document_list),dtype=np.float32),list(range(len(document_list))),None
+        version = self._version()
+        keys = [self.cache.key(query,doc_i,version) for doc_i in document_list]
+        cached = self.cache.get_many(keys)
+        missing = [i for i,key in enumerate(keys) if key not in cached]
+        return np.array([cached.get(key,0.0) for key in keys],dtype=np.float32),missing,keys
+
+    def _fill(self,score:np.ndarray,missing:list,keys,predicted) -> np.ndarray:
+        score[missing] = predicted
+        if keys is not None:
+            self.cache.put_many(zip([keys[i] for i in missing],predicted))
+        return score
+
+    @staticmethod
+    def _pairs(document_list:list,query:str,indices:list) -> list:
+        return [[query,getattr(document_list[i],'page_content',document_list[i])] for i in indices]
+
+    def _scores(self,document_list:list,query:str) -> np.ndarray:
+        """所有 (query, 文档) 的分数，缓存里有的直接取，只把没命中的送进模型"""
+        score,missing,keys = self._lookup(document_list,query)
+        if missing:
+            pairs = self._pairs(document_list,query,missing)
+            predicted = self.batcher.score(pairs) if self.batcher is not None else self.model.predict(pairs)
+            self._fill(score,missing,keys,predicted)
+        return score
+
+    async def _ascores(self,document_list:list,query:str) -> np.ndarray:
+        """_scores 的异步版本：开了微批时等待合并后的批次结果，不占用事件循环"""
+        score,missing,keys = self._lookup(document_list,query)
+        if missing:
+            pairs = self._pairs(document_list,query,missing)
+            if self.batcher is not None:
+                predicted = await self.batcher.ascore(pairs)
+            else:
+                predicted = await asyncio.to_thread(self.model.predict,pairs)
+            self._fill(score,missing,keys,predicted)
+        return score
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats() if self.cache is not None else {}
+
+    def _select(self,document_list:list,score:np.ndarray):
+        score_k = min(self.final_k,len(document_list))
+        #[1 4 2 3 0]就是从低到高来进行排序，这里显示的是下标
+        sort_indices = np.argsort(score)[::-1][:score_k]
+        #print(sort_indices)
+        rerank_docs = [document_list[i]for i in sort_indices]
+        rerank_score = [score[i]for i in sort_indices]
+        return rerank_docs,rerank_score,sort_indices
+
+    def _survivors(self,document_list:list,first_scores = None) -> list:
+        """级联第一阶段保留下来的候选下标；first_scores 是小模型的分数（'vector' 时不需要）"""
+        if self.first_stage is None or len(document_list) <= self.first_stage_k:
+            return list(range(len(document_list)))
+        if first_scores is None:
+            #召回结果本身就是按向量相似度排好序的
+            return list(range(self.first_stage_k))
+        return np.argsort(np.asarray(first_scores))[::-1][:self.first_stage_k].tolist()
+
+    def _needs_first_scores(self,document_list:list) -> bool:
+        return self.first_stage not in (None,'vector') and len(document_list) > self.first_stage_k
+
+    def _cascade_select(self,document_list:list,survivors:list,score:np.ndarray):
+        rerank_docs,rerank_score,sort_indices = self._select([document_list[i] for i in survivors],score)
+        #下标换回在原候选列表里的位置
+        return rerank_docs,rerank_score,[survivors[i] for i in sort_indices]
+
     def _rerank(self,document_list:list[str],query):
         try:
             if not document_list:
                 return [],[],[]
-            result = [[query,getattr(doc_i,'page_content',doc_i) ]for doc_i in  document_list]
-            #print(result)
-            score = self.model.predict(result)
+            first_scores = None
+            if self._needs_first_scores(document_list):
+                first_scores = self.first_stage.predict(self._pairs(document_list,query,range(len(document_list))))
+            survivors = self._survivors(document_list,first_scores)
+            score = self._scores([document_list[i] for i in survivors],query)
             #print(score)
-            score_k = min(self.final_k,len(document_list))
-            #[1 4 2 3 0]就是从低到高来进行排序，这里显示的是下标
-            sort_indices = np.argsort(score)[::-1][:score_k]
-            #print(sort_indices)
-            rerank_docs = [document_list[i]for i in sort_indices]
-            rerank_score = [score[i]for i in sort_indices]
-            return rerank_docs,rerank_score,sort_indices
+            return self._cascade_select(document_list,survivors,score)
+        except Exception as e:
+            print(f'rerank发生错误{e}')
 
+    async def _arerank(self,document_list:list,query:str):
+        try:
+            if not document_list:
+                return [],[],[]
+            first_scores = None
+            if self._needs_first_scores(document_list):
+                first_scores = await asyncio.to_thread(
+                    self.first_stage.predict,self._pairs(document_list,query,range(len(document_list))))
+            survivors = self._survivors(document_list,first_scores)
+            score = await self._ascores([document_list[i] for i in survivors],query)
+            return self._cascade_select(document_list,survivors,score)
         except Exception as e:
             print(f'rerank发生错误{e}')
     def invoke(self,query :str ,config = None,**kwargs):
@@ -70,7 +206,7 @@ class SimpleRerank(Runnable):
             docs = self.base_retriever.invoke(query)
         if not docs:
             return []
-        rerank_docs, rerank_score, sort_indices = await asyncio.to_thread(self._rerank, document_list=docs, query=query)
+        rerank_docs, rerank_score, sort_indices = await self._arerank(docs, query)
         #rerank_docs,rerank_score,sort_indices=self._rerank(docs,query=query)
         for doc, score, indices in zip(rerank_docs, rerank_score, sort_indices):
             #print(f'{indices} {score:.3f} {doc}')
@@ -0,0 +1,29 @@
+"""
+单元测试只用 langchain_core 的假 embedding，不连 API，不需要真实知识库
+
+kb/ 下的模块按脚本的方式互相 import（from chunk_store import ...），config/ 下的 path_config / token_utils 同理，
+这里把这几个目录加到 sys.path
+"""
+import sys
+from pathlib import Path
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+project_root = Path(__file__).parent.parent.absolute()
+for path in (project_root, project_root / 'config', project_root / 'kb', project_root / 'src'):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+
+@pytest.fixture
+def embeddings():
+    return DeterministicFakeEmbedding(size=16)
+
+
+def make_docs(n: int, prefix: str = 'doc', **metadata):
+    """内容各不相同、自带 id 的文档块"""
+    return [Document(page_content=f'{prefix} {i} ' + 'lorem ipsum ' * (i % 5 + 1), id=f'{prefix}_{i}',
+                     metadata={'id': f'{prefix}_{i}', 'file_name': f'{prefix}_{i % 3}.md', **metadata})
+            for i in range(n)]
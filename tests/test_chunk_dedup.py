@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from chunk_dedup import ChunkDeduplicator
+
+text = ' '.join(f'第{i}段 snapshot note number {i}: 先写临时目录再切换 CURRENT' for i in range(30))
+
+
+def doc(doc_id, content, file_name='a.md'):
+    return Document(page_content=content, id=doc_id, metadata={'id': doc_id, 'file_name': file_name})
+
+
+def corpus():
+    return [doc('a', text),
+            doc('b', text, 'b.md'),
+            doc('c', text.replace('note number 7:', 'note no. 7:'), 'c.md'),
+            doc('d', 'a completely different chunk about rate limits and token buckets ' * 4, 'd.md')]
+
+
+def test_drop_mode_skips_duplicates_and_records_ledger():
+    dedup = ChunkDeduplicator(0.8, mode='drop')
+    kept = [d.id for d in dedup.filter(corpus())]
+    assert kept == ['a', 'd']
+    assert dedup.dropped_ids == ['b', 'c']
+    assert dedup.ledger['b'] == ('a', 1.0, 'b.md')
+    canonical, similarity, file_name = dedup.ledger['c']
+    assert canonical == 'a' and 0.8 <= similarity < 1.0 and file_name == 'c.md'
+    assert dedup.stats.exact == 1 and dedup.stats.near == 1 and dedup.stats.tokens_saved > 0
+    assert dedup.dependents(['a']) == {'b.md', 'c.md'}
+
+
+def test_mark_mode_keeps_duplicates():
+    dedup = ChunkDeduplicator(0.8, mode='mark')
+    out = list(dedup.filter(corpus()))
+    assert [d.id for d in out] == ['a', 'b', 'c', 'd']
+    assert out[1].metadata['duplicate_of'] == 'a'
+    assert 'duplicate_of' not in out[3].metadata
+    assert not dedup.ledger and not dedup.dropped_ids
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        ChunkDeduplicator(mode='merge')
+
+
+def test_confirm_forgets_canonicals_that_failed_to_embed():
+    dedup = ChunkDeduplicator(0.8, mode='drop')
+    list(dedup.filter(corpus()))
+    # 'a' 没有 embed 成功：和它重复的 b / c 不算处理成功，a 也不再作为保留块
+    assert dedup.confirm({'d'}) == []
+    assert not dedup.ledger
+    assert dedup.find(text) is None
+    assert dedup.find(corpus()[3].page_content)[0] == 'd'
+
+
+def test_save_and_load_round_trip(tmp_path):
+    dedup = ChunkDeduplicator(0.8, mode='drop')
+    list(dedup.filter(corpus()))
+    dedup.confirm({'a', 'd'})
+    path = tmp_path / 'dedup.npz'
+    dedup.save(path)
+    assert not list(tmp_path.glob('*.tmp'))
+    loaded = ChunkDeduplicator.load(path)
+    assert loaded.ledger == dedup.ledger
+    assert set(loaded._signatures) == {'a', 'd'}
+    assert np.array_equal(loaded._signatures['a'], dedup._signatures['a'])
+    assert loaded.find(text) == ('a', 1.0)
+    # 已经不在向量库里的保留块不再参与比较
+    pruned = ChunkDeduplicator.load(path, live_ids={'d'})
+    assert pruned.find(text) is None
+    out = [d.id for d in pruned.filter([doc('e', text, 'e.md')])]
+    assert out == ['e']
+
+
+def test_forget_removes_signature_and_ledger_entry():
+    dedup = ChunkDeduplicator(0.8, mode='drop')
+    list(dedup.filter(corpus()))
+    dedup.forget(['a', 'b'])
+    assert 'b' not in dedup.ledger and 'c' in dedup.ledger
+    assert dedup.find(text) is None
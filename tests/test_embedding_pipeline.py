@@ -0,0 +1,136 @@
+import math
+import random
+import threading
+import time
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from conftest import make_docs
+from embedding_pipeline import AdaptiveBatcher, EmbeddingPipeline, iter_prefetch
+
+
+class SlowEmbeddings(DeterministicFakeEmbedding):
+    """每个批次随机延迟，后提交的批次可能先完成"""
+
+    def embed_documents(self, texts):
+        time.sleep(random.uniform(0, 0.01))
+        return super().embed_documents(texts)
+
+
+class FlakyEmbeddings(DeterministicFakeEmbedding):
+    """内容带 bad 的文档块总是失败，批次超过 max_texts 条时整批失败（模拟超出 API 单次请求的条数限制）"""
+    max_texts: int = 1000
+    calls: int = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if len(texts) > self.max_texts:
+            raise ValueError('batch too large')
+        if any('bad' in text for text in texts):
+            raise ValueError('bad chunk')
+        return super().embed_documents(texts)
+
+
+def test_pipeline_keeps_input_order_and_stats():
+    docs = make_docs(50)
+    pipeline = EmbeddingPipeline(SlowEmbeddings(size=8), batch_size=4, max_in_flight=3, max_batch_size=4)
+    store, stats = pipeline.run(iter(docs))
+    expected = [doc.id for doc in docs]
+    assert stats.ids == expected
+    assert [store.index_to_docstore_id[i] for i in range(store.index.ntotal)] == expected
+    assert stats.chunks == 50 and stats.failed == 0
+    assert stats.batches == stats.calls == math.ceil(50 / 4)
+    assert stats.tokens > 0 and stats.elapsed > 0
+
+
+def test_pipeline_appends_to_existing_store():
+    embeddings = DeterministicFakeEmbedding(size=8)
+    pipeline = EmbeddingPipeline(embeddings, batch_size=8)
+    store, _ = pipeline.run(make_docs(10, 'a'))
+    store, stats = pipeline.run(make_docs(5, 'b'), vector_store=store)
+    assert stats.ids == [f'b_{i}' for i in range(5)]
+    assert store.index.ntotal == 15
+
+
+def test_concurrent_runs_have_separate_stats():
+    pipeline = EmbeddingPipeline(SlowEmbeddings(size=8), batch_size=2, max_in_flight=2)
+    results = {}
+
+    def run(prefix, n):
+        results[prefix] = pipeline.run(make_docs(n, prefix))[1]
+
+    threads = [threading.Thread(target=run, args=(prefix, n)) for prefix, n in (('a', 7), ('b', 13))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results['a'].chunks == 7 and results['b'].chunks == 13
+    assert results['a'].ids == [f'a_{i}' for i in range(7)]
+
+
+def test_bisection_skips_only_the_bad_chunk():
+    docs = make_docs(8)
+    docs[5].page_content = 'bad chunk'
+    embeddings = FlakyEmbeddings(size=8)
+    store, stats = EmbeddingPipeline(embeddings, batch_size=8, max_batch_size=8).run(docs)
+    assert stats.failed == 1 and stats.chunks == 7
+    assert stats.ids == [doc.id for i, doc in enumerate(docs) if i != 5]
+    # 失败的整批 1 次 + 二分最多 2*log2(8) 次
+    assert stats.calls == embeddings.calls <= 1 + 2 * 3
+
+
+def test_bisection_splits_oversized_batch():
+    docs = make_docs(16)
+    embeddings = FlakyEmbeddings(size=8, max_texts=4)
+    store, stats = EmbeddingPipeline(embeddings, batch_size=16, max_batch_size=16, max_in_flight=1).run(docs)
+    assert stats.failed == 0 and stats.chunks == 16
+    assert stats.ids == [doc.id for doc in docs]
+    # 16 -> 8 -> 4 都成功：1 + 2 + 4 次
+    assert stats.calls == 7
+    assert store.index.ntotal == 16
+
+
+def test_all_failed_returns_given_store():
+    docs = make_docs(3)
+    for doc in docs:
+        doc.page_content = 'bad'
+    store, stats = EmbeddingPipeline(FlakyEmbeddings(size=8), batch_size=3).run(docs)
+    assert store is None
+    assert stats.failed == 3 and stats.chunks == 0
+
+
+def test_adaptive_batcher_respects_token_budget_and_adapts():
+    batcher = AdaptiveBatcher(size=10, max_tokens=30, max_size=16, step=2)
+    docs = make_docs(20)
+    for batch, tokens in batcher.batches(docs):
+        assert len(batch) <= 10
+        assert sum(tokens) <= 30 or len(batch) == 1
+    batcher.record(0.1)
+    assert batcher.size == 12
+    batcher.record(0.1, ok=False)
+    assert batcher.size == 6
+    batcher.record(10.0)
+    assert batcher.size == 4
+
+
+def test_iter_prefetch_reraises_producer_error():
+    def produce():
+        yield 1
+        yield 2
+        raise RuntimeError('loader failed')
+
+    seen = []
+    try:
+        for item in iter_prefetch(produce(), maxsize=1):
+            seen.append(item)
+    except RuntimeError as e:
+        assert str(e) == 'loader failed'
+    else:
+        raise AssertionError('producer error was swallowed')
+    assert seen == [1, 2]
+
+
+def test_default_store_is_faiss():
+    store, _ = EmbeddingPipeline(DeterministicFakeEmbedding(size=8)).run(make_docs(3))
+    assert isinstance(store, FAISS)
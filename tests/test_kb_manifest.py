@@ -0,0 +1,62 @@
+import os
+
+from kb_manifest import KBManifest
+
+
+def write(path, content):
+    path.write_text(content, encoding='utf-8')
+    return path
+
+
+def test_diff_detects_added_changed_removed(tmp_path):
+    docs = tmp_path / 'documents'
+    docs.mkdir()
+    a = write(docs / 'a.md', 'alpha')
+    b = write(docs / 'b.md', 'beta')
+    manifest = KBManifest(tmp_path)
+    added, changed, removed, hashes = manifest.diff([a, b])
+    assert added == [a, b] and not changed and not removed
+    manifest.record(a, ['a_1'], hashes['a.md'])
+    manifest.record(b, ['b_1', 'b_2'], hashes['b.md'])
+    manifest.save()
+
+    manifest = KBManifest(tmp_path)
+    assert manifest.total_chunks() == 3
+    assert manifest.diff([a, b]) == ([], [], [], {})
+    write(b, 'beta v2')
+    c = write(docs / 'c.md', 'gamma')
+    added, changed, removed, hashes = manifest.diff([b, c])
+    assert added == [c] and changed == [b] and removed == ['a.md']
+    assert manifest.chunk_ids(['b.md', 'a.md']) == ['b_1', 'b_2', 'a_1']
+
+
+def test_touch_without_content_change_is_not_a_change(tmp_path):
+    a = write(tmp_path / 'a.md', 'alpha')
+    manifest = KBManifest(tmp_path)
+    manifest.record(a, ['a_1'], manifest.diff([a])[3]['a.md'])
+    stat = a.stat()
+    os.utime(a, (stat.st_atime, stat.st_mtime + 10))
+    added, changed, removed, hashes = manifest.diff([a])
+    assert not (added or changed or removed)
+    # 记下新的修改时间，下次走大小 + 修改时间的快速路径
+    assert manifest.files['a.md']['mtime'] == a.stat().st_mtime
+    assert manifest.diff([a]) == ([], [], [], {})
+
+
+def test_incomplete_file_is_resynced(tmp_path):
+    a = write(tmp_path / 'a.md', 'alpha')
+    manifest = KBManifest(tmp_path)
+    # 上次没处理完（hash 为空），即使内容没变也要重新处理
+    manifest.record(a, ['a_1'], '')
+    added, changed, removed, hashes = manifest.diff([a])
+    assert changed == [a] and 'a.md' in hashes
+    manifest.forget('a.md')
+    assert manifest.diff([a])[0] == [a]
+
+
+def test_save_is_atomic(tmp_path):
+    manifest = KBManifest(tmp_path)
+    manifest.record(write(tmp_path / 'a.md', 'alpha'), [], 'digest')
+    manifest.save()
+    assert KBManifest(tmp_path).files['a.md']['hash'] == 'digest'
+    assert not list(tmp_path.glob('*.tmp'))
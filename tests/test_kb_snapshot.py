@@ -0,0 +1,63 @@
+from functools import partial
+
+import pytest
+
+from conftest import make_docs
+from kb_snapshot import HotSwapRetriever, SnapshotStore, resolve_vector_path
+from kb_vector_store import KBVectorStore
+from test_kb_vector_store import build_store
+
+
+def test_save_swaps_current_and_prunes(embeddings, tmp_path):
+    snapshots = SnapshotStore(tmp_path / 'vector_store', keep=2)
+    assert snapshots.current_path() is None and snapshots.version() is None
+    # 崩溃残留的临时目录在下次保存时清掉
+    (snapshots.snapshot_path / '.tmp_crashed').mkdir(parents=True)
+    names = [snapshots.save(build_store(embeddings, make_docs(n))) for n in (3, 4, 5)]
+    assert len(set(names)) == 3
+    assert snapshots.current_name() == names[-1]
+    assert snapshots.list_snapshots() == names[1:]
+    assert not list(snapshots.snapshot_path.glob('.tmp_*'))
+    assert resolve_vector_path(tmp_path / 'vector_store') == snapshots.snapshot_path / names[-1]
+    assert not (snapshots.vector_path / 'CURRENT.tmp').exists()
+
+
+def test_prune_never_removes_current(embeddings, tmp_path):
+    snapshots = SnapshotStore(tmp_path / 'vector_store', keep=1)
+    first = snapshots.save(build_store(embeddings, make_docs(2)))
+    second = snapshots.save(build_store(embeddings, make_docs(3)))
+    assert snapshots.list_snapshots() == [second]
+    with pytest.raises(ValueError):
+        snapshots.activate(first)
+    snapshots.keep = 3
+    third = snapshots.save(build_store(embeddings, make_docs(4)))
+    snapshots.activate(second)
+    snapshots.keep = 1
+    snapshots.prune()
+    assert snapshots.current_name() == second
+    # 最近的 keep 个快照照常保留，回滚到的旧快照也不会被删
+    assert snapshots.list_snapshots() == [second, third]
+
+
+def test_legacy_layout_resolves_to_vector_dir(embeddings, tmp_path):
+    vector_path = tmp_path / 'vector_store'
+    build_store(embeddings, make_docs(3)).save_local(str(vector_path))
+    assert resolve_vector_path(vector_path) == vector_path
+    assert SnapshotStore(vector_path).version() == 'legacy'
+
+
+def test_hot_swap_retriever_switches_on_new_snapshot(embeddings, tmp_path):
+    snapshots = SnapshotStore(tmp_path / 'vector_store')
+    loader = partial(KBVectorStore.load_local, embeddings=embeddings, allow_dangerous_deserialization=True)
+    retriever = HotSwapRetriever(snapshots, lambda path: loader(str(path)), search_kwargs={'k': 10})
+    with pytest.raises(ValueError):
+        retriever.invoke('doc')
+    snapshots.save(build_store(embeddings, make_docs(2, 'old')))
+    assert retriever.reload()
+    old_store = retriever.vector_store
+    assert {doc.metadata['id'] for doc in retriever.invoke('old 1')} == {'old_0', 'old_1'}
+    assert not retriever.reload()
+    snapshots.save(build_store(embeddings, make_docs(3, 'new')))
+    assert retriever.reload()
+    assert retriever.vector_store is not old_store
+    assert {doc.metadata['id'] for doc in retriever.invoke('new 1')} == {'new_0', 'new_1', 'new_2'}
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from chunk_store import pack_strings, unpack_strings
+from conftest import make_docs
+from kb_vector_store import KBVectorStore
+
+
+def build_store(embeddings, docs, **kwargs):
+    texts = [doc.page_content for doc in docs]
+    return KBVectorStore.from_embeddings(list(zip(texts, embeddings.embed_documents(texts))), embeddings,
+                                         metadatas=[doc.metadata for doc in docs], ids=[doc.id for doc in docs],
+                                         **kwargs)
+
+
+def result_ids(docs):
+    return [doc.metadata['id'] for doc in docs]
+
+
+def test_delete_hides_tombstoned_ids(embeddings):
+    docs = make_docs(30)
+    store = build_store(embeddings, docs)
+    assert store.delete_by_ids(['doc_3', 'doc_4', 'missing']) == 2
+    assert store.live_count == 28 and store.index.ntotal == 30
+    hits = result_ids(store.similarity_search(docs[3].page_content, k=30))
+    assert 'doc_3' not in hits and 'doc_4' not in hits and len(hits) == 28
+    mmr = result_ids(store.max_marginal_relevance_search(docs[3].page_content, k=10, fetch_k=30))
+    assert 'doc_3' not in mmr and 'doc_4' not in mmr
+    # doc_3 已经删过，doc_0.md 剩下 9 个
+    assert store.delete_by_metadata(file_name='doc_0.md') == 9
+    assert all(doc.metadata['file_name'] != 'doc_0.md' for doc in store.similarity_search('doc', k=30))
+
+
+def test_tombstones_survive_save_and_load(embeddings, tmp_path):
+    store = build_store(embeddings, make_docs(10))
+    store.delete_by_ids(['doc_1'])
+    store.save_local(str(tmp_path))
+    loaded = KBVectorStore.load_local(str(tmp_path), embeddings, allow_dangerous_deserialization=True)
+    assert loaded.tombstones == {1}
+    assert 'doc_1' not in result_ids(loaded.similarity_search('doc 1', k=10))
+
+
+def test_compact_removes_tombstones_and_keeps_mapping(embeddings):
+    docs = make_docs(40)
+    store = build_store(embeddings, docs)
+    deleted = {f'doc_{i}' for i in range(0, 40, 3)}
+    store.delete_by_ids(deleted)
+    assert store.compact() == len(deleted)
+    assert store.index.ntotal == store.live_count == 40 - len(deleted)
+    assert not store.tombstones
+    kept = [doc for doc in docs if doc.id not in deleted]
+    # 位置前移后每个文档块仍然能用自己的内容检索到自己
+    assert [store.index_to_docstore_id[i] for i in range(store.index.ntotal)] == [doc.id for doc in kept]
+    for doc in kept[:5]:
+        assert store.similarity_search(doc.page_content, k=1)[0].metadata['id'] == doc.id
+
+
+def test_ivf_store_direct_map_and_compact(embeddings, tmp_path):
+    docs = make_docs(400)
+    store = build_store(embeddings, docs, index_spec={'type': 'ivf_flat', 'nlist': 8, 'rescore': True})
+    assert store.index.direct_map.type != 0
+    store.delete_by_ids([f'doc_{i}' for i in range(50)])
+    assert store.compact() == 50
+    assert store.index.direct_map.type != 0
+    store.save_local(str(tmp_path))
+    for mmap in (False, True):
+        loaded = KBVectorStore.load_local(str(tmp_path), embeddings, mmap=mmap,
+                                          allow_dangerous_deserialization=True)
+        assert loaded.index.direct_map.type != 0
+        assert loaded.index.ntotal == 350
+        assert len(loaded.similarity_search('doc 60', k=3, filter={'file_name': 'doc_0.md'})) == 3
+
+
+def test_chunk_store_round_trip(embeddings, tmp_path):
+    docs = make_docs(20)
+    docs[2].metadata['title'] = '中文标题'
+    store = build_store(embeddings, docs)
+    store.delete_by_ids(['doc_5'])
+    store.docstore_format = 'chunks'
+    store.save_local(str(tmp_path))
+    assert not (tmp_path / 'index.pkl').exists()
+    for mmap in (False, True):
+        loaded = KBVectorStore.load_local(str(tmp_path), embeddings, mmap=mmap)
+        assert loaded.docstore_format == 'chunks'
+        assert loaded.read_only == mmap
+        doc = loaded.docstore.search('doc_2')
+        assert doc.page_content == docs[2].page_content
+        assert doc.metadata == docs[2].metadata
+        hits = loaded.similarity_search(docs[7].page_content, k=20)
+        assert hits[0].metadata['id'] == 'doc_7'
+        assert 'doc_5' not in result_ids(hits)
+    loaded = KBVectorStore.load_local(str(tmp_path), embeddings, mmap=True)
+    with pytest.raises(ValueError):
+        loaded.delete_by_ids(['doc_1'])
+
+
+def test_pack_strings_round_trip():
+    strings = ['', 'ascii', '中文 文件名.md', 'x' * 1000]
+    blob, offsets = pack_strings(strings)
+    assert unpack_strings(blob, offsets) == strings
+    assert blob.dtype == np.uint8
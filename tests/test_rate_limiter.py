@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+# config 包的 __init__ 会初始化模型客户端（rag_config），缺依赖的环境里跳过
+rate_limiter = pytest.importorskip('config.rate_limiter')
+INTERACTIVE, BATCH, RateLimiter = rate_limiter.INTERACTIVE, rate_limiter.BATCH, rate_limiter.RateLimiter
+
+
+@pytest.fixture(params=['local', 'shared'])
+def make_limiter(request, tmp_path):
+    shared_path = str(tmp_path / 'rate_limits.sqlite') if request.param == 'shared' else None
+
+    def make(**kwargs):
+        return RateLimiter('test', shared_path=shared_path, **kwargs)
+    return make
+
+
+def test_request_bucket_throttles(make_limiter):
+    limiter = make_limiter(requests_per_s=20, burst=2)
+    start = time.monotonic()
+    for _ in range(6):
+        limiter.acquire()
+    # 前 2 个是 burst，后 4 个每个等 1/20 秒
+    assert time.monotonic() - start >= 0.15
+
+
+def test_token_bucket_throttles_and_settles(make_limiter):
+    limiter = make_limiter(requests_per_s=1000, tokens_per_min=600)
+    limiter.acquire(600)
+    start = time.monotonic()
+    limiter.acquire(3)
+    # 每秒补 10 个 token
+    assert time.monotonic() - start >= 0.25
+    limiter.settle(-600)
+    start = time.monotonic()
+    limiter.acquire(300)
+    assert time.monotonic() - start < 0.1
+
+
+def test_interactive_requests_go_first(make_limiter):
+    limiter = make_limiter(requests_per_s=10, burst=1)
+    limiter.acquire()
+    order = []
+
+    def worker(name, priority, delay):
+        time.sleep(delay)
+        limiter.acquire(priority=priority)
+        order.append(name)
+
+    threads = [threading.Thread(target=worker, args=('batch', BATCH, 0)),
+               threading.Thread(target=worker, args=('interactive', INTERACTIVE, 0.02))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert order == ['interactive', 'batch']
+    metrics = limiter.metrics()
+    assert metrics['acquired'] == {'interactive': 2, 'batch': 1}
+    assert metrics['queue_depth'] == 0
+
+
+def test_batch_requests_age_into_interactive():
+    limiter = RateLimiter('test', requests_per_s=10, burst=1, aging_s=0.0)
+    limiter.acquire()
+    order = []
+
+    def worker(name, priority, delay):
+        time.sleep(delay)
+        limiter.acquire(priority=priority)
+        order.append(name)
+
+    threads = [threading.Thread(target=worker, args=('batch', BATCH, 0)),
+               threading.Thread(target=worker, args=('interactive', INTERACTIVE, 0.02))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # aging_s=0 时 BATCH 立即按 INTERACTIVE 排队，先到先得
+    assert order == ['batch', 'interactive']
+
+
+def test_concurrency_limit_and_cancellation(make_limiter):
+    limiter = make_limiter(requests_per_s=1000, max_concurrency=2)
+
+    async def main():
+        active, peak = 0, 0
+
+        async def call():
+            nonlocal active, peak
+            async with limiter.alimit():
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.01)
+                active -= 1
+
+        await asyncio.gather(*[call() for _ in range(8)])
+        assert peak <= 2
+        # 名额被占满时等待中的请求被取消，不会留在队列里，也不会占着名额
+        async with limiter.alimit(), limiter.alimit():
+            tasks = [asyncio.ensure_future(limiter.aacquire(_concurrent=True)) for _ in range(5)]
+            await asyncio.sleep(0.05)
+            for task in tasks:
+                task.cancel()
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        assert all(isinstance(result, asyncio.CancelledError) for result in results)
+        await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+    assert limiter.metrics()['queue_depth'] == 0
+    assert limiter.in_flight == 0
+
+
+def test_shared_quota_is_shared_between_limiters(tmp_path):
+    path = str(tmp_path / 'rate_limits.sqlite')
+    first = RateLimiter('embedding', requests_per_s=10, burst=2, shared_path=path)
+    second = RateLimiter('embedding', requests_per_s=10, burst=2, shared_path=path)
+    assert first.metrics()['shared']
+    first.acquire()
+    first.acquire()
+    start = time.monotonic()
+    second.acquire()
+    assert time.monotonic() - start >= 0.05
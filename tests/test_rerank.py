@@ -0,0 +1,128 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from rerank_batcher import RerankBatcher
+from rerank_cache import RerankScoreCache
+
+
+def test_cache_key_normalizes_query_and_identifies_chunks():
+    doc = Document(page_content='text', id='doc-id', metadata={'id': 'meta-id'})
+    assert RerankScoreCache.key('  什么是\tFAISS？ ', doc, 'v1') == ('什么是 FAISS？', 'meta-id', 'v1')
+    assert RerankScoreCache.key('q', Document(page_content='text', id='doc-id'))[1] == 'doc-id'
+    # 没有 id 时按内容 hash，同样内容的字符串和 Document 是同一个 key
+    assert (RerankScoreCache.key('q', 'same text') ==
+            RerankScoreCache.key('q', Document(page_content='same text')))
+    assert RerankScoreCache.key('q', 'same text')[1].startswith('sha1:')
+
+
+def test_cache_version_ttl_and_lru():
+    cache = RerankScoreCache(max_entries=2, ttl=None)
+    k1, k2, k3 = (RerankScoreCache.key('q', f'chunk {i}', 'v1') for i in range(3))
+    cache.put_many([(k1, 0.1), (k2, 0.2)])
+    assert cache.get_many([k1]) == {k1: 0.1}
+    cache.put_many([(k3, 0.3)])
+    # k2 最久没用，被淘汰
+    assert cache.get_many([k1, k2, k3]) == {k1: 0.1, k3: 0.3}
+    # 知识库换了快照，版本不同的 key 不命中
+    assert cache.get_many([RerankScoreCache.key('q', 'chunk 0', 'v2')]) == {}
+    assert cache.hits == 3 and cache.misses == 2
+
+    expiring = RerankScoreCache(ttl=0.01)
+    expiring.put_many([(k1, 1.0)])
+    time.sleep(0.02)
+    assert expiring.get_many([k1]) == {}
+    assert expiring.stats()['entries'] == 0
+
+
+class RecordingModel:
+    """记录每次前向计算的 pair，分数是文本长度"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def predict(self, pairs, batch_size=32):
+        self.started.set()
+        self.release.wait()
+        time.sleep(self.delay)
+        self.calls.append([text for _, text in pairs])
+        return np.array([len(text) for _, text in pairs], dtype=np.float32)
+
+
+def test_batcher_merges_requests_and_splits_scores():
+    model = RecordingModel()
+    batcher = RerankBatcher(model.predict, max_batch_size=64, max_wait_ms=50)
+    try:
+        futures = [batcher.submit([['q', 'x' * (i + j)] for j in range(3)]) for i in range(4)]
+        results = [future.result(timeout=5) for future in futures]
+    finally:
+        batcher.close()
+    for i, scores in enumerate(results):
+        assert scores.tolist() == [i, i + 1, i + 2]
+    assert batcher.requests == 4 and batcher.pairs == 12
+    assert batcher.batches < 4
+    assert batcher.submit([]).result().shape == (0,)
+
+
+def test_batcher_skips_cancelled_requests():
+    model = RecordingModel()
+    model.release.clear()
+    batcher = RerankBatcher(model.predict, max_batch_size=2, max_wait_ms=1)
+    try:
+        # 第一个请求卡在模型里，后面排队的请求在开始计算前被取消
+        first = batcher.submit([['q', 'first'], ['q', 'first']])
+        assert model.started.wait(5)
+        cancelled = batcher.submit([['q', 'cancelled']])
+        assert cancelled.cancel()
+        kept = batcher.submit([['q', 'kept']])
+        model.release.set()
+        assert first.result(timeout=5).tolist() == [5, 5]
+        assert kept.result(timeout=5).tolist() == [4]
+    finally:
+        batcher.close()
+    assert ['cancelled'] not in model.calls
+    assert all('cancelled' not in call for call in model.calls)
+
+
+def test_batcher_cancellation_from_asyncio():
+    model = RecordingModel()
+    model.release.clear()
+    batcher = RerankBatcher(model.predict, max_batch_size=1, max_wait_ms=1)
+
+    async def main():
+        blocker = asyncio.ensure_future(batcher.ascore([['q', 'blocker']]))
+        await asyncio.to_thread(model.started.wait, 5)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(batcher.ascore([['q', 'timed out']]), timeout=0.01)
+        model.release.set()
+        return await blocker, await batcher.ascore([['q', 'after']])
+
+    try:
+        blocker, after = asyncio.run(main())
+    finally:
+        batcher.close()
+    assert blocker.tolist() == [7] and after.tolist() == [5]
+    assert all('timed out' not in call for call in model.calls)
+
+
+def test_batcher_survives_model_errors():
+    def predict(pairs, batch_size=32):
+        if any(text == 'boom' for _, text in pairs):
+            raise RuntimeError('model failed')
+        return np.ones(len(pairs), dtype=np.float32)
+
+    batcher = RerankBatcher(predict, max_batch_size=1, max_wait_ms=1)
+    try:
+        with pytest.raises(RuntimeError):
+            batcher.score([['q', 'boom']])
+        assert batcher.score([['q', 'fine']]).tolist() == [1.0]
+    finally:
+        batcher.close()